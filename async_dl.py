@@ -0,0 +1,753 @@
+"""asyncio download backend.
+
+Lists, signs and streams files of a tile and year on a single event loop instead of
+one blocking request at a time, so one process can keep hundreds of sign calls and
+downloads in flight. `dl_file_list` and `dl_years_for_tile` take the same arguments
+as their counterparts in `starcloud_dl` plus the concurrency limits.
+
+Needs aiohttp (`uv sync --extra async`), which is only imported once a download starts.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO
+
+import profiling
+from bandwidth import Throttle
+from disk_space import DiskSpaceGuard, InsufficientDiskSpace, is_out_of_space, part_path
+from retry_queue import (
+    ERROR_AUTH,
+    ERROR_PERMANENT,
+    ERROR_TRANSIENT,
+    FailedFile,
+    RetryPolicy,
+    classify_error,
+)
+from sc_login import AuthData
+from signed_url_cache import SignedLink, SignedUrlCache
+from staging import StagingArea
+from starcloud_dl import (
+    DEFAULT_CHUNK_SIZE,
+    FILE_PAGE_URL,
+    LINK_GEN_URL,
+    ApiRequestError,
+    ListSplitChoose,
+    _fileListPayload,
+    _isInArchive,
+    _signedUrlCacheKey,
+    _signPayload,
+    _objectKey,
+)
+from transfer_stats import (
+    IN_FLIGHT,
+    RunningTransfer,
+    append_transfer_stat,
+    current_concurrency,
+    make_transfer_stat,
+)
+
+if TYPE_CHECKING:
+    import aiohttp
+
+    from events import EventSink
+    from file_claims import FileClaim, FileClaims
+    from hedging import Hedger
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+DEFAULT_CONCURRENCY: int = 32
+DEFAULT_PER_HOST_LIMIT: int = 16
+
+# how often a running download checks whether the caller set its cancel event
+CANCEL_POLL_S: float = 0.5
+
+
+def _aiohttp() -> Any:
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise RuntimeError(
+            "The async backend needs aiohttp! Install it with 'uv sync --extra async'."
+        ) from e
+    return aiohttp
+
+
+def _classify_error(e: BaseException) -> str:
+    # aiohttp connection errors and timeouts derive from OSError, which `classify_error`
+    # treats as permanent (e.g. a full disk)
+    if not isinstance(e, ApiRequestError) and (
+        isinstance(e, TimeoutError) or isinstance(e, _aiohttp().ClientError)
+    ):
+        return ERROR_TRANSIENT
+    return classify_error(e)
+
+
+def network_errors() -> tuple[type[BaseException], ...]:
+    """Errors of the backend's HTTP client that are not raised as `ApiRequestError`."""
+    try:
+        import aiohttp
+    except ImportError:
+        return (TimeoutError,)
+    return (aiohttp.ClientError, TimeoutError)
+
+
+def _session(concurrency: int, per_host_limit: int) -> "aiohttp.ClientSession":
+    aiohttp = _aiohttp()
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host_limit),
+        # no total timeout, large files may take a while, but stalled reads must end
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300),
+    )
+
+
+async def _postJSON(
+    session: "aiohttp.ClientSession",
+    url: str,
+    payload: dict[str, Any],
+    headers: dict[str, str] | None = None,
+    what: str = "request",
+) -> Any:
+    async with session.post(url, json=payload, headers=headers) as response:
+        if response.status != 200:
+            raise ApiRequestError(
+                f"Could not fetch {what}! Code: {response.status}, Reason: {await response.text()}",
+                status_code=response.status,
+            )
+        return await response.json(content_type=None)
+
+
+async def get_file_entries_for_id(
+    session: "aiohttp.ClientSession",
+    tile_id: str,
+    year: int,
+    list_split_chooser: ListSplitChoose | None = None,
+) -> list[dict[str, int | str]]:
+    """Retrieves the file list (name and size) of a tile and year."""
+    t_start: float = time.perf_counter()
+    resp_json = await _postJSON(
+        session,
+        url=FILE_PAGE_URL,
+        payload=_fileListPayload(tileName=tile_id, year=year),
+        what="FileList Page",
+    )
+    profiling.add_phase_time("list", time.perf_counter() - t_start)
+
+    list_of_file_dicts: list[dict[str, int | str]] = resp_json["response"]
+    if list_split_chooser is not None:
+        list_of_file_dicts = list_split_chooser.get_sublist(seq=list_of_file_dicts)
+    return list_of_file_dicts
+
+
+async def _getSignedFileLink(
+    session: "aiohttp.ClientSession",
+    filename: str,
+    tileName: str,
+    year: int,
+    auth: AuthData,
+    url_cache: SignedUrlCache | None = None,
+) -> tuple[str, str, int]:
+    cacheKey: str = _signedUrlCacheKey(
+        filename=filename, tileName=tileName, year=year, auth=auth
+    )
+    if url_cache is not None:
+        # the cache may read its file under a lock, keep that off the event loop
+        cached: SignedLink | None = await asyncio.to_thread(url_cache.get, cacheKey)
+        if cached is not None:
+            logger.debug(f"Reusing cached signed URL for {filename}")
+            return (cached.file_name, cached.signed_url, cached.file_size)
+
+    t_start: float = time.perf_counter()
+    responseBody = await _postJSON(
+        session,
+        url=LINK_GEN_URL,
+        payload=_signPayload(
+            objectKey=_objectKey(filename=filename, tileName=tileName, year=year),
+            auth=auth,
+        ),
+        headers={"Authorization": f"Bearer {auth.token}"},
+        what="signed file URL",
+    )
+    profiling.add_phase_time("sign", time.perf_counter() - t_start)
+
+    signedLink: tuple[str, str, int] = (
+        str(responseBody["fileName"]),
+        str(responseBody["signedUrl"]),
+        int(responseBody["fileSize"]),
+    )
+    if url_cache is not None:
+        _ = await asyncio.to_thread(
+            url_cache.put,
+            cacheKey,
+            file_name=signedLink[0],
+            signed_url=signedLink[1],
+            file_size=signedLink[2],
+        )
+    return signedLink
+
+
+def _write_chunk(f: BinaryIO, chunk: bytes, checksum: "hashlib._Hash | None") -> None:
+    _ = f.write(chunk)
+    if checksum is not None:
+        # hashlib releases the GIL for large buffers, so hashing stays off the event loop
+        checksum.update(chunk)
+
+
+async def _downloadTIFFile(
+    session: "aiohttp.ClientSession",
+    url: str,
+    outDir: Path,
+    filename: str,
+    chunkSize: int = DEFAULT_CHUNK_SIZE,
+    throttle: Throttle | None = None,
+    expectedSize: int | None = None,
+    diskGuard: DiskSpaceGuard | None = None,
+    checksum: "hashlib._Hash | None" = None,
+    progress: RunningTransfer | None = None,
+) -> int:
+    """Streams the file behind `url` to `outDir / filename` and returns the number of bytes written.
+    File writes run in the default executor. Like the threaded backend the file is written as
+    '<filename>.part' and removed if the download fails or is cancelled.
+    `checksum` is updated with every written chunk, `progress` counts the written bytes.
+    """
+    downloaded: int = 0
+    transferTime: float = 0.0
+    writeTime: float = 0.0
+    outFile: Path = outDir / filename
+    partFile: Path = part_path(outFile)
+    reserved: int = 0
+    tConnect: float = time.perf_counter()
+
+    async with session.get(url) as response:
+        profiling.add_phase_time("connect", time.perf_counter() - tConnect)
+        if response.status != 200:
+            raise ApiRequestError(
+                f"Could not download {filename}! Code: {response.status}",
+                status_code=response.status,
+            )
+
+        if expectedSize is None:
+            expectedSize = response.content_length or 0
+
+        f: BinaryIO = await asyncio.to_thread(open, partFile, "wb")
+        try:
+            if diskGuard is not None:
+                reserved = await asyncio.to_thread(
+                    diskGuard.allocate, f, directory=outDir, n_bytes=expectedSize
+                )
+            tChunkRequested: float = time.perf_counter()
+            async for chunk in response.content.iter_chunked(chunkSize):
+                tChunkReceived: float = time.perf_counter()
+                transferTime += tChunkReceived - tChunkRequested
+                if throttle is not None:
+                    # wait on the loop, blocking in the executor would hold up the file writes
+                    await asyncio.sleep(throttle.reserve(len(chunk)))
+                await asyncio.to_thread(_write_chunk, f, chunk, checksum)
+                downloaded += len(chunk)
+                if progress is not None:
+                    progress.bytes = downloaded
+                tChunkRequested = time.perf_counter()
+                writeTime += tChunkRequested - tChunkReceived
+            _ = await asyncio.to_thread(f.truncate, downloaded)
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, partFile, outFile)
+        except BaseException as e:
+            # also on cancellation, so do not await here
+            f.close()
+            partFile.unlink(missing_ok=True)
+            if is_out_of_space(e):
+                # a full file system or quota does not clear up on retry, stop like the guard would
+                raise InsufficientDiskSpace.for_failed_write(outDir, expectedSize, e) from e
+            raise
+        finally:
+            if diskGuard is not None:
+                diskGuard.release(outDir, reserved)
+
+    profiling.add_phase_time("transfer", transferTime)
+    profiling.add_phase_time("write", writeTime)
+    return downloaded
+
+
+async def dl_file_by_id(
+    session: "aiohttp.ClientSession",
+    tile_id: str,
+    year: int,
+    target_dir: Path,
+    auth: AuthData,
+    filename: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    log_time: bool = False,
+    stats_file: Path | None = None,
+    staging: StagingArea | None = None,
+    url_cache: SignedUrlCache | None = None,
+    throttle: Throttle | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
+) -> None:
+    t_file_start: float = time.perf_counter()
+    requestedFilename: str = filename
+    t_got_file_link: float = t_file_start
+    downloaded: int = 0
+    checksum: "hashlib._Hash | None" = hashlib.sha256() if events is not None else None
+    claim: FileClaim | None = (
+        await asyncio.to_thread(claims.claim, target_dir, filename)
+        if claims is not None
+        else None
+    )
+    transfer: RunningTransfer = IN_FLIGHT.start()
+
+    try:
+        (filename, signedURL, fileSize) = await _getSignedFileLink(
+            session,
+            filename=filename,
+            tileName=tile_id,
+            year=year,
+            auth=auth,
+            url_cache=url_cache,
+        )
+        t_got_file_link = time.perf_counter()
+
+        if claim is not None and await asyncio.to_thread(
+            _isInArchive, target_dir / filename, fileSize
+        ):
+            # completed by another process since the file list was made
+            logger.info(f"Skipping {filename}, it was downloaded by another process")
+            return
+
+        if staging is not None and disk_guard is not None:
+            # the staged file also has to fit into the archive once it is committed
+            await asyncio.to_thread(disk_guard.check, target_dir, fileSize)
+
+        downloaded = await _downloadTIFFile(
+            session,
+            url=signedURL,
+            outDir=staging.staging_dir if staging is not None else target_dir,
+            filename=filename,
+            chunkSize=chunk_size,
+            throttle=throttle,
+            expectedSize=fileSize,
+            diskGuard=disk_guard,
+            checksum=checksum,
+            progress=transfer,
+        )
+
+        if staging is not None:
+            # the staging area releases the claim once the file is in the archive
+            await asyncio.to_thread(
+                staging.stage,
+                filename=filename,
+                expected_size=fileSize,
+                sha256=checksum.hexdigest() if checksum is not None else None,
+                claim=claim,
+            )
+            claim = None
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        if url_cache is not None and isinstance(e, ApiRequestError):
+            # the object store rejected the (possibly cached) URL, sign again next time
+            await asyncio.to_thread(
+                url_cache.invalidate,
+                _signedUrlCacheKey(
+                    filename=requestedFilename, tileName=tile_id, year=year, auth=auth
+                ),
+            )
+        if stats_file is not None:
+            await asyncio.to_thread(
+                append_transfer_stat,
+                stats_file,
+                make_transfer_stat(
+                    tile=tile_id,
+                    year=year,
+                    filename=filename,
+                    # the bytes that arrived before the transfer failed
+                    n_bytes=transfer.bytes,
+                    sign_s=t_got_file_link - t_file_start,
+                    download_s=time.perf_counter() - t_got_file_link,
+                    status="error",
+                    error=type(e).__name__,
+                    concurrency=current_concurrency(transfer.peak),
+                ),
+            )
+        raise
+    finally:
+        IN_FLIGHT.finish(transfer)
+        if claim is not None:
+            # also on cancellation, so do not await here
+            claim.release()
+
+    t_downloaded: float = time.perf_counter()
+    if events is not None and checksum is not None and staging is None:
+        from events import CompletionEvent
+
+        await asyncio.to_thread(
+            events.publish,
+            CompletionEvent.for_file(
+                target_dir / filename,
+                tile=tile_id,
+                year=year,
+                size=downloaded,
+                sha256=checksum.hexdigest(),
+            ),
+        )
+    if stats_file is not None:
+        await asyncio.to_thread(
+            append_transfer_stat,
+            stats_file,
+            make_transfer_stat(
+                tile=tile_id,
+                year=year,
+                filename=filename,
+                n_bytes=downloaded,
+                sign_s=t_got_file_link - t_file_start,
+                download_s=t_downloaded - t_got_file_link,
+                concurrency=current_concurrency(transfer.peak),
+            ),
+        )
+
+    if log_time:
+        logger.info(
+            msg=f"Perf FileLink,Download: {(t_got_file_link - t_file_start):.2f}, {(t_downloaded - t_got_file_link):.2f} s"
+        )
+    logger.info(msg=f"Successfully downloaded {filename}!")
+
+
+class _SharedAuth:
+    """Login shared by all downloads of a run. Only the first task hitting an auth error logs in again."""
+
+    def __init__(self, auth: AuthData, relogin: Callable[[], AuthData] | None) -> None:
+        self.auth: AuthData = auth
+        self._relogin: Callable[[], AuthData] | None = relogin
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    @property
+    def can_relogin(self) -> bool:
+        return self._relogin is not None
+
+    async def renew(self, stale: AuthData) -> None:
+        assert self._relogin is not None
+        async with self._lock:
+            if self.auth is stale:
+                self.auth = await asyncio.to_thread(self._relogin)
+
+
+async def _watch_cancel(cancel_event: threading.Event, tasks: list[asyncio.Task[None]]) -> None:
+    while not cancel_event.is_set():
+        await asyncio.sleep(CANCEL_POLL_S)
+    for task in tasks:
+        _ = task.cancel()
+
+
+async def dl_file_list_async(
+    session: "aiohttp.ClientSession",
+    tile_id: str,
+    year: int,
+    target_dir: Path,
+    auth: AuthData,
+    filename_list: list[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    log_time: bool = False,
+    stats_file: Path | None = None,
+    staging: StagingArea | None = None,
+    url_cache: SignedUrlCache | None = None,
+    retry_policy: RetryPolicy | None = None,
+    relogin: Callable[[], AuthData] | None = None,
+    throttle: Throttle | None = None,
+    cancel_event: threading.Event | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
+) -> list[FailedFile]:
+    """Downloads a list of files with at most `concurrency` files in flight. See `dl_file_list`."""
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+    shared_auth = _SharedAuth(auth=auth, relogin=relogin)
+    failures: list[FailedFile] = []
+    out_of_space: list[InsufficientDiskSpace] = []
+
+    def _give_up(f: str, attempts: int, error_class: str, e: Exception) -> None:
+        failures.append(
+            FailedFile(
+                tile=tile_id,
+                year=year,
+                filename=f,
+                attempts=attempts,
+                error_class=error_class,
+                error=str(e),
+            )
+        )
+
+    # files claimed by another process are skipped, nothing is claimed without `claims`
+    claimed: tuple[type[Exception], ...] = ()
+    if claims is not None:
+        from file_claims import FileClaimed
+
+        claimed = (FileClaimed,)
+
+    async def _fetch(f: str) -> None:
+        attempts: int = 0
+        while True:
+            current_auth: AuthData = shared_auth.auth
+            try:
+                async with semaphore:
+                    if out_of_space:
+                        # no new files are started once one did not fit
+                        _give_up(f, attempts, ERROR_PERMANENT, out_of_space[0])
+                        return
+                    await dl_file_by_id(
+                        session,
+                        tile_id=tile_id,
+                        year=year,
+                        target_dir=target_dir,
+                        auth=current_auth,
+                        filename=f,
+                        chunk_size=chunk_size,
+                        log_time=log_time,
+                        stats_file=stats_file,
+                        staging=staging,
+                        url_cache=url_cache,
+                        throttle=throttle,
+                        disk_guard=disk_guard,
+                        events=events,
+                        claims=claims,
+                    )
+                return
+            except claimed as e:
+                logger.info(f"Skipping {f}: {str(e)}")
+                return
+            except Exception as e:
+                if retry_policy is None:
+                    raise
+                attempts += 1
+                if isinstance(e, InsufficientDiskSpace):
+                    if not out_of_space:
+                        logger.error(f"Stopping downloads of {tile_id} in {year}. Reason: {str(e)}")
+                    out_of_space.append(e)
+                    _give_up(f, attempts, ERROR_PERMANENT, e)
+                    return
+                error_class: str = _classify_error(e)
+                can_retry: bool = attempts < retry_policy.max_attempts
+
+                if error_class == ERROR_AUTH and shared_auth.can_relogin and can_retry:
+                    logger.warning(f"Auth error for {f}, logging in again. Reason: {str(e)}")
+                    try:
+                        await shared_auth.renew(stale=current_auth)
+                        continue
+                    except Exception as login_error:
+                        # a failed login counts as another failed attempt of the file
+                        e = login_error
+                        attempts += 1
+                        error_class = _classify_error(e)
+                        can_retry = attempts < retry_policy.max_attempts
+
+                if error_class != ERROR_PERMANENT and can_retry:
+                    delay: float = retry_policy.backoff(attempts)
+                    logger.warning(
+                        f"Attempt {attempts} for {f} failed ({error_class}), retrying in {delay:.1f} s. Reason: {str(e)}"
+                    )
+                    # waiting does not hold a download slot
+                    await asyncio.sleep(delay)
+                else:
+                    logger.error(
+                        f"Giving up on {f} after {attempts} attempts ({error_class}). Reason: {str(e)}"
+                    )
+                    _give_up(f, attempts, error_class, e)
+                    return
+
+    tasks: list[asyncio.Task[None]] = [asyncio.create_task(_fetch(f)) for f in filename_list]
+    watcher: asyncio.Task[None] | None = (
+        asyncio.create_task(_watch_cancel(cancel_event, tasks))
+        if cancel_event is not None
+        else None
+    )
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        if watcher is not None:
+            _ = watcher.cancel()
+
+    cancelled: int = sum(isinstance(r, asyncio.CancelledError) for r in results)
+    if cancelled:
+        logger.info(f"Cancelled, {cancelled} files of {tile_id} in {year} are left")
+    for r in results:
+        # without a retry policy the first error is raised like in the threaded backend
+        if isinstance(r, Exception):
+            raise r
+    return failures
+
+
+def dl_file_list(
+    tile_id: str,
+    year: int,
+    target_dir: Path,
+    auth: AuthData,
+    filename_list: list[str],
+    show_live_progress: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    log_time: bool = False,
+    stats_file: Path | None = None,
+    staging: StagingArea | None = None,
+    url_cache: SignedUrlCache | None = None,
+    hedger: "Hedger | None" = None,
+    retry_policy: RetryPolicy | None = None,
+    relogin: Callable[[], AuthData] | None = None,
+    throttle: Throttle | None = None,
+    cancel_event: threading.Event | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+) -> list[FailedFile]:
+    """Drop-in for `starcloud_dl.dl_file_list` running the downloads concurrently on an event loop.
+
+    Live progress is not shown with concurrent downloads and requests are not hedged,
+    `show_live_progress` and `hedger` are accepted for compatibility only.
+    """
+    _warn_unsupported(show_live_progress=show_live_progress, hedger=hedger)
+
+    async def _run() -> list[FailedFile]:
+        async with _session(concurrency, per_host_limit) as session:
+            return await dl_file_list_async(
+                session,
+                tile_id=tile_id,
+                year=year,
+                target_dir=target_dir,
+                auth=auth,
+                filename_list=filename_list,
+                concurrency=concurrency,
+                chunk_size=chunk_size,
+                log_time=log_time,
+                stats_file=stats_file,
+                staging=staging,
+                url_cache=url_cache,
+                retry_policy=retry_policy,
+                relogin=relogin,
+                throttle=throttle,
+                cancel_event=cancel_event,
+                disk_guard=disk_guard,
+                events=events,
+                claims=claims,
+            )
+
+    return asyncio.run(_run())
+
+
+def dl_years_for_tile(
+    tile_id: str,
+    years: list[int],
+    root_dir: Path,
+    auth: AuthData,
+    dl_index: dict[str, int] | None = None,
+    show_live_progress: bool = True,
+    log_time: bool = True,
+    chunkSize: int = DEFAULT_CHUNK_SIZE,
+    list_split_chooser: ListSplitChoose | None = None,
+    stats_file: Path | None = None,
+    staging_root: Path | None = None,
+    url_cache: SignedUrlCache | None = None,
+    hedger: "Hedger | None" = None,
+    retry_policy: RetryPolicy | None = None,
+    relogin: Callable[[], AuthData] | None = None,
+    throttle: Throttle | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+) -> list[FailedFile]:
+    """Drop-in for `starcloud_dl.dl_years_for_tile`. The file lists of all years are fetched
+    concurrently, the years are then downloaded one after another on the same connections.
+    """
+    _warn_unsupported(show_live_progress=show_live_progress, hedger=hedger)
+
+    async def _run() -> list[FailedFile]:
+        failures: list[FailedFile] = []
+        async with _session(concurrency, per_host_limit) as session:
+            t_start: float = time.perf_counter()
+            entries_per_year: list[list[dict[str, int | str]]] = await asyncio.gather(
+                *(
+                    get_file_entries_for_id(
+                        session,
+                        tile_id=tile_id,
+                        year=year,
+                        list_split_chooser=list_split_chooser,
+                    )
+                    for year in years
+                )
+            )
+            if log_time:
+                logger.info(msg=f"Perf File List: {(time.perf_counter() - t_start):.2f} s")
+
+            for year, entries in zip(years, entries_per_year):
+                target_dir: Path = root_dir / str(year) / tile_id
+                target_dir.mkdir(exist_ok=True, parents=True)
+
+                staging: StagingArea | None = None
+                if staging_root is not None:
+                    staging = StagingArea(
+                        staging_root=staging_root,
+                        archive_root=root_dir,
+                        tile_id=tile_id,
+                        year=year,
+                        events=events,
+                    )
+                    staging.open()
+                    if dl_index is not None:
+                        dl_index.update({f.filename: f.size for f in staging.recovered})
+
+                filenameList: list[str] = [
+                    str(entry["file"])
+                    for entry in entries
+                    if dl_index is None
+                    or dl_index.get(str(entry["file"]), -10) != entry["size"]
+                ]
+                if len(filenameList) == 0:
+                    logger.info(f"No files left for {tile_id} in {year} {list_split_chooser}.")
+                    if staging is not None:
+                        staging.close()
+                    continue
+                logger.info(
+                    msg=f"Found {len(filenameList)} files for {tile_id} in year {year}! Starting download..."
+                )
+
+                try:
+                    failures += await dl_file_list_async(
+                        session,
+                        tile_id=tile_id,
+                        year=year,
+                        target_dir=target_dir,
+                        auth=auth,
+                        filename_list=filenameList,
+                        concurrency=concurrency,
+                        chunk_size=chunkSize,
+                        log_time=log_time,
+                        stats_file=stats_file,
+                        staging=staging,
+                        url_cache=url_cache,
+                        retry_policy=retry_policy,
+                        relogin=relogin,
+                        throttle=throttle,
+                        disk_guard=disk_guard,
+                        events=events,
+                        claims=claims,
+                    )
+                finally:
+                    if staging is not None:
+                        staging.close()
+        return failures
+
+    return asyncio.run(_run())
+
+
+def _warn_unsupported(show_live_progress: bool, hedger: "Hedger | None") -> None:
+    if show_live_progress:
+        logger.debug("Live progress is not shown by the async backend")
+    if hedger is not None:
+        logger.warning("The async backend does not hedge requests, ignoring the hedger")
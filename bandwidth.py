@@ -0,0 +1,124 @@
+import fcntl
+import getpass
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Protocol
+
+MB: int = 1024 * 1024
+
+# tokens and monotonic time of the last refill, CLOCK_MONOTONIC is shared by all processes of a node
+_STATE_FORMAT: str = "dd"
+_STATE_SIZE: int = struct.calcsize(_STATE_FORMAT)
+
+
+class Throttle(Protocol):
+    def consume(self, n_bytes: int) -> None:
+        """Blocks until `n_bytes` may be transferred."""
+        ...
+
+    def reserve(self, n_bytes: int) -> float:
+        """Takes `n_bytes` from the budget without blocking and returns the seconds to wait
+        before transferring them, for callers that must not block (e.g. an event loop).
+        """
+        ...
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the bytes per second of all downloads sharing it.
+
+    Consumers may overdraw the bucket and then wait until the debt is paid off, so large
+    chunks are admitted and waiting consumers are served roughly in arrival order.
+    """
+
+    def __init__(self, rate_bytes_per_s: float, burst_bytes: float | None = None) -> None:
+        if rate_bytes_per_s <= 0:
+            raise ValueError("Bandwidth rate must be positive!")
+        self.rate: float = rate_bytes_per_s
+        self.burst: float = burst_bytes if burst_bytes is not None else rate_bytes_per_s
+        self._tokens: float = self.burst
+        self._last: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    def consume(self, n_bytes: int) -> None:
+        """Blocks until `n_bytes` may be transferred."""
+        wait_s: float = self.reserve(n_bytes)
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+    def reserve(self, n_bytes: int) -> float:
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n_bytes
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class NodeTokenBucket:
+    """Token bucket shared by all processes of a node through a small state file.
+
+    Every consumer draws from the same bucket under an exclusive file lock, so the
+    configured rate holds for the whole node. As with `TokenBucket` consumers wait off
+    their debt in arrival order, so concurrent downloads get about the same share.
+    All processes should use the same rate, the state file is best put on a tmpfs.
+    """
+
+    def __init__(
+        self,
+        rate_bytes_per_s: float,
+        state_file: Path | None = None,
+        burst_bytes: float | None = None,
+    ) -> None:
+        if rate_bytes_per_s <= 0:
+            raise ValueError("Bandwidth rate must be positive!")
+        self.rate: float = rate_bytes_per_s
+        self.burst: float = burst_bytes if burst_bytes is not None else rate_bytes_per_s
+        self.state_file: Path = state_file or default_node_state_file()
+        self._fd: int = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o600)
+        # flock does not exclude threads sharing the file descriptor
+        self._lock: threading.Lock = threading.Lock()
+
+    def consume(self, n_bytes: int) -> None:
+        """Blocks until `n_bytes` may be transferred."""
+        wait_s: float = self.reserve(n_bytes)
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+    def reserve(self, n_bytes: int) -> float:
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now: float = time.monotonic()
+                raw: bytes = os.pread(self._fd, _STATE_SIZE, 0)
+                if len(raw) == _STATE_SIZE:
+                    tokens, last = struct.unpack(_STATE_FORMAT, raw)
+                    tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+                else:
+                    tokens = self.burst
+                tokens -= n_bytes
+                _ = os.pwrite(self._fd, struct.pack(_STATE_FORMAT, tokens, now), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return -tokens / self.rate if tokens < 0 else 0.0
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def default_node_state_file() -> Path:
+    base: Path = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+    return base / f"starcloud_bw_{getpass.getuser()}"
+
+
+def node_throttle_from_env() -> NodeTokenBucket | None:
+    """Node-wide bandwidth cap of S_NODE_MAX_MBPS MB/s, shared through S_NODE_BW_FILE. None if unset."""
+    if not os.getenv("S_NODE_MAX_MBPS"):
+        return None
+    return NodeTokenBucket(
+        rate_bytes_per_s=float(os.environ["S_NODE_MAX_MBPS"]) * MB,
+        state_file=Path(os.environ["S_NODE_BW_FILE"]) if os.getenv("S_NODE_BW_FILE") else None,
+    )
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Guards the start-up time of the Slurm array task entry path.
+
+Every array task starts a fresh interpreter for `slurm_main.py`, so heavy imports
+(polars, pandas, pyarrow, pycryptodome, aiohttp) and the modules of optional features
+must stay off that path. This script imports the entry module in a fresh interpreter and
+fails if one of them gets loaded. It also reports the median cumulative import time measured
+with `-X importtime`, which is dominated by `requests` and varies between machines, so a
+time budget is only checked if one is given.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR: Path = Path(__file__).parent
+
+ENTRY_MODULE: str = "slurm_main"
+
+FORBIDDEN_MODULES: list[str] = [
+    "polars",
+    "pandas",
+    "pyarrow",
+    "numpy",
+    "Crypto",
+    "aiohttp",
+    "dotenv",
+    # only imported when the feature is enabled
+    "async_dl",
+    "cProfile",
+    "tracemalloc",
+    "ctypes",
+    "events",
+    "file_claims",
+    "file_index",
+    "hedging",
+    "http_trace",
+]
+
+
+def measure_import_us(module: str) -> int:
+    """Cumulative import time of `module` in microseconds, measured in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    raise RuntimeError(f"Could not find import time of '{module}' in -X importtime output")
+
+
+def loaded_modules(module: str) -> set[str]:
+    """Top level packages that are loaded after importing `module`."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))",
+        ],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {m.split(".")[0] for m in json.loads(result.stdout)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    _ = parser.add_argument("--module", default=ENTRY_MODULE, type=str)
+    _ = parser.add_argument("--runs", default=7, type=int)
+    _ = parser.add_argument(
+        "--budget-ms",
+        default=None,
+        type=float,
+        help="Maximum allowed median import time, not checked by default",
+    )
+    args = parser.parse_args()
+
+    forbidden = sorted(loaded_modules(args.module) & set(FORBIDDEN_MODULES))
+
+    timings_ms: list[float] = [
+        measure_import_us(args.module) / 1000 for _ in range(args.runs)
+    ]
+    median_ms = statistics.median(timings_ms)
+
+    print(
+        f"import {args.module}: median {median_ms:.1f} ms, min {min(timings_ms):.1f} ms, max {max(timings_ms):.1f} ms ({args.runs} runs)"
+    )
+
+    failed = False
+    if forbidden:
+        print(f"FAIL: '{args.module}' loads modules that must stay off its import path: {', '.join(forbidden)}")
+        failed = True
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f"FAIL: median import time exceeds budget of {args.budget_ms:.1f} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
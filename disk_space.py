@@ -0,0 +1,189 @@
+import errno
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+
+if TYPE_CHECKING:
+    import ctypes
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+PART_SUFFIX: str = ".part"
+
+GB: int = 1024 * 1024 * 1024
+
+
+# a write refused by the file system or by the user/project quota
+_OUT_OF_SPACE_ERRNOS: tuple[int, ...] = (errno.ENOSPC, errno.EDQUOT)
+
+# the quota command is run for every admission, its output is not trusted for longer
+QUOTA_CMD_TIMEOUT_S: float = 30.0
+
+
+class InsufficientDiskSpace(OSError):
+    """A download was not admitted because it would leave less than the minimum free space,
+    or a write failed because the file system or the quota is full.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        needed: int,
+        free: int,
+        min_free: int,
+        reason: str | None = None,
+        err: int = errno.ENOSPC,
+    ) -> None:
+        self.needed: int = needed
+        self.free: int = free
+        self.min_free: int = min_free
+        super().__init__(
+            err,
+            reason
+            or f"Not enough space for {needed} bytes in {path}: {free} bytes free, {min_free} bytes must stay free",
+        )
+
+    @classmethod
+    def for_failed_write(cls, path: Path, needed: int, error: OSError) -> "InsufficientDiskSpace":
+        return cls(
+            path=path,
+            needed=needed,
+            free=0,
+            min_free=0,
+            reason=f"Writing {needed} bytes to {path} failed: {error.strerror}",
+            err=error.errno or errno.ENOSPC,
+        )
+
+
+def is_out_of_space(error: BaseException) -> bool:
+    """Whether `error` is a write refused for lack of space or quota (and not yet reported as such)."""
+    return (
+        isinstance(error, OSError)
+        and not isinstance(error, InsufficientDiskSpace)
+        and error.errno in _OUT_OF_SPACE_ERRNOS
+    )
+
+
+_libc: "ctypes.CDLL | None" = None
+
+
+def _fallocate(fd: int, n_bytes: int) -> None:
+    """Allocates `n_bytes` for `fd` with fallocate(2).
+
+    Unlike `os.posix_fallocate`, which glibc emulates by writing every block on file systems
+    without native support (NFS, some Lustre/GPFS setups), this fails with EOPNOTSUPP there.
+    ctypes is only imported when preallocating.
+    """
+    import ctypes
+    import ctypes.util
+
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(_libc, "fallocate"):
+        raise OSError(errno.ENOSYS, "fallocate is not available")
+    if _libc.fallocate(fd, 0, ctypes.c_longlong(0), ctypes.c_longlong(n_bytes)) != 0:
+        err: int = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def part_path(path: Path) -> Path:
+    """Path a download is written to until it is complete."""
+    return path.with_name(path.name + PART_SUFFIX)
+
+
+class DiskSpaceGuard:
+    """Admits downloads only while they fit on the file system with `min_free_bytes` to spare.
+
+    The size of an admitted file is reserved in this process until the download ends.
+    With `preallocate` the file instead gets its full size allocated right away, so later
+    admissions of other processes see it as well. Where the file system has no native
+    preallocation the reservation is used.
+
+    The free space of the file system says nothing about a user or project quota. With
+    `quota_cmd` the free space is also limited by the bytes left in the quota, which the
+    shell command prints (its first number), '{path}' in it is replaced by the directory.
+    """
+
+    def __init__(
+        self, min_free_bytes: int = 0, preallocate: bool = False, quota_cmd: str | None = None
+    ) -> None:
+        self.min_free_bytes: int = min_free_bytes
+        self.preallocate: bool = preallocate
+        self.quota_cmd: str | None = quota_cmd
+        self._reserved: dict[int, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def check(self, directory: Path, n_bytes: int) -> None:
+        """Raises `InsufficientDiskSpace` if `n_bytes` more would not fit into `directory`."""
+        with self._lock:
+            self._check(directory, n_bytes)
+
+    def allocate(self, f: BinaryIO, directory: Path, n_bytes: int) -> int:
+        """Admits a download of `n_bytes` into the open file `f` and reserves or preallocates it.
+        Returns the number of bytes reserved in this process, to be passed to `release`.
+        """
+        with self._lock:
+            self._check(directory, n_bytes)
+            if n_bytes <= 0:
+                return 0
+            if self.preallocate:
+                try:
+                    _fallocate(f.fileno(), n_bytes)
+                    return 0
+                except OSError as e:
+                    if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                        raise
+                logger.debug(f"Preallocation not supported in {directory}, reserving {n_bytes} bytes")
+            dev: int = os.stat(directory).st_dev
+            self._reserved[dev] = self._reserved.get(dev, 0) + n_bytes
+            return n_bytes
+
+    def release(self, directory: Path, n_bytes: int) -> None:
+        if n_bytes <= 0:
+            return
+        with self._lock:
+            dev: int = os.stat(directory).st_dev
+            self._reserved[dev] = max(0, self._reserved.get(dev, 0) - n_bytes)
+
+    def _check(self, directory: Path, n_bytes: int) -> None:
+        free: int = shutil.disk_usage(directory).free
+        if self.quota_cmd is not None:
+            quota_free: int | None = quota_free_bytes(self.quota_cmd, directory)
+            if quota_free is not None:
+                free = min(free, quota_free)
+        free -= self._reserved.get(os.stat(directory).st_dev, 0)
+        if free - n_bytes < self.min_free_bytes:
+            raise InsufficientDiskSpace(
+                path=directory, needed=n_bytes, free=free, min_free=self.min_free_bytes
+            )
+
+
+def quota_free_bytes(quota_cmd: str, directory: Path) -> int | None:
+    """Bytes left in the quota as printed by `quota_cmd`, None if the command failed."""
+    import shlex
+    import subprocess
+
+    cmd: str = quota_cmd.replace("{path}", shlex.quote(str(directory)))
+    try:
+        result = subprocess.run(
+            cmd, shell=True, capture_output=True, text=True, timeout=QUOTA_CMD_TIMEOUT_S, check=True
+        )
+        return int(float(result.stdout.split()[0]))
+    except (subprocess.SubprocessError, OSError, ValueError, IndexError) as e:
+        logger.warning(f"Quota command '{cmd}' failed, using the free space of the file system: {str(e)}")
+        return None
+
+
+def guard_from_env() -> DiskSpaceGuard:
+    """Guard with the minimum free space given by S_MIN_FREE_GB (default 0, i.e. the file must fit),
+    preallocating if S_PREALLOCATE is set and checking the quota with S_QUOTA_CMD.
+    """
+    return DiskSpaceGuard(
+        min_free_bytes=int(float(os.getenv("S_MIN_FREE_GB", "0")) * GB),
+        preallocate=bool(os.getenv("S_PREALLOCATE")),
+        quota_cmd=os.getenv("S_QUOTA_CMD"),
+    )
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""Throughput and completeness report over the accumulated transfer telemetry and validation history.
+
+All inputs are scanned lazily with polars, so the report also works on large logs.
+"""
+
+import argparse
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+
+MB: int = 1024 * 1024
+
+PERCENTILES: list[float] = [0.5, 0.9, 0.95, 0.99]
+
+# the columns of transfer_stats.TransferStat
+STATS_SCHEMA: dict[str, pl.DataType] = {
+    "timestamp": pl.Float64(),
+    "host": pl.String(),
+    "job_id": pl.String(),
+    "concurrency": pl.Int64(),
+    "tile": pl.String(),
+    "year": pl.Int64(),
+    "filename": pl.String(),
+    "bytes": pl.Int64(),
+    "sign_s": pl.Float64(),
+    "download_s": pl.Float64(),
+    "status": pl.String(),
+    "error": pl.String(),
+}
+
+SECTIONS: list[str] = ["throughput", "latency", "errors", "completeness"]
+
+
+def scan_transfer_stats(stats_files: list[Path]) -> pl.LazyFrame:
+    """Lazily scans transfer stats CSVs written by the downloaders and adds the start `hour` of every transfer.
+    Rows are written when a transfer ends, its start is the `timestamp` minus `sign_s` and `download_s`.
+    """
+    return (
+        # read as text first, files written before the header was locked may repeat it
+        pl.scan_csv(
+            [str(f) for f in stats_files], schema={c: pl.String() for c in STATS_SCHEMA}
+        )
+        .filter(pl.col("timestamp") != "timestamp")
+        .cast(STATS_SCHEMA)
+        .with_columns(
+            pl.from_epoch(
+                pl.col("timestamp")
+                - pl.col("sign_s").fill_null(0.0)
+                - pl.col("download_s").fill_null(0.0),
+                time_unit="s",
+            )
+            .dt.truncate("1h")
+            .cast(pl.Datetime("us"))
+            .alias("hour")
+        )
+    )
+
+
+def scan_legacy_sign_stats(csv_file: Path) -> pl.LazyFrame:
+    """Scans an old '<name>_<n>_concurrent.csv' file of sign and download times in the transfer stats layout.
+    Only `sign_s`, `download_s` and the concurrency taken from the file name are known.
+    """
+    match = re.search(r"(\d+)_concurrent", csv_file.name)
+    concurrency: int | None = int(match.group(1)) if match else None
+    return (
+        pl.scan_csv(
+            csv_file, new_columns=["sign_s", "download_s"], infer_schema=False
+        )
+        .select(
+            pl.lit(None, dtype=pl.Float64).alias("timestamp"),
+            pl.lit(csv_file.stem).alias("host"),
+            pl.lit("legacy").alias("job_id"),
+            pl.lit(concurrency, dtype=pl.Int64).alias("concurrency"),
+            pl.lit(None, dtype=pl.String).alias("tile"),
+            pl.lit(None, dtype=pl.Int64).alias("year"),
+            pl.lit(None, dtype=pl.String).alias("filename"),
+            pl.lit(None, dtype=pl.Int64).alias("bytes"),
+            pl.col("sign_s").str.strip_chars().cast(pl.Float64),
+            pl.col("download_s").str.strip_chars().cast(pl.Float64),
+            pl.lit("ok").alias("status"),
+            pl.lit("").alias("error"),
+            pl.lit(None, dtype=pl.Datetime("us")).alias("hour"),
+        )
+    )
+
+
+def throughput(stats: pl.LazyFrame, by: list[str]) -> pl.LazyFrame:
+    """Successful transfers grouped by `by`.
+
+    `mbps_per_stream` is the average speed of a single download, `mbps_total` the bytes moved
+    over the wall time between the first and last transfer of the group.
+    """
+    return (
+        stats.filter((pl.col("status") == "ok") & (pl.col("bytes") > 0))
+        .group_by(by)
+        .agg(
+            pl.len().alias("files"),
+            pl.col("bytes").sum().alias("bytes"),
+            (pl.col("bytes").sum() / pl.col("download_s").sum() / MB).alias("mbps_per_stream"),
+            (
+                pl.col("bytes").sum()
+                / (
+                    pl.col("timestamp").max()
+                    - (pl.col("timestamp") - pl.col("sign_s") - pl.col("download_s")).min()
+                )
+                / MB
+            ).alias("mbps_total"),
+        )
+        .sort(by)
+    )
+
+
+def latency_percentiles(
+    stats: pl.LazyFrame, by: list[str] | None = None, percentiles: list[float] = PERCENTILES
+) -> pl.LazyFrame:
+    """Percentiles of the sign and the transfer time of successful downloads, one row per phase."""
+    by = by or []
+    return (
+        stats.filter(pl.col("status") == "ok")
+        .unpivot(
+            on=["sign_s", "download_s"],
+            index=by,
+            variable_name="phase",
+            value_name="seconds",
+        )
+        .group_by([*by, "phase"])
+        .agg(
+            pl.len().alias("samples"),
+            *[
+                pl.col("seconds").quantile(p).alias(f"p{round(p * 100)}")
+                for p in percentiles
+            ],
+            pl.col("seconds").max().alias("max"),
+        )
+        .sort([*by, "phase"])
+    )
+
+
+def error_rates(stats: pl.LazyFrame, by: list[str]) -> pl.LazyFrame:
+    """Share of failed attempts and the most frequent error type grouped by `by`."""
+    return (
+        stats.group_by(by)
+        .agg(
+            pl.len().alias("attempts"),
+            (pl.col("status") != "ok").sum().alias("errors"),
+            pl.col("error")
+            .filter(pl.col("status") != "ok")
+            .mode()
+            .first()
+            .alias("top_error"),
+        )
+        .with_columns((pl.col("errors") / pl.col("attempts")).alias("error_rate"))
+        .sort(by)
+    )
+
+
+def build_report(
+    stats: pl.LazyFrame | None, history: pl.LazyFrame | None, sections: list[str]
+) -> dict[str, pl.LazyFrame]:
+    """All report tables by name. Nothing is computed until the frames are collected."""
+    from validate_starcloud_dl import progress_per_tile_over_time
+
+    tables: dict[str, pl.LazyFrame] = {}
+    if stats is not None:
+        if "throughput" in sections:
+            tables["throughput_per_host"] = throughput(stats, by=["host"])
+            tables["throughput_per_concurrency"] = throughput(stats, by=["concurrency"])
+            tables["throughput_per_hour"] = throughput(stats, by=["hour"])
+        if "latency" in sections:
+            tables["latency_percentiles"] = latency_percentiles(stats)
+            tables["latency_percentiles_per_concurrency"] = latency_percentiles(
+                stats, by=["concurrency"]
+            )
+        if "errors" in sections:
+            tables["error_rates_per_host"] = error_rates(stats, by=["host"])
+            tables["error_rates_per_concurrency"] = error_rates(stats, by=["concurrency"])
+    if history is not None and "completeness" in sections:
+        tables["completeness_per_tile"] = progress_per_tile_over_time(history)
+    return tables
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Reports throughput, latency percentiles, error rates and the completeness trend per tile.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    _ = parser.add_argument(
+        "--stats-file",
+        type=str,
+        nargs="*",
+        default=[os.environ["S_STATS_FILE"]] if os.getenv("S_STATS_FILE") else [],
+        help="Transfer stats CSVs written by the downloaders, defaults to S_STATS_FILE",
+    )
+    _ = parser.add_argument(
+        "--legacy-stats",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Old '<name>_<n>_concurrent.csv' files of sign and download times",
+    )
+    _ = parser.add_argument(
+        "--history-dir",
+        type=str,
+        default=None,
+        help="Completeness history written by validate_starcloud_dl.py (default ./completeness_reports/history)",
+    )
+    _ = parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        default=None,
+        help="Only include transfers and validation runs from this time on (ISO format, e.g. 2026-01-31)",
+    )
+    _ = parser.add_argument(
+        "--only",
+        choices=SECTIONS,
+        nargs="+",
+        default=SECTIONS,
+        help="Report sections",
+    )
+    _ = parser.add_argument(
+        "--out-dir",
+        type=str,
+        default=None,
+        help="Additionally write every table as CSV to this directory",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from validate_starcloud_dl import COMPLETENESS_HISTORY_DIR, scan_completeness_history
+
+    args = parse_args()
+
+    scans: list[pl.LazyFrame] = []
+    if args.stats_file:
+        scans.append(scan_transfer_stats([Path(f) for f in args.stats_file]))
+    scans += [scan_legacy_sign_stats(Path(f)) for f in args.legacy_stats]
+    stats: pl.LazyFrame | None = pl.concat(scans, how="vertical_relaxed") if scans else None
+
+    history_dir: Path = Path(args.history_dir) if args.history_dir else COMPLETENESS_HISTORY_DIR
+    history: pl.LazyFrame | None = (
+        scan_completeness_history(history_dir) if history_dir.is_dir() else None
+    )
+
+    if args.since is not None:
+        since: datetime = args.since
+        if stats is not None:
+            stats = stats.filter(
+                pl.col("timestamp").is_null() | (pl.col("timestamp") >= since.timestamp())
+            )
+        if history is not None:
+            history = history.filter(pl.col("checked_at") >= since)
+
+    if stats is None and history is None:
+        print("Nothing to report! Pass --stats-file/--legacy-stats or validate the archive first.")
+        raise SystemExit(1)
+
+    tables: dict[str, pl.LazyFrame] = build_report(stats, history, sections=args.only)
+    # all tables share the scans, collect them in one pass
+    collected: list[pl.DataFrame] = pl.collect_all(list(tables.values()))
+
+    out_dir: Path | None = Path(args.out_dir) if args.out_dir else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    with pl.Config(tbl_rows=100, tbl_cols=20, tbl_width_chars=200):
+        for name, df in zip(tables, collected):
+            print(f"\n## {name}")
+            print(df)
+            if out_dir is not None:
+                df.write_csv(out_dir / f"{name}.csv")
+
+    if out_dir is not None:
+        print(f"\nWrote {len(tables)} tables to {out_dir}")
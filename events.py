@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""Completion events announcing every file that landed in the archive.
+
+Downloaders publish one event per file once it has its final name (after the staging commit
+when staging is used) to the sink given by S_EVENT_SINK:
+
+    jsonl:<file>   append-only JSON lines spool, followed by consumers with a cursor
+    fifo:<path>    named pipe of a running consumer
+    unix:<path>    stream socket a running consumer listens on
+
+A plain path is a JSON lines spool. Only the spool is durable, events for a pipe or socket
+without a reader are dropped, so consumers that must not miss files should follow a spool:
+
+    python3 events.py follow ./events.jsonl --cursor ./events.cursor
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Protocol
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+HASH_CHUNK_SIZE: int = 16 * 1024 * 1024
+
+
+@dataclass
+class CompletionEvent:
+    path: str
+    tile: str
+    year: int
+    size: int
+    sha256: str
+    completed_at: float
+    host: str
+
+    @classmethod
+    def for_file(cls, path: Path, tile: str, year: int, size: int, sha256: str) -> "CompletionEvent":
+        return cls(
+            path=str(path.absolute()),
+            tile=tile,
+            year=year,
+            size=size,
+            sha256=sha256,
+            completed_at=time.time(),
+            host=socket.gethostname(),
+        )
+
+    def to_line(self) -> bytes:
+        return (json.dumps(asdict(self)) + "\n").encode("utf-8")
+
+
+def file_sha256(path: Path) -> str:
+    """Checksum of a file that was not hashed while it was downloaded."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EventSink(Protocol):
+    def publish(self, event: CompletionEvent) -> None:
+        """Delivers `event`. Never raises on delivery problems of non-durable sinks."""
+        ...
+
+    def close(self) -> None:
+        """Releases the connection or descriptor of the sink."""
+        ...
+
+
+class JsonlSpool:
+    """Appends events to a JSON lines file, shared by all processes writing to it."""
+
+    def __init__(self, spool_file: Path) -> None:
+        self.spool_file: Path = spool_file
+        self.spool_file.parent.mkdir(parents=True, exist_ok=True)
+
+    def publish(self, event: CompletionEvent) -> None:
+        # a single write on an O_APPEND descriptor, lines of concurrent writers do not interleave
+        fd = os.open(self.spool_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            _ = os.write(fd, event.to_line())
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        # the spool is opened per event, nothing stays open
+        pass
+
+
+class FifoSink:
+    """Writes events to a named pipe. Without a reader on the pipe events are dropped."""
+
+    def __init__(self, fifo: Path) -> None:
+        self.fifo: Path = fifo
+        self._fd: int | None = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def publish(self, event: CompletionEvent) -> None:
+        with self._lock:
+            try:
+                if self._fd is None:
+                    # non-blocking open fails with ENXIO instead of waiting for a reader
+                    self._fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+                    os.set_blocking(self._fd, True)
+                _ = os.write(self._fd, event.to_line())
+            except OSError as e:
+                logger.warning(f"Dropped completion event for {event.path}, no reader on {self.fifo}: {str(e)}")
+                self._close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class UnixSocketSink:
+    """Sends events over a unix stream socket, reconnecting once per event if the connection broke."""
+
+    def __init__(self, socket_path: Path, timeout_s: float = 5.0) -> None:
+        self.socket_path: Path = socket_path
+        self.timeout_s: float = timeout_s
+        self._sock: socket.socket | None = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def publish(self, event: CompletionEvent) -> None:
+        with self._lock:
+            error: OSError | None = None
+            for _ in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self._sock.settimeout(self.timeout_s)
+                        self._sock.connect(str(self.socket_path))
+                    self._sock.sendall(event.to_line())
+                    return
+                except OSError as e:
+                    self._close()
+                    error = e
+            logger.warning(
+                f"Dropped completion event for {event.path}, could not send to {self.socket_path}: {str(error)}"
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def sink_from_spec(spec: str) -> EventSink:
+    """Sink for 'jsonl:<file>', 'fifo:<path>', 'unix:<path>' or a plain spool file path."""
+    kind, sep, target = spec.partition(":")
+    if not sep:
+        return JsonlSpool(Path(spec))
+    if kind == "jsonl":
+        return JsonlSpool(Path(target))
+    if kind == "fifo":
+        return FifoSink(Path(target))
+    if kind == "unix":
+        return UnixSocketSink(Path(target))
+    raise ValueError(f"Unknown event sink '{spec}'! Use jsonl:, fifo: or unix:")
+
+
+def sink_from_env() -> EventSink | None:
+    """Sink given by S_EVENT_SINK, None if unset."""
+    spec: str | None = os.getenv("S_EVENT_SINK")
+    return sink_from_spec(spec) if spec else None
+
+
+def _read_cursor(cursor_file: Path | None) -> int:
+    if cursor_file is None or not cursor_file.exists():
+        return 0
+    return int(cursor_file.read_text().strip() or 0)
+
+
+def _write_cursor(cursor_file: Path, offset: int) -> None:
+    tmp_file: Path = cursor_file.with_name(cursor_file.name + ".tmp")
+    _ = tmp_file.write_text(str(offset))
+    os.replace(tmp_file, cursor_file)
+
+
+def follow(
+    spool_file: Path,
+    cursor_file: Path | None = None,
+    poll_s: float = 1.0,
+    stop_at_end: bool = False,
+) -> Iterator[CompletionEvent]:
+    """Yields the events of a spool, waiting for new ones unless `stop_at_end`.
+
+    With `cursor_file` the position after the last event is stored once the next event is
+    requested, so a restarted consumer continues after the last event it processed.
+    An event whose processing was interrupted is delivered again.
+    """
+    offset: int = _read_cursor(cursor_file)
+    f: BinaryIO | None = None
+    try:
+        while True:
+            if f is None and spool_file.exists():
+                f = open(spool_file, "rb")
+                _ = f.seek(offset)
+
+            line: bytes = f.readline() if f is not None else b""
+            if not line.endswith(b"\n"):
+                # nothing new or a line still being written, read it again next time
+                if f is not None:
+                    _ = f.seek(offset)
+                if stop_at_end:
+                    return
+                time.sleep(poll_s)
+                continue
+
+            offset += len(line)
+            try:
+                event = CompletionEvent(**json.loads(line))  # pyright: ignore[reportAny]
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Skipping malformed event at offset {offset - len(line)}: {str(e)}")
+                continue
+            yield event
+            if cursor_file is not None:
+                _write_cursor(cursor_file, offset)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Follows the completion event spool and prints one JSON line per downloaded file."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_follow = sub.add_parser("follow", help="Print new events of a spool as they arrive")
+    _ = p_follow.add_argument("spool_file", type=str, help="JSON lines spool written with S_EVENT_SINK=jsonl:<file>")
+    _ = p_follow.add_argument(
+        "--cursor",
+        type=str,
+        default=None,
+        help="File storing the position after the last printed event, a restart continues from there",
+    )
+    _ = p_follow.add_argument("--poll", type=float, default=1.0, help="Seconds between checks for new events")
+    _ = p_follow.add_argument(
+        "--once", action="store_true", help="Exit at the end of the spool instead of waiting"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    try:
+        for event in follow(
+            Path(args.spool_file),
+            cursor_file=Path(args.cursor) if args.cursor else None,
+            poll_s=args.poll,
+            stop_at_end=args.once,
+        ):
+            print(json.dumps(asdict(event)), flush=True)
+    except KeyboardInterrupt:
+        pass
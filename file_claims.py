@@ -0,0 +1,158 @@
+import errno
+import json
+import logging
+import os
+import socket
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from types import TracebackType
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+CLAIM_SUFFIX: str = ".claim"
+
+# claims of other hosts can only be judged by their age
+DEFAULT_STALE_AFTER_S: float = 6 * 3600
+
+
+@dataclass
+class ClaimOwner:
+    pid: int
+    host: str
+    started: float
+
+
+class FileClaimed(RuntimeError):
+    """The file is being downloaded by another process."""
+
+    def __init__(self, path: Path, owner: ClaimOwner | None) -> None:
+        self.path: Path = path
+        self.owner: ClaimOwner | None = owner
+        by: str = f"pid {owner.pid} on {owner.host}" if owner is not None else "another process"
+        super().__init__(f"{path.name} is being downloaded by {by}")
+
+
+def claim_path(path: Path) -> Path:
+    """Sidecar file claiming the download of `path`."""
+    return path.with_name(path.name + CLAIM_SUFFIX)
+
+
+class FileClaim:
+    """A claim held by this process, removed by `release`."""
+
+    def __init__(self, path: Path, owner: ClaimOwner) -> None:
+        self.path: Path = path
+        self.owner: ClaimOwner = owner
+
+    def __enter__(self) -> "FileClaim":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
+
+    def release(self) -> None:
+        # only remove the claim if it still is ours, it may have been broken as stale
+        if _read_owner(self.path) == self.owner:
+            self.path.unlink(missing_ok=True)
+
+
+class FileClaims:
+    """Advisory per-file claims shared by all processes downloading into the same archive.
+
+    A claim is a '<file>.claim' sidecar next to the final file, created with O_EXCL so that
+    exactly one process gets it, also across nodes on a shared file system. It names the pid,
+    host and start time of its owner. A claim is stale and taken over if its owner is no longer
+    running on this host, or if it is older than `stale_after_s`.
+    """
+
+    def __init__(self, stale_after_s: float = DEFAULT_STALE_AFTER_S) -> None:
+        self.stale_after_s: float = stale_after_s
+        self.host: str = socket.gethostname()
+
+    def claim(self, directory: Path, filename: str) -> FileClaim:
+        """Claims `directory / filename`, raises `FileClaimed` if another process holds it."""
+        path: Path = claim_path(directory / filename)
+        owner = ClaimOwner(pid=os.getpid(), host=self.host, started=time.time())
+
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                current: ClaimOwner | None = _read_owner(path)
+                if not self._is_stale(path, current):
+                    raise FileClaimed(directory / filename, current)
+                self._break(path, current)
+                continue
+            try:
+                _ = os.write(fd, json.dumps(asdict(owner)).encode("utf-8"))
+            finally:
+                os.close(fd)
+            return FileClaim(path, owner)
+
+        raise FileClaimed(directory / filename, _read_owner(path))
+
+    def _is_stale(self, path: Path, owner: ClaimOwner | None) -> bool:
+        if owner is None:
+            # unreadable or still being written, judge it by the age of the file
+            try:
+                started: float = path.stat().st_mtime
+            except FileNotFoundError:
+                return True
+        else:
+            if owner.host == self.host and not _is_running(owner.pid):
+                return True
+            started = owner.started
+        return time.time() - started > self.stale_after_s
+
+    def _break(self, path: Path, stale: ClaimOwner | None) -> None:
+        # move the claim aside first, so that of several processes finding it stale only one removes it
+        aside: Path = path.with_name(f"{path.name}.stale.{self.host}.{os.getpid()}")
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return
+        if _read_owner(aside) != stale:
+            # another process broke the stale claim and claimed the file in between, give it back
+            try:
+                os.link(aside, path)
+            except FileExistsError:
+                pass
+        else:
+            logger.warning(f"Taking over stale claim {path} of {stale}")
+        aside.unlink(missing_ok=True)
+
+
+def _read_owner(path: Path) -> ClaimOwner | None:
+    try:
+        return ClaimOwner(**json.loads(path.read_text()))  # pyright: ignore[reportAny]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError as e:
+        # EPERM: running, but owned by another user
+        return e.errno == errno.EPERM
+    return True
+
+
+def claims_from_env(default: bool = False) -> FileClaims | None:
+    """Claims with the stale age given by S_CLAIM_STALE_H if S_FILE_CLAIMS is '1', None if it is '0'.
+    Without S_FILE_CLAIMS `default` decides, claims are only worth their cost when processes overlap.
+    """
+    enabled: str | None = os.getenv("S_FILE_CLAIMS")
+    if enabled == "0" or (not enabled and not default):
+        return None
+    return FileClaims(
+        stale_after_s=float(os.getenv("S_CLAIM_STALE_H", str(DEFAULT_STALE_AFTER_S / 3600))) * 3600
+    )
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""Compact, memory-mappable index of the downloaded files of the whole archive.
+
+The index stores the name and size of every '<root>/<year>/<tile>/*.tif' in flat arrays,
+sorted by tile, year and name. Tiles and years are stored once per group instead of per
+file. Opening an index maps the file read-only, so any number of processes share one copy
+of it in the page cache, and lookups are binary searches on the mapped arrays.
+
+File layout (little endian):
+    header:  magic, number of files, number of groups, length of the tile names, length of the file names
+    tiles:   tile names separated by '\\n', padded to 8 bytes
+    groups:  per (tile, year): tile code (u32), year (u32), first file (u64), end (u64)
+    offsets: start of every file name in the names blob (u64, one more than files)
+    sizes:   file sizes (u64)
+    names:   utf-8 file names
+"""
+
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections.abc import Iterator, Mapping
+from functools import lru_cache
+from pathlib import Path
+from typing import TypeVar, overload
+
+MAGIC: bytes = b"SCFIDX01"
+_HEADER = struct.Struct("<8sQQQQ")
+_GROUP = struct.Struct("<IIQQ")
+
+T = TypeVar("T")
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) // 8 * 8
+
+
+class TileYearIndex(Mapping[str, int]):
+    """Read-only mapping of the file names of one tile and year to their sizes,
+    usable in place of the `dict` returned by `indexAlreadyDownloadedFiles`.
+    """
+
+    def __init__(self, index: "FileIndex", start: int, end: int) -> None:
+        self._index: FileIndex = index
+        self._start: int = start
+        self._end: int = end
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._start, self._end):
+            yield self._index.name_at(i)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self._find(name) is not None
+
+    def __getitem__(self, name: str) -> int:
+        i: int | None = self._find(name)
+        if i is None:
+            raise KeyError(name)
+        return self._index.sizes[i]
+
+    @overload
+    def get(self, name: str, /) -> int | None: ...
+    @overload
+    def get(self, name: str, default: int, /) -> int: ...
+    @overload
+    def get(self, name: str, default: T, /) -> int | T: ...
+    def get(self, name: str, default: int | T | None = None, /) -> int | T | None:
+        i: int | None = self._find(name)
+        return self._index.sizes[i] if i is not None else default
+
+    @property
+    def built_ns(self) -> int:
+        """Modification time of the index file."""
+        return self._index.built_ns
+
+    def total_bytes(self) -> int:
+        return sum(self._index.sizes[self._start : self._end])
+
+    def _find(self, name: str) -> int | None:
+        key: bytes = name.encode("utf-8")
+        i: int = bisect.bisect_left(
+            range(self._start, self._end), key, key=self._index.name_bytes_at
+        ) + self._start
+        if i < self._end and self._index.name_bytes_at(i) == key:
+            return i
+        return None
+
+
+class FileIndex:
+    """A memory-mapped index file, see the module docstring."""
+
+    def __init__(self, index_file: Path) -> None:
+        self.index_file: Path = index_file
+        with open(index_file, "rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.built_ns: int = os.fstat(f.fileno()).st_mtime_ns
+        buf = memoryview(self._mmap)
+
+        magic, n_files, n_groups, tiles_len, names_len = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_file} is not a file index!")
+        pos: int = _HEADER.size
+
+        self.tiles: list[str] = bytes(buf[pos : pos + tiles_len]).decode("utf-8").split("\n")
+        pos += _pad8(tiles_len)
+
+        self._groups: dict[tuple[str, int], tuple[int, int]] = {}
+        for _ in range(n_groups):
+            tile_code, year, start, end = _GROUP.unpack_from(buf, pos)
+            self._groups[(self.tiles[tile_code], year)] = (start, end)
+            pos += _GROUP.size
+
+        self._offsets: memoryview = buf[pos : pos + 8 * (n_files + 1)].cast("Q")
+        pos += 8 * (n_files + 1)
+        self.sizes: memoryview = buf[pos : pos + 8 * n_files].cast("Q")
+        pos += 8 * n_files
+        self._names: memoryview = buf[pos : pos + names_len]
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def tile_years(self) -> list[tuple[str, int]]:
+        return sorted(self._groups)
+
+    def tile_year(self, tile_id: str, year: int) -> TileYearIndex:
+        """The files of one tile and year, empty if none were indexed."""
+        start, end = self._groups.get((tile_id, year), (0, 0))
+        return TileYearIndex(self, start, end)
+
+    def name_bytes_at(self, i: int) -> bytes:
+        return bytes(self._names[self._offsets[i] : self._offsets[i + 1]])
+
+    def name_at(self, i: int) -> str:
+        return self.name_bytes_at(i).decode("utf-8")
+
+    def close(self) -> None:
+        self._offsets.release()
+        self.sizes.release()
+        self._names.release()
+        self._mmap.close()
+
+
+def build_file_index(
+    root_dir: Path,
+    index_file: Path,
+    years: list[int] | None = None,
+    tiles: list[str] | None = None,
+) -> FileIndex:
+    """Scans '<root_dir>/<year>/<tile>/*.tif' and writes the index to `index_file`.
+    `years` and `tiles` restrict the scan, the tiles and years of an existing index outside of
+    them are kept, so rescanning a few years does not drop the others. The file is replaced atomically.
+    """
+    scanned: dict[tuple[str, int], list[tuple[bytes, int]]] = {}
+
+    year_dirs: list[tuple[int, Path]] = sorted(
+        (int(e.name), Path(e.path))
+        for e in os.scandir(root_dir)
+        if e.is_dir() and e.name.isdigit() and (years is None or int(e.name) in years)
+    )
+    tile_dirs: list[tuple[str, int, Path]] = sorted(
+        (e.name, year, Path(e.path))
+        for year, year_dir in year_dirs
+        for e in os.scandir(year_dir)
+        if e.is_dir() and (tiles is None or e.name in tiles)
+    )
+
+    for tile_id, year, tile_dir in tile_dirs:
+        scanned[(tile_id, year)] = sorted(
+            (e.name.encode("utf-8"), e.stat().st_size)
+            for e in os.scandir(tile_dir)
+            if e.name.endswith(".tif") and e.is_file()
+        )
+
+    if (years is not None or tiles is not None) and index_file.exists():
+        existing = FileIndex(index_file)
+        for tile_id, year in existing.tile_years():
+            if (years is None or year in years) and (tiles is None or tile_id in tiles):
+                continue
+            start, end = existing._groups[(tile_id, year)]
+            scanned[(tile_id, year)] = [
+                (existing.name_bytes_at(i), existing.sizes[i]) for i in range(start, end)
+            ]
+        existing.close()
+
+    tile_codes: dict[str, int] = {}
+    groups: list[tuple[int, int, int, int]] = []
+    offsets = array("Q", [0])
+    sizes = array("Q")
+    names = bytearray()
+
+    for (tile_id, year), files in sorted(scanned.items()):
+        if not files:
+            continue
+        start: int = len(sizes)
+        for name, size in files:
+            names += name
+            offsets.append(len(names))
+            sizes.append(size)
+        code: int = tile_codes.setdefault(tile_id, len(tile_codes))
+        groups.append((code, year, start, len(sizes)))
+
+    tiles_blob: bytes = "\n".join(tile_codes).encode("utf-8")
+
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file: Path = index_file.with_name(index_file.name + ".tmp")
+    with open(tmp_file, "wb") as f:
+        _ = f.write(_HEADER.pack(MAGIC, len(sizes), len(groups), len(tiles_blob), len(names)))
+        _ = f.write(tiles_blob.ljust(_pad8(len(tiles_blob)), b"\0"))
+        for group in groups:
+            _ = f.write(_GROUP.pack(*group))
+        offsets.tofile(f)
+        sizes.tofile(f)
+        _ = f.write(names)
+    os.replace(tmp_file, index_file)
+
+    return FileIndex(index_file)
+
+
+@lru_cache(maxsize=4)
+def open_file_index(index_file: Path) -> FileIndex:
+    """Opens `index_file` once per process."""
+    return FileIndex(index_file)
+
+
+class CheckedLookup(Mapping[str, int]):
+    """Size lookups in a prebuilt index that fall back to the file system for names the index
+    does not know, e.g. files downloaded after the index was built. Can be passed as `index`
+    to `get_filenames_for_id`.
+
+    If the directory changed after the index was built (files are added, replaced and removed
+    by renames, which update its mtime), indexed sizes may be stale and every lookup is a `stat`.
+    """
+
+    def __init__(self, index: TileYearIndex, directory: Path) -> None:
+        self.index: TileYearIndex = index
+        self.directory: Path = directory
+        try:
+            self.verify: bool = directory.stat().st_mtime_ns >= index.built_ns
+        except FileNotFoundError:
+            self.verify = False
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __getitem__(self, name: str) -> int:
+        size: int | None = self.get(name)
+        if size is None:
+            raise KeyError(name)
+        return size
+
+    @overload
+    def get(self, name: str, /) -> int | None: ...
+    @overload
+    def get(self, name: str, default: int, /) -> int: ...
+    @overload
+    def get(self, name: str, default: T, /) -> int | T: ...
+    def get(self, name: str, default: int | T | None = None, /) -> int | T | None:
+        size: int | None = self.index.get(name)
+        if size is not None and not self.verify:
+            return size
+        try:
+            return (self.directory / name).stat().st_size
+        except FileNotFoundError:
+            return default
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Builds or inspects the compact archive-wide index of downloaded files."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Scan the archive and write the index")
+    _ = p_build.add_argument("root_dir", type=str, help="Archive root directory (<root>/<year>/<tile>)")
+    _ = p_build.add_argument(
+        "index_file",
+        type=str,
+        nargs="?",
+        default=os.getenv("S_FILE_INDEX"),
+        help="Index file, defaults to S_FILE_INDEX",
+    )
+    _ = p_build.add_argument("--years", type=int, nargs="+", default=None)
+
+    p_stats = sub.add_parser("stats", help="Print the number of files and bytes per year")
+    _ = p_stats.add_argument("index_file", type=str)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "build":
+        if not args.index_file:
+            raise SystemExit("No index file given! Pass it or set S_FILE_INDEX.")
+        t_start: float = time.perf_counter()
+        index: FileIndex = build_file_index(
+            Path(args.root_dir), Path(args.index_file), years=args.years
+        )
+        print(
+            f"Indexed {len(index)} files of {len(index.tile_years())} tile/years in "
+            f"{time.perf_counter() - t_start:.2f} s, {Path(args.index_file).stat().st_size} bytes"
+        )
+    else:
+        index = FileIndex(Path(args.index_file))
+        per_year: dict[int, tuple[int, int]] = {}
+        for tile_id, year in index.tile_years():
+            view: TileYearIndex = index.tile_year(tile_id, year)
+            files, n_bytes = per_year.get(year, (0, 0))
+            per_year[year] = (files + len(view), n_bytes + view.total_bytes())
+        for year, (files, n_bytes) in sorted(per_year.items()):
+            print(f"{year}: {files} files, {n_bytes / 1024**3:.2f} GB")
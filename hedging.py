@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import TypeVar
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+T = TypeVar(name="T")
+
+
+@dataclass
+class HedgePolicy:
+    """When and how often small idempotent requests are hedged.
+
+    A second request is sent when the first did not answer within the `percentile`
+    of the recently observed latencies of the same endpoint. At most
+    `budget_burst + budget_ratio * requests` hedges are sent in total.
+    """
+
+    percentile: float = 0.95
+    initial_delay_s: float = 2.0
+    min_delay_s: float = 0.05
+    min_samples: int = 20
+    window: int = 200
+    budget_ratio: float = 0.1
+    budget_burst: int = 5
+    # upper bound for a single request, abandoned requests must not pile up
+    request_timeout_s: float = 60.0
+
+
+class Hedger:
+    """Runs request functions with hedging according to a `HedgePolicy`. Safe to share between threads."""
+
+    def __init__(self, policy: HedgePolicy, max_workers: int = 8) -> None:
+        self.policy: HedgePolicy = policy
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge"
+        )
+        self._latencies: dict[str, deque[float]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self.requests: int = 0
+        self.hedges: int = 0
+        self.hedge_wins: int = 0
+
+    def delay_for(self, endpoint: str) -> float:
+        """Time after which a request to `endpoint` gets hedged."""
+        with self._lock:
+            samples = sorted(self._latencies.get(endpoint, ()))
+        if len(samples) < self.policy.min_samples:
+            return self.policy.initial_delay_s
+        idx: int = min(len(samples) - 1, int(self.policy.percentile * len(samples)))
+        return max(self.policy.min_delay_s, samples[idx])
+
+    def call(
+        self,
+        endpoint: str,
+        fn: Callable[[], T],
+        accept: Callable[[T], bool] | None = None,
+    ) -> T:
+        """Calls `fn`, sending a hedge if it is slow. Returns the first successful result.
+
+        Once hedged, a result only wins if `accept` returns True for it, e.g. only 2xx responses,
+        so that a fast error response does not beat a slower good one. If neither is accepted
+        the last result is returned, or the last error raised.
+        """
+        delay: float = self.delay_for(endpoint)
+        with self._lock:
+            self.requests += 1
+
+        t_start: float = time.perf_counter()
+        primary: Future[T] = self._executor.submit(fn)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            self._record(endpoint, time.perf_counter() - t_start)
+            return primary.result()
+
+        if not self._take_budget():
+            result: T = primary.result()
+            self._record(endpoint, time.perf_counter() - t_start)
+            return result
+
+        logger.debug(f"Hedging request to {endpoint} after {delay:.2f} s")
+        hedge: Future[T] = self._executor.submit(fn)
+        pending: set[Future[T]] = {primary, hedge}
+        last_error: BaseException | None = None
+        rejected: Future[T] | None = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is not None:
+                    last_error = error
+                    continue
+                if accept is not None and not accept(future.result()):
+                    rejected = future
+                    continue
+                self._record(endpoint, time.perf_counter() - t_start)
+                if future is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                for loser in pending:
+                    # requests can not be interrupted, a running loser is abandoned and its result dropped
+                    _ = loser.cancel()
+                    loser.add_done_callback(_discard_result)
+                return future.result()
+
+        if rejected is not None:
+            self._record(endpoint, time.perf_counter() - t_start)
+            return rejected.result()
+        assert last_error is not None
+        raise last_error
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            budget: float = (
+                self.policy.budget_burst + self.policy.budget_ratio * self.requests
+            )
+            if self.hedges + 1 > budget:
+                return False
+            self.hedges += 1
+            return True
+
+    def _record(self, endpoint: str, latency: float) -> None:
+        with self._lock:
+            samples = self._latencies.setdefault(
+                endpoint, deque(maxlen=self.policy.window)
+            )
+            samples.append(latency)
+
+
+def _discard_result(future: Future[T]) -> None:
+    if not future.cancelled():
+        _ = future.exception()
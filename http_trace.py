@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""Records the HTTP traffic shape of real downloads and replays it offline.
+
+Recording (S_HTTP_TRACE=<file>) appends one JSON line per file list, sign and download
+request: status, latency, file names and sizes, but neither tokens, signed URLs nor file
+contents. Replaying serves `starcloud_dl` from such a trace with synthetic bodies, pausing
+for the recorded latencies and transfer times, so changes to scheduling, concurrency and
+retries can be benchmarked without network access.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import requests
+
+from retry_queue import FailedFile, RetryPolicy
+from sc_login import AuthData
+from starcloud_dl import (
+    FILE_PAGE_URL,
+    LINK_GEN_URL,
+    dl_file_list,
+    get_filenames_for_id,
+    set_session_factory,
+)
+from transfer_stats import current_concurrency
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+KIND_LIST: str = "list"
+KIND_SIGN: str = "sign"
+KIND_DOWNLOAD: str = "download"
+
+REPLAY_SCHEME: str = "replay://"
+
+
+class TraceRecorder:
+    """Appends trace events to a JSON lines file. Shared by the recording sessions of all threads."""
+
+    def __init__(self, trace_file: Path) -> None:
+        self.trace_file: Path = trace_file
+        self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+        # signed URLs are only kept in memory to attribute downloads to their object
+        self._objectKeys: dict[str, str] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def remember_signed_url(self, signed_url: str, object_key: str) -> None:
+        with self._lock:
+            self._objectKeys[signed_url] = object_key
+
+    def object_key_for(self, signed_url: str) -> str:
+        with self._lock:
+            return self._objectKeys.get(signed_url, "")
+
+    def write(self, event: dict[str, Any]) -> None:
+        # a single write on an O_APPEND descriptor, processes can share one trace file
+        fd = os.open(self.trace_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            _ = os.write(fd, (json.dumps(event) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+
+class RecordingSession(requests.Session):
+    """`requests.Session` writing the metadata and timing of every API and download request to a trace."""
+
+    def __init__(self, recorder: TraceRecorder) -> None:
+        super().__init__()
+        self.recorder: TraceRecorder = recorder
+
+    def request(self, method: str | bytes, url: str | bytes, *args: Any, **kwargs: Any) -> requests.Response:  # pyright: ignore[reportIncompatibleMethodOverride]
+        t_start: float = time.perf_counter()
+        ts: float = time.time()
+        response: requests.Response = super().request(
+            method.decode() if isinstance(method, bytes) else method, url, *args, **kwargs
+        )
+        latency_s: float = time.perf_counter() - t_start
+
+        payload: dict[str, Any] = kwargs.get("json") or {}
+        event: dict[str, Any] = {
+            "ts": ts,
+            "pid": os.getpid(),
+            "concurrency": current_concurrency(),
+            "status": response.status_code,
+            "latency_s": latency_s,
+        }
+
+        if url == FILE_PAGE_URL:
+            event.update(kind=KIND_LIST, key=payload.get("params", {}).get("path", ""))
+            if response.status_code == 200:
+                event["entries"] = [
+                    {"file": e["file"], "size": e["size"]}
+                    for e in response.json()["response"]  # pyright: ignore[reportAny]
+                ]
+            self.recorder.write(event)
+        elif url == LINK_GEN_URL:
+            object_key: str = str(payload.get("objectKey", ""))
+            event.update(kind=KIND_SIGN, key=object_key)
+            if response.status_code == 200:
+                body = response.json()  # pyright: ignore[reportAny]
+                event.update(fileName=body["fileName"], fileSize=body["fileSize"])
+                self.recorder.remember_signed_url(str(body["signedUrl"]), object_key)  # pyright: ignore[reportAny]
+            self.recorder.write(event)
+        elif str(method).upper() == "GET":
+            event.update(
+                kind=KIND_DOWNLOAD, key=self.recorder.object_key_for(str(url)), connect_s=latency_s
+            )
+            if response.status_code != 200 or not kwargs.get("stream"):
+                event.update(bytes=len(response.content), transfer_s=0.0)
+                self.recorder.write(event)
+            else:
+                response.iter_content = self._timed_body(response, event)  # pyright: ignore[reportAttributeAccessIssue]
+        return response
+
+    def _timed_body(self, response: requests.Response, event: dict[str, Any]) -> Any:
+        iter_content = response.iter_content
+
+        def _iter(chunk_size: int = 1, decode_unicode: bool = False) -> Iterator[str | bytes]:
+            n_bytes: int = 0
+            t_start: float = time.perf_counter()
+            completed: bool = False
+            try:
+                for chunk in iter_content(chunk_size=chunk_size, decode_unicode=decode_unicode):
+                    n_bytes += len(chunk)
+                    yield chunk
+                completed = True
+            finally:
+                event.update(
+                    bytes=n_bytes,
+                    transfer_s=time.perf_counter() - t_start,
+                    completed=completed,
+                )
+                self.recorder.write(event)
+
+        return _iter
+
+
+def enable_recording(trace_file: Path) -> TraceRecorder:
+    """Records the requests of all HTTP sessions created from now on to `trace_file`."""
+    recorder = TraceRecorder(trace_file)
+    set_session_factory(lambda: RecordingSession(recorder))
+    logger.info(f"Recording HTTP trace to {trace_file}")
+    return recorder
+
+
+def record_from_env(backend: str | None = None) -> TraceRecorder | None:
+    """Enables recording if S_HTTP_TRACE is set. Only the `requests` sessions of the threads backend
+    are recorded, with the async backend (`backend`, default S_BACKEND) nothing is recorded.
+    """
+    if not os.getenv("S_HTTP_TRACE"):
+        return None
+    if (backend or os.getenv("S_BACKEND", "threads")) == "async":
+        # the aiohttp downloads would be missing, a trace of only the file lists cannot be replayed
+        logger.warning("S_HTTP_TRACE is not supported with the async backend, not recording")
+        return None
+    return enable_recording(Path(os.environ["S_HTTP_TRACE"]))
+
+
+def read_trace(trace_file: Path) -> list[dict[str, Any]]:
+    """Reads all events of a trace in the order they were written. Malformed lines are skipped."""
+    events: list[dict[str, Any]] = []
+    with open(trace_file) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
+
+
+class _SyntheticBody(io.RawIOBase):
+    """Zero bytes of a recorded download, delivered at the recorded transfer rate.
+    A transfer that was cut off in the recording fails after its recorded bytes.
+    """
+
+    def __init__(self, n_bytes: int, transfer_s: float, cut_off: bool = False) -> None:
+        super().__init__()
+        self._left: int = n_bytes
+        self._s_per_byte: float = transfer_s / n_bytes if n_bytes > 0 else 0.0
+        self._cut_off: bool = cut_off
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:  # pyright: ignore[reportIncompatibleMethodOverride]
+        n: int = self._left if size < 0 else min(size, self._left)
+        if n <= 0:
+            if self._cut_off:
+                raise requests.exceptions.ChunkedEncodingError("Replayed cut off transfer")
+            return b""
+        time.sleep(n * self._s_per_byte)
+        self._left -= n
+        return bytes(n)
+
+
+class ReplayTrace:
+    """The recorded events by kind and key. Repeated requests get the recorded events in order,
+    once they are used up the last one is repeated. Safe to share between threads.
+    """
+
+    def __init__(self, events: list[dict[str, Any]], time_scale: float = 1.0, size_scale: float = 1.0) -> None:
+        self.time_scale: float = time_scale
+        self.size_scale: float = size_scale
+        self._events: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        for e in events:
+            self._events.setdefault((e["kind"], e["key"]), []).append(e)
+        self._used: dict[tuple[str, str], int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def next_event(self, kind: str, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            recorded: list[dict[str, Any]] | None = self._events.get((kind, key))
+            if not recorded:
+                return None
+            i: int = self._used.get((kind, key), 0)
+            self._used[(kind, key)] = i + 1
+            return recorded[min(i, len(recorded) - 1)]
+
+    def tile_years(self) -> list[tuple[str, int]]:
+        """Tiles and years whose file list was recorded."""
+        res: list[tuple[str, int]] = []
+        for kind, key in self._events:
+            if kind == KIND_LIST:
+                tile, year = key.split("/")[-2:]
+                res.append((tile, int(year)))
+        return sorted(res)
+
+
+class ReplaySession(requests.Session):
+    """`requests.Session` answering file list, sign and download requests from a `ReplayTrace`."""
+
+    def __init__(self, trace: ReplayTrace) -> None:
+        super().__init__()
+        self.trace: ReplayTrace = trace
+
+    def request(self, method: str | bytes, url: str | bytes, *args: Any, **kwargs: Any) -> requests.Response:  # pyright: ignore[reportIncompatibleMethodOverride]
+        payload: dict[str, Any] = kwargs.get("json") or {}
+        if url == FILE_PAGE_URL:
+            kind, key = KIND_LIST, str(payload.get("params", {}).get("path", ""))
+        elif url == LINK_GEN_URL:
+            kind, key = KIND_SIGN, str(payload.get("objectKey", ""))
+        elif str(url).startswith(REPLAY_SCHEME):
+            kind, key = KIND_DOWNLOAD, str(url)[len(REPLAY_SCHEME) :]
+        else:
+            raise ValueError(f"No replay for {method!r} {url!r}")
+
+        response = requests.Response()
+        response.url = str(url)
+        event: dict[str, Any] | None = self.trace.next_event(kind, key)
+        if event is None:
+            response.status_code = 404
+            response._content = f"Not in trace: {kind} {key}".encode()  # pyright: ignore[reportPrivateUsage]
+            response._content_consumed = True  # pyright: ignore[reportPrivateUsage]
+            return response
+
+        response.status_code = int(event["status"])
+        time.sleep(
+            float(event.get("connect_s", event.get("latency_s", 0.0))) * self.trace.time_scale
+        )
+
+        if response.status_code != 200:
+            response._content = b"replayed error"  # pyright: ignore[reportPrivateUsage]
+        elif kind == KIND_LIST:
+            entries = [
+                {**e, "size": self._size(int(e["size"]))} for e in event["entries"]
+            ]
+            response._content = json.dumps({"response": entries}).encode()  # pyright: ignore[reportPrivateUsage]
+        elif kind == KIND_SIGN:
+            response._content = json.dumps(  # pyright: ignore[reportPrivateUsage]
+                {
+                    "fileName": event["fileName"],
+                    "fileSize": self._size(int(event["fileSize"])),
+                    "signedUrl": REPLAY_SCHEME + key,
+                }
+            ).encode()
+        else:
+            n_bytes: int = self._size(int(event["bytes"]))
+            response.headers["Content-Length"] = str(n_bytes)
+            response.raw = _SyntheticBody(
+                n_bytes=n_bytes,
+                transfer_s=float(event["transfer_s"]) * self.trace.time_scale,
+                cut_off=not event.get("completed", True),
+            )
+            return response
+        # closing a response without a raw body must not touch it
+        response._content_consumed = True  # pyright: ignore[reportPrivateUsage]
+        return response
+
+    def _size(self, n_bytes: int) -> int:
+        return int(n_bytes * self.trace.size_scale)
+
+
+def enable_replay(trace: ReplayTrace) -> None:
+    """Serves the requests of all HTTP sessions created from now on from `trace`."""
+    set_session_factory(lambda: ReplaySession(trace))
+
+
+def _replay_tile_year(
+    tile_id: str, year: int, out_dir: Path, retry_policy: RetryPolicy, stats_file: Path | None
+) -> list[FailedFile]:
+    target_dir: Path = out_dir / str(year) / tile_id
+    target_dir.mkdir(parents=True, exist_ok=True)
+    auth = AuthData(id=0, userName="replay", token="replay")
+    return dl_file_list(
+        tile_id=tile_id,
+        year=year,
+        target_dir=target_dir,
+        auth=auth,
+        filename_list=get_filenames_for_id(tile_id=tile_id, year=year),
+        show_live_progress=False,
+        stats_file=stats_file,
+        retry_policy=retry_policy,
+        relogin=lambda: auth,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Replays a recorded HTTP trace (S_HTTP_TRACE) against the downloader without network access.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    _ = parser.add_argument("trace_file", type=str, help="Trace recorded with S_HTTP_TRACE")
+    _ = parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of tile/year downloads replayed concurrently, like concurrent array tasks",
+    )
+    _ = parser.add_argument(
+        "--time-scale", type=float, default=1.0, help="Factor applied to all recorded latencies"
+    )
+    _ = parser.add_argument(
+        "--size-scale",
+        type=float,
+        default=1.0,
+        help="Factor applied to all file sizes, e.g. 0.01 to keep replays small. Transfer times are kept.",
+    )
+    _ = parser.add_argument("--max-attempts", type=int, default=5)
+    _ = parser.add_argument(
+        "--out-dir",
+        type=str,
+        default=None,
+        help="Directory the synthetic files are written to, defaults to a temporary directory that is removed afterwards",
+    )
+    _ = parser.add_argument(
+        "--stats-file", type=str, default=None, help="Transfer stats CSV of the replay"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    trace = ReplayTrace(
+        read_trace(Path(args.trace_file)),
+        time_scale=args.time_scale,
+        size_scale=args.size_scale,
+    )
+    enable_replay(trace)
+
+    tile_years: list[tuple[str, int]] = trace.tile_years()
+    if not tile_years:
+        print(f"No file lists recorded in {args.trace_file}, nothing to replay!")
+        raise SystemExit(1)
+
+    out_dir: Path = Path(args.out_dir) if args.out_dir else Path(tempfile.mkdtemp(prefix="sc_replay_"))
+    stats_file: Path | None = Path(args.stats_file) if args.stats_file else None
+
+    t_start: float = time.perf_counter()
+    failures: list[FailedFile] = []
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for result in pool.map(
+                lambda ty: _replay_tile_year(
+                    ty[0], ty[1], out_dir, RetryPolicy(max_attempts=args.max_attempts), stats_file
+                ),
+                tile_years,
+            ):
+                failures += result
+        wall_s: float = time.perf_counter() - t_start
+        n_files: int = sum(1 for p in out_dir.rglob("*.tif"))
+        n_bytes: int = sum(p.stat().st_size for p in out_dir.rglob("*.tif"))
+    finally:
+        if not args.out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    print(
+        f"Replayed {len(tile_years)} tile/years with {args.workers} workers in {wall_s:.2f} s: "
+        f"{n_files} files, {n_bytes / 1024 / 1024:.1f} MB, {len(failures)} failed"
+    )
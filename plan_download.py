@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from disk_space import GB, quota_free_bytes
+from starcloud_dl import get_file_entries_for_id, indexAlreadyDownloadedFiles
+from tiles import add_region_arguments, tiles_from_region_args
+from transfer_stats import TransferStat, read_transfer_stats
+
+
+@dataclass
+class TileYearPlan:
+    tile: str
+    year: int
+    files_total: int
+    bytes_total: int
+    files_to_fetch: int
+    bytes_to_fetch: int
+
+    @property
+    def complete_fraction(self) -> float:
+        if self.files_total == 0:
+            return 1.0
+        return 1.0 - self.files_to_fetch / self.files_total
+
+
+@dataclass
+class ThroughputModel:
+    """Historic per-stream transfer characteristics used for the time estimate."""
+
+    bytes_per_s: float
+    sign_s: float
+    samples: int
+    concurrency: int | None
+
+    def estimate_seconds(self, n_files: int, n_bytes: int, concurrency: int) -> float:
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1!")
+        serial_seconds = n_files * self.sign_s + n_bytes / self.bytes_per_s
+        return serial_seconds / min(concurrency, max(n_files, 1))
+
+
+def plan_tile_year(
+    root_dir: Path, tile_id: str, year: int, list_cache: Path | None = None
+) -> TileYearPlan:
+    """Compares the remote file list of a tile and year with the local archive. Downloads nothing
+    and writes nothing to the archive. File lists fetched for the plan are cached in `list_cache`.
+    """
+    target_dir: Path = root_dir / str(year) / tile_id
+
+    # a file list the downloader cached in the archive is reused, but never written there
+    cache_dir: Path | None = list_cache / str(year) / tile_id if list_cache is not None else None
+    if (target_dir / f"expected_files_{year}_{tile_id}.json").is_file():
+        cache_dir = target_dir
+    elif cache_dir is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    entries = get_file_entries_for_id(
+        tile_id=tile_id,
+        year=year,
+        write_resp_to_disk=cache_dir,
+    )
+
+    index: dict[str, int] = (
+        indexAlreadyDownloadedFiles(path=target_dir) if target_dir.is_dir() else {}
+    )
+
+    missing = [e for e in entries if index.get(str(e["file"]), -10) != e["size"]]
+
+    return TileYearPlan(
+        tile=tile_id,
+        year=year,
+        files_total=len(entries),
+        bytes_total=sum(int(e["size"]) for e in entries),
+        files_to_fetch=len(missing),
+        bytes_to_fetch=sum(int(e["size"]) for e in missing),
+    )
+
+
+def throughput_from_stats(
+    stats: list[TransferStat], concurrency: int | None = None
+) -> ThroughputModel | None:
+    """Derives the per-stream throughput from recorded telemetry.
+    Prefers samples recorded at the requested concurrency and falls back to all samples.
+    """
+    ok = [s for s in stats if s.status == "ok" and s.bytes > 0 and s.download_s > 0]
+
+    if concurrency is not None:
+        same_concurrency = [s for s in ok if s.concurrency == concurrency]
+        if same_concurrency:
+            ok = same_concurrency
+        else:
+            concurrency = None
+
+    if not ok:
+        return None
+
+    return ThroughputModel(
+        bytes_per_s=sum(s.bytes for s in ok) / sum(s.download_s for s in ok),
+        sign_s=statistics.median(s.sign_s for s in ok),
+        samples=len(ok),
+        concurrency=concurrency,
+    )
+
+
+def free_space_shortfall(
+    root_dir: Path, bytes_needed: int, min_free_bytes: int = 0, quota_cmd: str | None = None
+) -> tuple[int, int]:
+    """Returns the free bytes of the file system holding `root_dir` and how many bytes are missing
+    to download `bytes_needed` while keeping `min_free_bytes` free (0 if it fits).
+    With `quota_cmd` the free bytes are at most what is left in the quota.
+    """
+    existing: Path = root_dir.resolve()
+    # the archive root may not exist yet, use the file system it will be created on
+    while not existing.exists():
+        existing = existing.parent
+    free: int = shutil.disk_usage(existing).free
+    if quota_cmd is not None:
+        quota_free: int | None = quota_free_bytes(quota_cmd, existing)
+        if quota_free is not None:
+            free = min(free, quota_free)
+    return free, max(0, bytes_needed + min_free_bytes - free)
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:.2f} {unit}"
+        n /= 1024
+    return f"{n:.2f} TB"
+
+
+def _format_duration(seconds: float) -> str:
+    hours, rem = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{hours}h {minutes:02d}m {secs:02d}s"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Dry run: reports how many files and bytes a tiles/years selection still needs and estimates the download time.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    _ = parser.add_argument(
+        "--slurm-years",
+        type=int,
+        nargs="+",
+        required=True,
+        help="One or more years (e.g. --slurm-years 2024 2025)",
+    )
+    _ = parser.add_argument(
+        "--slurm-tiles",
+        type=json.loads,
+        default=None,
+        help='JSON array of tiles (e.g. --slurm-tiles \'["tileA","tileB"]\'). Defaults to S_TILES.',
+    )
+    add_region_arguments(parser)
+    _ = parser.add_argument(
+        "--root-dir",
+        type=str,
+        default=os.getenv("S_ROOT_DIR", "./"),
+        help="Archive root directory (<root>/<year>/<tile>)",
+    )
+    _ = parser.add_argument(
+        "--stats-file",
+        type=str,
+        default=os.getenv("S_STATS_FILE"),
+        help="Transfer telemetry CSV written by the downloader",
+    )
+    _ = parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("S_LIMIT_CONCURRENT", "5")),
+        help="Number of concurrent downloads the estimate is made for",
+    )
+    _ = parser.add_argument(
+        "--throughput-mbps",
+        type=float,
+        default=None,
+        help="Per-stream throughput in MB/s, used when no telemetry is available",
+    )
+    _ = parser.add_argument(
+        "--min-free-gb",
+        type=float,
+        default=float(os.getenv("S_MIN_FREE_GB", "0")),
+        help="Free space in GB the downloads must leave on the archive file system",
+    )
+    _ = parser.add_argument(
+        "--quota-cmd",
+        type=str,
+        default=os.getenv("S_QUOTA_CMD"),
+        help="Shell command printing the bytes left in the quota ('{path}' is the archive)",
+    )
+    _ = parser.add_argument(
+        "--list-cache",
+        type=str,
+        default=None,
+        help="Directory outside the archive to cache the fetched file lists in (<dir>/<year>/<tile>)",
+    )
+    _ = parser.add_argument(
+        "--json",
+        type=str,
+        default=None,
+        help="Write the plan as JSON to this file",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    _ = load_dotenv(Path(__file__).parent / ".env")
+
+    args = parse_args()
+
+    years: list[int] = args.slurm_years
+    region_tiles: list[str] | None = tiles_from_region_args(args)
+    tiles: list[str] = (
+        args.slurm_tiles
+        if args.slurm_tiles is not None
+        else region_tiles
+        if region_tiles is not None
+        else json.loads(os.environ.get("S_TILES", "[]"))
+    )
+
+    if not tiles:
+        print("No tiles given! Pass --slurm-tiles, --bbox or --region or set S_TILES.")
+        sys.exit(1)
+
+    root_dir = Path(args.root_dir)
+
+    plans: list[TileYearPlan] = []
+    for year in years:
+        for tile_id in tiles:
+            try:
+                plans.append(
+                    plan_tile_year(
+                        root_dir=root_dir,
+                        tile_id=tile_id,
+                        year=year,
+                        list_cache=Path(args.list_cache) if args.list_cache else None,
+                    )
+                )
+            except Exception as e:
+                print(f"ERROR: Could not plan {year}, {tile_id}. Reason: {str(e)}")
+
+    model: ThroughputModel | None = None
+    if args.stats_file:
+        model = throughput_from_stats(
+            read_transfer_stats(Path(args.stats_file)), concurrency=args.concurrency
+        )
+    if model is None and args.throughput_mbps is not None:
+        model = ThroughputModel(
+            bytes_per_s=args.throughput_mbps * 1024 * 1024,
+            sign_s=0.0,
+            samples=0,
+            concurrency=None,
+        )
+
+    print(f"{'tile':<8}{'year':<6}{'files':>8}{'to fetch':>10}{'bytes to fetch':>18}{'complete':>10}")
+    for p in plans:
+        print(
+            f"{p.tile:<8}{p.year:<6}{p.files_total:>8}{p.files_to_fetch:>10}{_format_bytes(p.bytes_to_fetch):>18}{p.complete_fraction * 100:>9.2f}%"
+        )
+
+    files_total = sum(p.files_total for p in plans)
+    bytes_total = sum(p.bytes_total for p in plans)
+    files_to_fetch = sum(p.files_to_fetch for p in plans)
+    bytes_to_fetch = sum(p.bytes_to_fetch for p in plans)
+    complete_fraction = 1.0 - files_to_fetch / files_total if files_total else 1.0
+
+    print(
+        f"Total: {files_to_fetch}/{files_total} files, {_format_bytes(bytes_to_fetch)} of {_format_bytes(bytes_total)} left to fetch ({complete_fraction * 100:.2f} % complete)"
+    )
+
+    free_bytes, shortfall_bytes = free_space_shortfall(
+        root_dir=root_dir,
+        bytes_needed=bytes_to_fetch,
+        min_free_bytes=int(args.min_free_gb * GB),
+        quota_cmd=args.quota_cmd,
+    )
+    print(f"Free space in {root_dir}: {_format_bytes(free_bytes)}")
+    if shortfall_bytes > 0:
+        print(
+            f"WARNING: {_format_bytes(shortfall_bytes)} missing to fetch everything while keeping {args.min_free_gb} GB free! "
+            "Downloads stop once a file does not fit."
+        )
+
+    estimate_s: float | None = None
+    if model is None:
+        print("No throughput data available, pass --stats-file or --throughput-mbps for a time estimate.")
+    else:
+        estimate_s = model.estimate_seconds(
+            n_files=files_to_fetch, n_bytes=bytes_to_fetch, concurrency=args.concurrency
+        )
+        print(
+            f"Estimated wall time at concurrency {args.concurrency}: {_format_duration(estimate_s)} "
+            f"(per stream {_format_bytes(model.bytes_per_s)}/s, sign {model.sign_s:.2f} s, {model.samples} samples)"
+        )
+
+    if args.json:
+        _ = Path(args.json).write_text(
+            json.dumps(
+                {
+                    "concurrency": args.concurrency,
+                    "files_total": files_total,
+                    "bytes_total": bytes_total,
+                    "files_to_fetch": files_to_fetch,
+                    "bytes_to_fetch": bytes_to_fetch,
+                    "complete_fraction": complete_fraction,
+                    "free_bytes": free_bytes,
+                    "shortfall_bytes": shortfall_bytes,
+                    "estimated_seconds": estimate_s,
+                    "throughput": asdict(model) if model is not None else None,
+                    "tiles": [
+                        {**asdict(p), "complete_fraction": p.complete_fraction}
+                        for p in plans
+                    ],
+                },
+                indent=2,
+            )
+        )
+        print(f"Wrote plan to {args.json}")
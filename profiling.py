@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections.abc import Generator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+PHASES: list[str] = ["login", "list", "sign", "connect", "transfer", "write", "index"]
+
+TOP_N: int = 40
+
+
+class RunProfiler:
+    """Collects a cProfile profile, tracemalloc snapshots and per phase wall times of one run.
+
+    cProfile, pstats and tracemalloc are only imported once a profiler is created, `phase`
+    and `add_phase_time` stay cheap to import and call on the download path.
+    """
+
+    def __init__(self, output_dir: Path, name: str) -> None:
+        import cProfile
+
+        self.output_dir: Path = output_dir
+        self.name: str = name
+        self.phase_totals: dict[str, float] = {p: 0.0 for p in PHASES}
+        self.phase_counts: dict[str, int] = {p: 0 for p in PHASES}
+        self._lock: threading.Lock = threading.Lock()
+        self._profile: cProfile.Profile = cProfile.Profile()
+        self._t_start: float = 0.0
+        self._snapshot_start: tracemalloc.Snapshot | None = None
+
+    def start(self) -> None:
+        import tracemalloc
+
+        tracemalloc.start()
+        self._snapshot_start = tracemalloc.take_snapshot()
+        self._t_start = time.perf_counter()
+        self._profile.enable()
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phase_totals[phase] = self.phase_totals.get(phase, 0.0) + seconds
+            self.phase_counts[phase] = self.phase_counts.get(phase, 0) + 1
+
+    def stop(self) -> list[Path]:
+        """Stops profiling and writes the results. Returns the written files."""
+        import io
+        import pstats
+        import tracemalloc
+
+        self._profile.disable()
+        wall_s: float = time.perf_counter() - self._t_start
+        snapshot_end: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        base: Path = self.output_dir / self.name
+
+        pstats_file: Path = base.with_name(base.name + ".pstats")
+        self._profile.dump_stats(pstats_file)
+
+        cprofile_txt: Path = base.with_name(base.name + "_cprofile.txt")
+        buf = io.StringIO()
+        pstats.Stats(self._profile, stream=buf).sort_stats("cumulative").print_stats(TOP_N)
+        _ = cprofile_txt.write_text(buf.getvalue())
+
+        tracemalloc_txt: Path = base.with_name(base.name + "_tracemalloc.txt")
+        lines: list[str] = [f"peak traced memory: {peak_bytes} bytes", "", "top allocations:"]
+        lines += [str(s) for s in snapshot_end.statistics("lineno")[:TOP_N]]
+        if self._snapshot_start is not None:
+            lines += ["", "growth since start:"]
+            lines += [
+                str(s)
+                for s in snapshot_end.compare_to(self._snapshot_start, "lineno")[:TOP_N]
+            ]
+        _ = tracemalloc_txt.write_text("\n".join(lines) + "\n")
+
+        phases_json: Path = base.with_name(base.name + "_phases.json")
+        _ = phases_json.write_text(
+            json.dumps(
+                {
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                    "argv": sys.argv,
+                    "wall_s": wall_s,
+                    "peak_memory_bytes": peak_bytes,
+                    "phases": {
+                        p: {
+                            "total_s": self.phase_totals[p],
+                            "count": self.phase_counts[p],
+                            "share": self.phase_totals[p] / wall_s if wall_s > 0 else 0.0,
+                        }
+                        for p in self.phase_totals
+                    },
+                },
+                indent=2,
+            )
+        )
+
+        return [pstats_file, cprofile_txt, tracemalloc_txt, phases_json]
+
+
+_active: RunProfiler | None = None
+
+
+def enable(output_dir: Path, name: str) -> RunProfiler:
+    """Starts profiling the current process. Phases are recorded by `phase` and `add_phase_time`."""
+    global _active
+    _active = RunProfiler(output_dir=output_dir, name=name)
+    _active.start()
+    return _active
+
+
+def is_enabled() -> bool:
+    return _active is not None
+
+
+def add_phase_time(phase: str, seconds: float) -> None:
+    if _active is not None:
+        _active.add(phase, seconds)
+
+
+def phase(name: str) -> AbstractContextManager[None]:
+    """Times the wrapped block as `name` if profiling is enabled, otherwise does nothing."""
+    if _active is None:
+        return nullcontext()
+    return _timed(_active, name)
+
+
+@contextmanager
+def _timed(profiler: RunProfiler, name: str) -> Generator[None, None, None]:
+    t_start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add(name, time.perf_counter() - t_start)
+
+
+def finish() -> None:
+    """Stops profiling and writes the results to the output directory given to `enable`."""
+    global _active
+    if _active is None:
+        return
+    files: list[Path] = _active.stop()
+    _active = None
+    logger.info(f"Wrote profile to {', '.join(str(f) for f in files)}")
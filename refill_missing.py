@@ -1,7 +1,12 @@
 from pathlib import Path
 
 from requests import auth
+from bandwidth import node_throttle_from_env
+from disk_space import InsufficientDiskSpace, guard_from_env
+from events import sink_from_env
+from file_claims import FileClaimed, claims_from_env
 from sc_login import AuthData, LoginCredentials, performLogin
+from signed_url_cache import SignedUrlCache
 from starcloud_dl import DEFAULT_CHUNK_SIZE, dl_file_by_id
 from validate_starcloud_dl import validate_year
 import argparse
@@ -10,8 +15,16 @@ from dotenv import load_dotenv
 import os
 
 
-def fetch_missing_files(path: Path, year: int) -> pl.DataFrame:
-    df = validate_year(path=path, year=year, print_stats=False)
+def fetch_missing_files(
+    path: Path, year: int, check_structure: bool = False, workers: int = 1
+) -> pl.DataFrame:
+    df = validate_year(
+        path=path,
+        year=year,
+        print_stats=False,
+        check_structure=check_structure,
+        workers=workers,
+    )
 
     result = df.filter(pl.col("status") != "complete")
 
@@ -20,7 +33,7 @@ def fetch_missing_files(path: Path, year: int) -> pl.DataFrame:
     return result
 
 
-def parse_args() -> tuple[list[int], bool]:
+def parse_args() -> tuple[list[int], bool, bool, int]:
     parser = argparse.ArgumentParser()
 
     _ = parser.add_argument(
@@ -37,10 +50,25 @@ def parse_args() -> tuple[list[int], bool]:
         help="Enable check mode (default: False)",
     )
 
+    _ = parser.add_argument(
+        "--structural",
+        action="store_true",
+        help="Also refill files of the right size whose TIFF structure is damaged",
+    )
+
+    _ = parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes validating tiles in parallel",
+    )
+
     args = parser.parse_args()
 
     slurm_years: list[str] = args.slurm_years
     check: bool = args.check
+    structural: bool = args.structural
+    workers: int = args.workers
 
     if len(slurm_years) == 1 and "-" in slurm_years[0]:
         start, end = map(int, slurm_years[0].split("-"))
@@ -48,13 +76,13 @@ def parse_args() -> tuple[list[int], bool]:
     else:
         years = list(map(int, slurm_years))
 
-    return years, check
+    return years, check, structural, workers
 
 
 if __name__ == "__main__":
     import sys
 
-    years, just_check = parse_args()
+    years, just_check, structural, workers = parse_args()
 
     env_path = Path(__file__).parent / ".env"
     load_dotenv(env_path)
@@ -65,7 +93,9 @@ if __name__ == "__main__":
     password: str = os.environ["STAR_PASSWORD"]
     creds = LoginCredentials(email, password)
 
-    missing_files_df = pl.concat([fetch_missing_files(root_dir, y) for y in years])
+    missing_files_df = pl.concat(
+        [fetch_missing_files(root_dir, y, structural, workers) for y in years]
+    )
 
 
     missing_tiles = missing_files_df.get_column('tile').unique().len()
@@ -86,6 +116,19 @@ if __name__ == "__main__":
         print(f"Error authenticating for star cloud: {str(e)}")
         sys.exit(1)
 
+    url_cache = SignedUrlCache(
+        cache_file=Path(os.environ["S_URL_CACHE_FILE"])
+        if os.getenv("S_URL_CACHE_FILE")
+        else None
+    )
+
+    disk_guard = guard_from_env()
+    throttle = node_throttle_from_env()
+    events = sink_from_env()
+    # Slurm tasks may be downloading some of the missing files right now, claims are on
+    # unless S_FILE_CLAIMS=0
+    claims = claims_from_env(default=True)
+
     for row in missing_files_df.iter_rows(named=True):
 
         year, tile_id, fname = (row['year'], row['tile'], row['filename'])
@@ -100,6 +143,16 @@ if __name__ == "__main__":
                 target_dir=target_dir,
                 show_live_progress=True,
                 chunk_size=DEFAULT_CHUNK_SIZE * 4,
+                url_cache=url_cache,
+                disk_guard=disk_guard,
+                throttle=throttle,
+                events=events,
+                claims=claims,
             )
+        except FileClaimed as e:
+            print(f"Skipping {target_dir / fname}, {e}")
+        except InsufficientDiskSpace as e:
+            print(f"Stopping refill, {e}")
+            sys.exit(1)
         except Exception as e:
             print(f"Failed to download file to {target_dir / fname}! Reason: {e}")
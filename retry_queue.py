@@ -0,0 +1,120 @@
+import csv
+import heapq
+import itertools
+import random
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Generic, TypeVar
+
+import requests
+
+from sc_login import LoginExpired
+
+T = TypeVar(name="T")
+
+ERROR_TRANSIENT: str = "transient"
+ERROR_AUTH: str = "auth"
+ERROR_PERMANENT: str = "permanent"
+
+_TRANSIENT_STATUS_CODES: set[int] = {403, 408, 425, 429, 500, 502, 503, 504}
+_AUTH_STATUS_CODES: set[int] = {401}
+
+
+def _status_code(e: BaseException) -> int | None:
+    status: int | None = getattr(e, "status_code", None)
+    if status is not None:
+        return status
+    response: requests.Response | None = getattr(e, "response", None)
+    if response is not None:
+        return response.status_code
+    return None
+
+
+def classify_error(e: BaseException) -> str:
+    """Sorts a download error into 'transient', 'auth' or 'permanent'.
+
+    Transient errors (connection resets, timeouts, throttling, server errors, rejected
+    signed URLs) are worth retrying later. Auth errors need a new login first.
+    Everything else, e.g. missing objects or a full disk, will fail again.
+    """
+    if isinstance(e, LoginExpired):
+        return ERROR_AUTH
+
+    status: int | None = _status_code(e)
+    if status is not None:
+        if status in _AUTH_STATUS_CODES:
+            return ERROR_AUTH
+        if status in _TRANSIENT_STATUS_CODES:
+            return ERROR_TRANSIENT
+        return ERROR_PERMANENT
+
+    if isinstance(e, requests.exceptions.RequestException):
+        return ERROR_TRANSIENT
+    if isinstance(e, (OSError, ValueError, KeyError)):
+        return ERROR_PERMANENT
+    # e.g. size mismatches after a cut transfer
+    return ERROR_TRANSIENT
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay_s: float = 2.0
+    max_delay_s: float = 120.0
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given (1-based) failed attempt."""
+        return random.uniform(
+            0, min(self.max_delay_s, self.base_delay_s * 2 ** (attempt - 1))
+        )
+
+
+@dataclass
+class FailedFile:
+    tile: str
+    year: int
+    filename: str
+    attempts: int
+    error_class: str
+    error: str
+
+
+class RetryQueue(Generic[T]):
+    """Work queue in which failed items are requeued with a delay behind the other work."""
+
+    def __init__(self, items: list[T]) -> None:
+        self._counter = itertools.count()
+        self._heap: list[tuple[float, int, T]] = []
+        for item in items:
+            self.push(item)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, item: T, delay: float = 0.0) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), item))
+
+    def pop(self) -> T:
+        """Returns the next item, waiting until its retry delay has passed."""
+        ready_at, _, item = heapq.heappop(self._heap)
+        wait_s: float = ready_at - time.monotonic()
+        if wait_s > 0:
+            time.sleep(wait_s)
+        return item
+
+    def drain(self) -> list[T]:
+        """Removes and returns all items without waiting."""
+        items: list[T] = [item for _, _, item in sorted(self._heap)]
+        self._heap = []
+        return items
+
+
+def write_failed_report(report_file: Path, failures: list[FailedFile]) -> None:
+    """Writes the files that could not be downloaded as CSV, e.g. as input for a refill run."""
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=[fd.name for fd in fields(FailedFile)])
+        writer.writeheader()
+        for failure in failures:
+            writer.writerow(asdict(failure))
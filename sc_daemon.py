@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+"""Long running download service for a transfer node.
+
+The service keeps the login, HTTP connections, file lists and the index of downloaded
+files warm and accepts jobs over a local Unix socket. Jobs are stored in a SQLite queue,
+processed by priority and share one bandwidth budget.
+
+    python3 sc_daemon.py serve --workers 4 --max-mbps 200
+    python3 sc_daemon.py submit --slurm-years 2000 2001 --slurm-tiles '["32UQB"]' --priority 5
+    python3 sc_daemon.py refill failed_files/failed_32UQB_2000_0.csv
+    python3 sc_daemon.py status 3
+    python3 sc_daemon.py cancel 3
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from bandwidth import MB, Throttle, TokenBucket, node_throttle_from_env
+from disk_space import GB, DiskSpaceGuard
+from events import EventSink, sink_from_env
+from file_claims import FileClaims, claims_from_env
+from retry_queue import ERROR_AUTH, FailedFile, RetryPolicy
+from sc_login import AuthData, LoginCredentials, performLogin
+from signed_url_cache import SignedUrlCache
+from starcloud_dl import (
+    DEFAULT_CHUNK_SIZE,
+    dl_file_list,
+    get_file_entries_for_id,
+    indexAlreadyDownloadedFiles,
+    loadCredsFromEnv,
+)
+
+LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+
+logging.basicConfig(
+    level=LOG_LEVEL,
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    stream=sys.stdout,
+)
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+DEFAULT_SOCKET: str = os.getenv(
+    "S_DAEMON_SOCKET", f"/tmp/starcloud_dl_{os.getenv('USER', 'user')}.sock"
+)
+DEFAULT_DB: str = os.getenv("S_DAEMON_DB", "./starcloud_daemon.db")
+# file lists and the index of downloaded files are fetched again once they are older
+DEFAULT_CACHE_TTL_S: float = float(os.getenv("S_DAEMON_CACHE_TTL_S", "3600"))
+
+JOB_QUEUED: str = "queued"
+JOB_RUNNING: str = "running"
+JOB_DONE: str = "done"
+JOB_FAILED: str = "failed"
+JOB_CANCELLED: str = "cancelled"
+
+KIND_TILES: str = "tiles"
+KIND_FILES: str = "files"
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    priority: int
+    status: str
+    created: float
+    started: float | None
+    finished: float | None
+    total: int
+    done: int
+    failed: int
+    error: str | None
+
+
+class JobStore:
+    """Persistent job queue in SQLite. Higher priorities run first, then older jobs."""
+
+    def __init__(self, db_path: Path) -> None:
+        self._conn: sqlite3.Connection = sqlite3.connect(
+            db_path, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._lock: threading.Lock = threading.Lock()
+        with self._lock, self._conn:
+            _ = self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )"""
+            )
+
+    def requeue_interrupted(self) -> int:
+        """Puts jobs that were running when the service stopped back into the queue."""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, started = NULL WHERE status = ?",
+                (JOB_QUEUED, JOB_RUNNING),
+            )
+            return cur.rowcount
+
+    def submit(self, kind: str, payload: dict[str, Any], priority: int = 0) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO jobs (kind, payload, priority, status, created) VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), priority, JOB_QUEUED, time.time()),
+            )
+            return int(cur.lastrowid or 0)
+
+    def claim_next(self) -> Job | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, id ASC LIMIT 1",
+                (JOB_QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            _ = self._conn.execute(
+                "UPDATE jobs SET status = ?, started = ? WHERE id = ?",
+                (JOB_RUNNING, time.time(), row["id"]),
+            )
+        return self.get(int(row["id"]))
+
+    def set_total(self, job_id: int, total: int) -> None:
+        with self._lock, self._conn:
+            _ = self._conn.execute(
+                "UPDATE jobs SET total = ? WHERE id = ?", (total, job_id)
+            )
+
+    def add_progress(self, job_id: int, done: int, failed: int) -> None:
+        with self._lock, self._conn:
+            _ = self._conn.execute(
+                "UPDATE jobs SET done = done + ?, failed = failed + ? WHERE id = ?",
+                (done, failed, job_id),
+            )
+
+    def finish(self, job_id: int, status: str, error: str | None = None) -> None:
+        with self._lock, self._conn:
+            _ = self._conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                (status, time.time(), error, job_id),
+            )
+
+    def cancel_queued(self, job_id: int) -> bool:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED),
+            )
+            return cur.rowcount > 0
+
+    def get(self, job_id: int) -> Job | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return _row_to_job(row) if row is not None else None
+
+    def list(self, limit: int = 50) -> list[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [_row_to_job(r) for r in rows]
+
+
+def _row_to_job(row: sqlite3.Row) -> Job:
+    return Job(
+        id=row["id"],
+        kind=row["kind"],
+        payload=json.loads(row["payload"]),
+        priority=row["priority"],
+        status=row["status"],
+        created=row["created"],
+        started=row["started"],
+        finished=row["finished"],
+        total=row["total"],
+        done=row["done"],
+        failed=row["failed"],
+        error=row["error"],
+    )
+
+
+class DownloadService:
+    """Processes queued jobs with a pool of workers sharing login, caches and bandwidth."""
+
+    def __init__(
+        self,
+        creds: LoginCredentials,
+        root_dir: Path,
+        store: JobStore,
+        workers: int = 2,
+        throttle: Throttle | None = None,
+        url_cache: SignedUrlCache | None = None,
+        retry_policy: RetryPolicy | None = None,
+        disk_guard: DiskSpaceGuard | None = None,
+        events: EventSink | None = None,
+        claims: FileClaims | None = None,
+        cache_ttl_s: float = DEFAULT_CACHE_TTL_S,
+    ) -> None:
+        self.creds: LoginCredentials = creds
+        self.root_dir: Path = root_dir
+        self.store: JobStore = store
+        self.n_workers: int = workers
+        self.throttle: Throttle | None = throttle
+        self.url_cache: SignedUrlCache = url_cache or SignedUrlCache()
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy()
+        self.disk_guard: DiskSpaceGuard | None = disk_guard
+        self.events: EventSink | None = events
+        self.claims: FileClaims | None = claims
+        self.cache_ttl_s: float = cache_ttl_s
+
+        self._auth: AuthData | None = None
+        self._auth_lock: threading.Lock = threading.Lock()
+        # file lists and downloaded file index per (tile, year) with the time they were made
+        self._manifests: dict[tuple[str, int], tuple[float, list[dict[str, int | str]]]] = {}
+        self._ledger: dict[tuple[str, int], tuple[float, dict[str, int]]] = {}
+        self._cache_lock: threading.Lock = threading.Lock()
+        # (tile, year, file) -> id of the running job downloading it
+        self._in_flight: dict[tuple[str, int, str], int] = {}
+        self._in_flight_changed: threading.Condition = threading.Condition()
+        self._cancel_events: dict[int, threading.Event] = {}
+        self._wakeup: threading.Event = threading.Event()
+        self._stopping: threading.Event = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        requeued: int = self.store.requeue_interrupted()
+        if requeued > 0:
+            logger.info(f"Requeued {requeued} interrupted jobs")
+        _ = self.auth()
+        for i in range(self.n_workers):
+            t = threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for event in list(self._cancel_events.values()):
+            event.set()
+        self._wakeup.set()
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def auth(self) -> AuthData:
+        with self._auth_lock:
+            if self._auth is None:
+                self._auth = performLogin(self.creds)
+            return self._auth
+
+    def relogin(self) -> AuthData:
+        with self._auth_lock:
+            self._auth = performLogin(self.creds)
+            return self._auth
+
+    def cancel(self, job_id: int) -> bool:
+        if self.store.cancel_queued(job_id):
+            return True
+        event: threading.Event | None = self._cancel_events.get(job_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def _is_fresh(self, made_at: float) -> bool:
+        return time.monotonic() - made_at < self.cache_ttl_s
+
+    def manifest(self, tile_id: str, year: int) -> list[dict[str, int | str]]:
+        key = (tile_id, year)
+        with self._cache_lock:
+            if key in self._manifests and self._is_fresh(self._manifests[key][0]):
+                return self._manifests[key][1]
+        target_dir: Path = self.root_dir / str(year) / tile_id
+        target_dir.mkdir(parents=True, exist_ok=True)
+        entries = get_file_entries_for_id(
+            tile_id=tile_id, year=year, write_resp_to_disk=target_dir
+        )
+        with self._cache_lock:
+            self._manifests[key] = (time.monotonic(), entries)
+        return entries
+
+    def ledger(self, tile_id: str, year: int, refresh: bool = False) -> dict[str, int]:
+        key = (tile_id, year)
+        with self._cache_lock:
+            if key in self._ledger and not refresh and self._is_fresh(self._ledger[key][0]):
+                return self._ledger[key][1]
+        index: dict[str, int] = indexAlreadyDownloadedFiles(
+            path=self.root_dir / str(year) / tile_id
+        )
+        with self._cache_lock:
+            self._ledger[key] = (time.monotonic(), index)
+        return index
+
+    def _work_items(self, job: Job) -> dict[tuple[str, int], list[str]]:
+        """Files still missing per (tile, year) for a job."""
+        work: dict[tuple[str, int], list[str]] = {}
+        if job.kind == KIND_TILES:
+            for year in job.payload["years"]:
+                for tile_id in job.payload["tiles"]:
+                    index = self.ledger(tile_id, int(year))
+                    work[(tile_id, int(year))] = [
+                        str(e["file"])
+                        for e in self.manifest(tile_id, int(year))
+                        if index.get(str(e["file"]), -10) != e["size"]
+                    ]
+        elif job.kind == KIND_FILES:
+            for f in job.payload["files"]:
+                work.setdefault((str(f["tile"]), int(f["year"])), []).append(
+                    str(f["filename"])
+                )
+        else:
+            raise ValueError(f"Unknown job kind '{job.kind}'")
+        return work
+
+    def _reserve(
+        self, job_id: int, tile_id: str, year: int, filenames: list[str]
+    ) -> tuple[list[str], list[str]]:
+        """Splits `filenames` into the files the job now downloads and those another running job downloads."""
+        own: list[str] = []
+        busy: list[str] = []
+        with self._in_flight_changed:
+            for filename in dict.fromkeys(filenames):
+                if self._in_flight.setdefault((tile_id, year, filename), job_id) == job_id:
+                    own.append(filename)
+                else:
+                    busy.append(filename)
+        return own, busy
+
+    def _release(self, tile_id: str, year: int, filenames: list[str]) -> None:
+        with self._in_flight_changed:
+            for filename in filenames:
+                _ = self._in_flight.pop((tile_id, year, filename), None)
+            self._in_flight_changed.notify_all()
+
+    def _wait_released(
+        self, tile_id: str, year: int, filenames: list[str], cancel_event: threading.Event
+    ) -> None:
+        with self._in_flight_changed:
+            while not cancel_event.is_set() and any(
+                (tile_id, year, f) in self._in_flight for f in filenames
+            ):
+                _ = self._in_flight_changed.wait(timeout=5)
+
+    def _download_group(
+        self, job: Job, tile_id: str, year: int, filenames: list[str], cancel_event: threading.Event
+    ) -> list[FailedFile]:
+        """Downloads the files of one tile and year. Files another running job is downloading are
+        left to it, if it did not complete them they are downloaded afterwards.
+        """
+        target_dir: Path = self.root_dir / str(year) / tile_id
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        failures: list[FailedFile] = []
+        pending: list[str] = filenames
+        while pending and not cancel_event.is_set():
+            own, busy = self._reserve(job.id, tile_id, year, pending)
+            if own:
+                try:
+                    failures += dl_file_list(
+                        tile_id=tile_id,
+                        year=year,
+                        target_dir=target_dir,
+                        auth=self.auth(),
+                        filename_list=own,
+                        show_live_progress=False,
+                        chunk_size=DEFAULT_CHUNK_SIZE * 4,
+                        log_time=True,
+                        url_cache=self.url_cache,
+                        retry_policy=self.retry_policy,
+                        relogin=self.relogin,
+                        throttle=self.throttle,
+                        cancel_event=cancel_event,
+                        disk_guard=self.disk_guard,
+                        events=self.events,
+                        claims=self.claims,
+                    )
+                finally:
+                    self._release(tile_id, year, own)
+            if not busy:
+                break
+            logger.info(
+                f"Job {job.id}: waiting for {len(busy)} files of {tile_id} {year} downloaded by another job"
+            )
+            self._wait_released(tile_id, year, busy, cancel_event)
+            index: dict[str, int] = self.ledger(tile_id, year, refresh=True)
+            pending = [f for f in busy if f not in index]
+        return failures
+
+    def _run_job(self, job: Job) -> None:
+        cancel_event = threading.Event()
+        self._cancel_events[job.id] = cancel_event
+        try:
+            work = self._work_items(job)
+            self.store.set_total(job.id, sum(len(v) for v in work.values()))
+            logger.info(f"Starting job {job.id} ({job.kind}) with {len(work)} tile/year groups")
+
+            failures: list[FailedFile] = []
+            for (tile_id, year), filenames in work.items():
+                if cancel_event.is_set() or not filenames:
+                    continue
+
+                group_failures = self._download_group(job, tile_id, year, filenames, cancel_event)
+                failures += group_failures
+
+                index: dict[str, int] = self.ledger(tile_id, year, refresh=True)
+                failed_names: set[str] = {f.filename for f in group_failures}
+                self.store.add_progress(
+                    job.id,
+                    done=sum(1 for f in filenames if f in index and f not in failed_names),
+                    failed=len(group_failures),
+                )
+
+            if cancel_event.is_set():
+                self.store.finish(job.id, JOB_CANCELLED)
+            elif failures:
+                auth_failures = [f for f in failures if f.error_class == ERROR_AUTH]
+                self.store.finish(
+                    job.id,
+                    JOB_FAILED,
+                    error=f"{len(failures)} files failed ({len(auth_failures)} auth errors)",
+                )
+            else:
+                self.store.finish(job.id, JOB_DONE)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            self.store.finish(job.id, JOB_FAILED, error=str(e))
+        finally:
+            _ = self._cancel_events.pop(job.id, None)
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            job: Job | None = self.store.claim_next()
+            if job is None:
+                _ = self._wakeup.wait(timeout=5)
+                self._wakeup.clear()
+                continue
+            self._run_job(job)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_ServiceServer"
+
+    def handle(self) -> None:
+        line: bytes = self.rfile.readline()
+        try:
+            request: dict[str, Any] = json.loads(line)
+            response: dict[str, Any] = self.server.dispatch(request)
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        _ = self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _ServiceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads: bool = True
+
+    def __init__(self, socket_path: str, service: DownloadService) -> None:
+        self.service: DownloadService = service
+        super().__init__(socket_path, _RequestHandler)
+
+    def dispatch(self, request: dict[str, Any]) -> dict[str, Any]:
+        op: str = request.get("op", "")
+        store: JobStore = self.service.store
+
+        if op == "ping":
+            return {"ok": True}
+        if op == "submit":
+            kind: str = request["kind"]
+            if kind not in (KIND_TILES, KIND_FILES):
+                raise ValueError(f"Unknown job kind '{kind}'")
+            job_id: int = store.submit(
+                kind=kind,
+                payload=request["payload"],
+                priority=int(request.get("priority", 0)),
+            )
+            self.service.notify()
+            return {"ok": True, "id": job_id}
+        if op == "status":
+            job: Job | None = store.get(int(request["id"]))
+            if job is None:
+                return {"ok": False, "error": f"No job with id {request['id']}"}
+            return {"ok": True, "job": asdict(job)}
+        if op == "list":
+            return {
+                "ok": True,
+                "jobs": [asdict(j) for j in store.list(int(request.get("limit", 50)))],
+            }
+        if op == "cancel":
+            return {"ok": self.service.cancel(int(request["id"]))}
+        raise ValueError(f"Unknown operation '{op}'")
+
+
+def send_request(socket_path: str, request: dict[str, Any]) -> dict[str, Any]:
+    """Sends one request to a running service and returns its answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())  # pyright: ignore[reportAny]
+
+
+def serve(args: argparse.Namespace) -> None:
+    creds: LoginCredentials = loadCredsFromEnv(envfilePath=args.env_file)
+    root_dir: Path = Path(args.root_dir or os.environ["S_ROOT_DIR"])
+
+    service = DownloadService(
+        creds=creds,
+        root_dir=root_dir,
+        store=JobStore(Path(args.db)),
+        workers=args.workers,
+        # the node-wide budget (S_NODE_MAX_MBPS) is shared with downloaders outside the service
+        throttle=node_throttle_from_env()
+        or (TokenBucket(args.max_mbps * MB) if args.max_mbps else None),
+        url_cache=SignedUrlCache(),
+        retry_policy=RetryPolicy(max_attempts=args.max_attempts),
+        disk_guard=DiskSpaceGuard(
+            min_free_bytes=int(args.min_free_gb * GB),
+            preallocate=args.preallocate,
+            quota_cmd=args.quota_cmd,
+        ),
+        events=sink_from_env(),
+        # the service runs next to other downloaders of the archive, claims are on unless S_FILE_CLAIMS=0
+        claims=claims_from_env(default=True),
+        cache_ttl_s=args.cache_ttl_s,
+    )
+    service.start()
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    with _ServiceServer(args.socket, service) as server:
+        os.chmod(args.socket, 0o600)
+        logger.info(f"Download service listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down...")
+        finally:
+            service.stop()
+            os.unlink(args.socket)
+
+
+def _read_failed_report(report_file: Path) -> list[dict[str, str | int]]:
+    with open(report_file, newline="") as f:
+        return [
+            {"tile": r["tile"], "year": int(r["year"]), "filename": r["filename"]}
+            for r in csv.DictReader(f)
+        ]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Download service with a local job API",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    _ = parser.add_argument("--socket", default=DEFAULT_SOCKET, type=str)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Run the service")
+    _ = p_serve.add_argument("-e", "--env-file", default=".env", type=str)
+    _ = p_serve.add_argument("--root-dir", default=None, type=str, help="Defaults to S_ROOT_DIR")
+    _ = p_serve.add_argument("--db", default=DEFAULT_DB, type=str, help="SQLite job queue")
+    _ = p_serve.add_argument("--workers", default=2, type=int)
+    _ = p_serve.add_argument(
+        "--max-mbps",
+        default=None,
+        type=float,
+        help="Bandwidth budget in MB/s shared by all jobs. S_NODE_MAX_MBPS takes precedence",
+    )
+    _ = p_serve.add_argument("--max-attempts", default=5, type=int)
+    _ = p_serve.add_argument(
+        "--min-free-gb",
+        default=float(os.getenv("S_MIN_FREE_GB", "0")),
+        type=float,
+        help="Free space in GB that must remain in the archive, files that do not fit are not started",
+    )
+    _ = p_serve.add_argument(
+        "--preallocate",
+        action="store_true",
+        default=bool(os.getenv("S_PREALLOCATE")),
+        help="Allocate the full size of a file before streaming it (needs native fallocate support)",
+    )
+    _ = p_serve.add_argument(
+        "--cache-ttl-s",
+        default=DEFAULT_CACHE_TTL_S,
+        type=float,
+        help="Seconds after which file lists and the index of downloaded files are fetched again",
+    )
+    _ = p_serve.add_argument(
+        "--quota-cmd",
+        default=os.getenv("S_QUOTA_CMD"),
+        type=str,
+        help="Shell command printing the bytes left in the quota ('{path}' is the archive)",
+    )
+
+    p_submit = sub.add_parser("submit", help="Queue all missing files of tiles and years")
+    _ = p_submit.add_argument("--slurm-years", type=int, nargs="+", required=True)
+    _ = p_submit.add_argument("--slurm-tiles", type=json.loads, required=True)
+    _ = p_submit.add_argument("--priority", type=int, default=0)
+
+    p_refill = sub.add_parser("refill", help="Queue the files of a failed files report")
+    _ = p_refill.add_argument("report", type=str)
+    _ = p_refill.add_argument("--priority", type=int, default=10)
+
+    p_status = sub.add_parser("status", help="Show a job")
+    _ = p_status.add_argument("id", type=int)
+
+    p_list = sub.add_parser("list", help="List recent jobs")
+    _ = p_list.add_argument("--limit", type=int, default=20)
+
+    p_cancel = sub.add_parser("cancel", help="Cancel a queued or running job")
+    _ = p_cancel.add_argument("id", type=int)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+
+    if args.command == "serve":
+        serve(args)
+        sys.exit(0)
+
+    request: dict[str, Any]
+    if args.command == "submit":
+        request = {
+            "op": "submit",
+            "kind": KIND_TILES,
+            "payload": {"tiles": args.slurm_tiles, "years": args.slurm_years},
+            "priority": args.priority,
+        }
+    elif args.command == "refill":
+        request = {
+            "op": "submit",
+            "kind": KIND_FILES,
+            "payload": {"files": _read_failed_report(Path(args.report))},
+            "priority": args.priority,
+        }
+    elif args.command == "status":
+        request = {"op": "status", "id": args.id}
+    elif args.command == "list":
+        request = {"op": "list", "limit": args.limit}
+    else:
+        request = {"op": "cancel", "id": args.id}
+
+    response = send_request(args.socket, request)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get("ok") else 1)
@@ -1,12 +1,15 @@
 from dataclasses import dataclass
+from functools import lru_cache
 import json
 import base64
 import requests
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5
-import logging 
+import logging
 import os
 import sys
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from Crypto.PublicKey import RSA
 
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
 
@@ -30,15 +33,24 @@ EMe+TLiuxFoCQO9smGCOi9sCFAVrC3DaGPhGYT422QIDAQAB
 -----END PUBLIC KEY-----"""
 
 
+@lru_cache(maxsize=1)
+def _public_key() -> "RSA.RsaKey":
+    """Parses the login public key once per process. pycryptodome is only imported when logging in."""
+    from Crypto.PublicKey import RSA
+
+    return RSA.import_key(PUBLIC_KEY_PEM)
+
+
 def _encrypt_login(account: str, password: str) -> str:
+    from Crypto.Cipher import PKCS1_v1_5
+
     payload: dict[str, bool | str] = {
         "account": account,
         "password": password,
         "rememberMe": False,
     }
     payload_bytes: bytes = json.dumps(payload, separators=(",", ":")).encode("utf-8")
-    rsa_key: RSA.RsaKey = RSA.import_key(PUBLIC_KEY_PEM)
-    cipher: PKCS1_v1_5.PKCS115_Cipher = PKCS1_v1_5.new(rsa_key)
+    cipher: PKCS1_v1_5.PKCS115_Cipher = PKCS1_v1_5.new(_public_key())
     encrypted_bytes = cipher.encrypt(payload_bytes)
     return base64.b64encode(encrypted_bytes).decode("utf-8")
 
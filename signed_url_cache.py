@@ -0,0 +1,232 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+# lifetime assumed for signed URLs whose expiry can not be read from the URL
+DEFAULT_TTL_S: float = 10 * 60
+
+# cached URLs are not handed out if they expire within this margin
+DEFAULT_SAFETY_MARGIN_S: float = 60
+
+# the journal is compacted once it has more records than this and 4 times the live links
+COMPACT_MIN_RECORDS: int = 1000
+
+
+@dataclass
+class SignedLink:
+    file_name: str
+    signed_url: str
+    file_size: int
+    obtained_at: float
+    expires_at: float
+
+
+def parse_url_expiry(url: str) -> float | None:
+    """Reads the expiry (unix time) from the query parameters of a pre-signed object store URL.
+
+    Supports AWS SigV4 ('X-Amz-Date' + 'X-Amz-Expires'), Google ('X-Goog-Date' + 'X-Goog-Expires')
+    and the absolute 'Expires' parameter used by SigV2, OSS and OBS style URLs.
+    """
+    query: dict[str, list[str]] = parse_qs(urlparse(url).query)
+
+    for prefix in ("X-Amz", "X-Goog"):
+        date = query.get(f"{prefix}-Date")
+        expires = query.get(f"{prefix}-Expires")
+        if date and expires:
+            try:
+                signed_at = datetime.strptime(date[0], "%Y%m%dT%H%M%SZ").replace(
+                    tzinfo=timezone.utc
+                )
+                return signed_at.timestamp() + int(expires[0])
+            except ValueError:
+                return None
+
+    for key in ("Expires", "expires"):
+        if key in query:
+            try:
+                return float(query[key][0])
+            except ValueError:
+                return None
+
+    return None
+
+
+class SignedUrlCache:
+    """Cache of signed download URLs keyed by object key that honours the URL expiry.
+
+    Safe to use from multiple threads. With `cache_file` the cache is shared between processes
+    through a JSON lines journal (mode 0600, the URLs grant access): `put` and `invalidate`
+    append one record under an exclusive `flock`, readers only parse the records appended
+    since their last read. Once the journal holds far more records than live links it is
+    compacted into a new file.
+    """
+
+    def __init__(
+        self,
+        cache_file: Path | None = None,
+        default_ttl: float = DEFAULT_TTL_S,
+        safety_margin: float = DEFAULT_SAFETY_MARGIN_S,
+    ) -> None:
+        self.cache_file: Path | None = cache_file
+        self.default_ttl: float = default_ttl
+        self.safety_margin: float = safety_margin
+        self._links: dict[str, SignedLink] = {}
+        self._lock: threading.Lock = threading.Lock()
+        # position up to which the journal was read and the inode it belongs to,
+        # a compaction by another process replaces the inode
+        self._file_offset: int = 0
+        self._file_inode: int | None = None
+        self._file_records: int = 0
+
+    def get(self, object_key: str) -> SignedLink | None:
+        """Returns a cached link that stays valid for at least the safety margin."""
+        with self._lock:
+            link = self._links.get(object_key)
+            if link is None or not self._is_usable(link):
+                self._reload_from_file()
+                link = self._links.get(object_key)
+            if link is None or not self._is_usable(link):
+                return None
+            return link
+
+    def put(
+        self, object_key: str, file_name: str, signed_url: str, file_size: int
+    ) -> SignedLink:
+        now: float = time.time()
+        expires_at: float | None = parse_url_expiry(signed_url)
+        link = SignedLink(
+            file_name=file_name,
+            signed_url=signed_url,
+            file_size=file_size,
+            obtained_at=now,
+            expires_at=expires_at if expires_at is not None else now + self.default_ttl,
+        )
+        with self._lock:
+            self._links[object_key] = link
+            self._append_to_file({"key": object_key, **asdict(link)})
+        return link
+
+    def invalidate(self, object_key: str) -> None:
+        """Drops a link, e.g. after the object store rejected it."""
+        with self._lock:
+            _ = self._links.pop(object_key, None)
+            self._append_to_file({"key": object_key, "removed": True})
+
+    def _is_usable(self, link: SignedLink) -> bool:
+        return link.expires_at - self.safety_margin > time.time()
+
+    def _reload_from_file(self) -> None:
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+        st = self.cache_file.stat()
+        if st.st_ino == self._file_inode and st.st_size == self._file_offset:
+            return
+        try:
+            with _locked(self.cache_file, fcntl.LOCK_SH):
+                self._read_new_records()
+        except OSError as e:
+            logger.warning(f"Could not read signed URL cache {self.cache_file}: {e}")
+
+    def _append_to_file(self, record: dict[str, str | int | float | bool]) -> None:
+        if self.cache_file is None:
+            return
+        try:
+            with _locked(self.cache_file, fcntl.LOCK_EX):
+                # catch up first, so links of other processes are not missed and the offset
+                # stays at the end of the file after our own record
+                self._read_new_records()
+                line: bytes = (json.dumps(record) + "\n").encode("utf-8")
+                fd = os.open(self.cache_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    _ = os.write(fd, line)
+                    self._file_inode = os.fstat(fd).st_ino
+                finally:
+                    os.close(fd)
+                self._file_offset += len(line)
+                self._file_records += 1
+
+                if self._file_records > max(COMPACT_MIN_RECORDS, 4 * len(self._links)):
+                    self._compact()
+        except OSError as e:
+            # the cache only saves sign requests, downloading continues without it
+            logger.warning(f"Could not write signed URL cache {self.cache_file}: {e}")
+
+    def _read_new_records(self) -> None:
+        """Applies the records appended since the last read. Needs the file lock."""
+        assert self.cache_file is not None
+        try:
+            f = open(self.cache_file, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            inode: int = os.fstat(f.fileno()).st_ino
+            if inode != self._file_inode:
+                # new or compacted file, it holds all live links
+                self._file_inode = inode
+                self._file_offset = 0
+                self._file_records = 0
+            _ = f.seek(self._file_offset)
+            data: bytes = f.read()
+
+        # a torn last line of a crashed writer is skipped for good
+        for line in data.splitlines(keepends=True):
+            self._file_offset += len(line)
+            self._file_records += 1
+            try:
+                record: dict[str, str | int | float | bool] = json.loads(line)
+                key = str(record.pop("key"))
+                if record.get("removed"):
+                    _ = self._links.pop(key, None)
+                else:
+                    self._links[key] = SignedLink(**record)  # pyright: ignore[reportArgumentType]
+            except (ValueError, TypeError, KeyError) as e:
+                logger.debug(f"Skipping unreadable record in signed URL cache {self.cache_file}: {e}")
+
+    def _compact(self) -> None:
+        """Rewrites the journal with the unexpired links only. Needs the exclusive file lock."""
+        assert self.cache_file is not None
+        now: float = time.time()
+        self._links = {k: v for k, v in self._links.items() if v.expires_at > now}
+        data: bytes = "".join(
+            json.dumps({"key": k, **asdict(v)}) + "\n" for k, v in self._links.items()
+        ).encode("utf-8")
+
+        tmp_file: Path = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            _ = os.write(fd, data)
+            inode: int = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        os.replace(tmp_file, self.cache_file)
+        self._file_inode = inode
+        self._file_offset = len(data)
+        self._file_records = len(self._links)
+
+
+class _locked:
+    """Holds an flock on '<path>.lock' for the duration of a `with` block."""
+
+    def __init__(self, path: Path, operation: int) -> None:
+        self.lock_path: Path = path.with_name(path.name + ".lock")
+        self.operation: int = operation
+        self.fd: int | None = None
+
+    def __enter__(self) -> None:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, self.operation)
+
+    def __exit__(self, *_: object) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -10,17 +10,29 @@ from starcloud_dl import (
     dl_file_list,
 )
 from sc_login import LoginCredentials, AuthData, performLogin
+from bandwidth import node_throttle_from_env
+from disk_space import guard_from_env
+import profiling
+from retry_queue import FailedFile, RetryPolicy, write_failed_report
+from signed_url_cache import SignedUrlCache
+from staging import DEFAULT_BATCH_SIZE, StagingArea
+import atexit
 import os
+from collections.abc import Mapping
 import json
 import itertools
 from pathlib import Path
-from dotenv import load_dotenv
 import logging
 import argparse
 import sys
+from typing import TYPE_CHECKING
 
-# --- Load .env ---
-_ = load_dotenv()
+# events, file claims, the file index, hedging and HTTP tracing are only imported
+# when their environment variables enable them
+if TYPE_CHECKING:
+    from events import EventSink
+    from file_claims import FileClaims
+    from hedging import Hedger
 
 
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -36,7 +48,7 @@ logger: Logger = logging.getLogger(name=__name__)
 
 
 
-def parse_args() -> tuple[list[int], list[str]]:
+def parse_args() -> tuple[list[int], list[str], bool]:
     parser = argparse.ArgumentParser()
     _ = parser.add_argument(
         "--slurm-years",
@@ -52,14 +64,26 @@ def parse_args() -> tuple[list[int], list[str]]:
         help='JSON array of tiles (e.g. --slurm-tiles \'["tileA","tileB"]\')',
     )
 
+    _ = parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the task and write the results to S_PROFILE_DIR (defaults to ./profiles)",
+    )
+
     args = parser.parse_args()
 
     slurm_years: list[int] = args.slurm_years
     slurm_tiles: list[str] = args.slurm_tiles
+    profile: bool = args.profile
 
-    return slurm_years, slurm_tiles
+    return slurm_years, slurm_tiles, profile
 
 if __name__ == "__main__":
+    # --- Load .env ---, only when run as a task, importing the module stays cheap
+    from dotenv import load_dotenv
+
+    _ = load_dotenv()
+
     if (
         # "S_TILES" not in os.environ
         # or "S_YEARS" not in os.environ
@@ -71,13 +95,30 @@ if __name__ == "__main__":
             "If executed by slurm the tasks need to know which keys are handled! S_ROOT_DIR need to be set need to be set!"
         )
 
-    slurm_years, slurm_tiles = parse_args()
+    slurm_years, slurm_tiles, profile = parse_args()
 
     chunks = int(os.getenv("S_SPLIT_FILES", "1"))
 
     working_dir: Path = Path(os.environ.get("SLURM_SUBMIT_DIR", "."))
     root_dir: Path = Path(os.environ["S_ROOT_DIR"])
 
+    stats_file: Path | None = (
+        Path(os.environ["S_STATS_FILE"]) if os.getenv("S_STATS_FILE") else None
+    )
+
+    # hedging of the file list and sign requests against their tail latency
+    hedger: "Hedger | None" = None
+    if os.getenv("S_HEDGE_PERCENTILE"):
+        from hedging import HedgePolicy, Hedger
+
+        hedger = Hedger(HedgePolicy(percentile=float(os.environ["S_HEDGE_PERCENTILE"])))
+
+    url_cache = SignedUrlCache(
+        cache_file=Path(os.environ["S_URL_CACHE_FILE"])
+        if os.getenv("S_URL_CACHE_FILE")
+        else None
+    )
+
     slurm_array_job_id: str | None = os.getenv("SLURM_ARRAY_TASK_ID")
 
     if slurm_array_job_id is None:
@@ -92,6 +133,20 @@ if __name__ == "__main__":
         itertools.product(slurm_tiles, slurm_years, range(chunks))
     )[job_index]
 
+    if profile:
+        _ = profiling.enable(
+            output_dir=Path(os.getenv("S_PROFILE_DIR", str(working_dir / "profiles"))),
+            name=f"profile_{os.getenv('SLURM_ARRAY_JOB_ID', 'local')}_{job_index}_{tile_id}_{year}",
+        )
+        # the task exits through sys.exit in several places
+        atexit.register(profiling.finish)
+
+    # S_HTTP_TRACE records the traffic shape of the task for offline replays (http_trace.py)
+    if os.getenv("S_HTTP_TRACE"):
+        from http_trace import record_from_env
+
+        _ = record_from_env()
+
     creds: LoginCredentials = loadCredsFromEnv(envfilePath=working_dir / ".env")
 
     # t_before_index: float = time.perf_counter()
@@ -103,54 +158,134 @@ if __name__ == "__main__":
         target_dir.mkdir(parents=True, exist_ok=True)
         logger.debug(f"Created directory {target_dir}")
 
-    # fetch already loaded files
-    file_index: dict[str, int] | None = (
-        indexAlreadyDownloadedFiles(path=target_dir)
-        if bool(os.getenv("S_CREATE_INDEX"))
-        else None
-    )
-
-    # logger.info(msg=f'Perf loading index: {(time.perf_counter() - t_before_index):.3f}')
+    # completion events let downstream processing start on each file as soon as it lands
+    events: "EventSink | None" = None
+    if os.getenv("S_EVENT_SINK"):
+        from events import sink_from_env
 
-    # set CHunk choosing
-    list_split_chooser = ListSplitChoose(i=chunk_id, n=chunks)
+        events = sink_from_env()
 
-    try:
-        file_names = get_filenames_for_id(
+    # in staging mode files go to node-local scratch first, opening the staging area
+    # commits files that a crashed task left verified but uncommitted
+    staging: StagingArea | None = None
+    if os.getenv("S_STAGING_DIR"):
+        staging = StagingArea(
+            staging_root=Path(os.environ["S_STAGING_DIR"]),
+            archive_root=root_dir,
             tile_id=tile_id,
             year=year,
-            index=file_index,
-            list_split_chooser=list_split_chooser,
-            write_resp_to_disk=target_dir
+            batch_size=int(os.getenv("S_STAGING_BATCH", str(DEFAULT_BATCH_SIZE))),
+            events=events,
         )
-    except Exception as e:
-        logger.error(f"Error accessing file list: {str(e)}")
-        sys.exit(1)
-
-    if len(file_names) == 0:
-        logger.info(
-            f"No files left for array task {job_index}, {tile_id}, {year}, {list_split_chooser}: Exiting..."
-        )
-        sys.exit(0)
-    else:
-        logger.info(msg=f"Found {len(file_names)} for downloading!")
-
-    try:
-        authData: AuthData = performLogin(creds)
-    except Exception as e:
-        logger.error(f"Error authenticating for star cloud: {str(e)}")
-        sys.exit(1)
+        staging.open()
 
+    # the early exits below also have to close staging and the event sink and stop the hedger
+    failures: list[FailedFile] = []
     try:
-        dl_file_list(
-            tile_id=tile_id,
-            year=year,
-            target_dir=target_dir,
-            auth=authData,
-            filename_list=file_names,
-            show_live_progress=False,
-            chunk_size=DEFAULT_CHUNK_SIZE * 4,
-            log_time=True,
+        # fetch already loaded files
+        file_index: Mapping[str, int] | None = None
+        if os.getenv("S_FILE_INDEX") and Path(os.environ["S_FILE_INDEX"]).is_file():
+            from file_index import CheckedLookup, open_file_index
+
+            # prebuilt index, names it does not know are checked on disk
+            file_index = CheckedLookup(
+                index=open_file_index(Path(os.environ["S_FILE_INDEX"])).tile_year(tile_id, year),
+                directory=target_dir,
+            )
+        elif bool(os.getenv("S_CREATE_INDEX")):
+            file_index = indexAlreadyDownloadedFiles(path=target_dir)
+
+        # logger.info(msg=f'Perf loading index: {(time.perf_counter() - t_before_index):.3f}')
+
+        # set CHunk choosing
+        list_split_chooser = ListSplitChoose(i=chunk_id, n=chunks)
+
+        try:
+            file_names = get_filenames_for_id(
+                tile_id=tile_id,
+                year=year,
+                index=file_index,
+                list_split_chooser=list_split_chooser,
+                write_resp_to_disk=target_dir,
+                hedger=hedger,
+            )
+        except Exception as e:
+            logger.error(f"Error accessing file list: {str(e)}")
+            sys.exit(1)
+
+        if len(file_names) == 0:
+            logger.info(
+                f"No files left for array task {job_index}, {tile_id}, {year}, {list_split_chooser}: Exiting..."
+            )
+            sys.exit(0)
+        else:
+            logger.info(msg=f"Found {len(file_names)} for downloading!")
+
+        try:
+            with profiling.phase("login"):
+                authData: AuthData = performLogin(creds)
+        except Exception as e:
+            logger.error(f"Error authenticating for star cloud: {str(e)}")
+            sys.exit(1)
+
+        # the async backend keeps many downloads of this task in flight on one event loop
+        dl_files = dl_file_list
+        backend_args: dict[str, int] = {}
+        if os.getenv("S_BACKEND", "threads") == "async":
+            import async_dl
+
+            dl_files = async_dl.dl_file_list
+            backend_args = {"concurrency": int(os.getenv("S_CONCURRENCY", "32"))}
+
+        # refill runs and the daemon download into the same archive as array tasks, so claims
+        # are on unless S_FILE_CLAIMS=0
+        claims: "FileClaims | None" = None
+        if os.getenv("S_FILE_CLAIMS") != "0":
+            from file_claims import claims_from_env
+
+            claims = claims_from_env(default=True)
+
+        try:
+            failures = dl_files(
+                tile_id=tile_id,
+                year=year,
+                target_dir=target_dir,
+                auth=authData,
+                filename_list=file_names,
+                show_live_progress=False,
+                chunk_size=DEFAULT_CHUNK_SIZE * 4,
+                log_time=True,
+                stats_file=stats_file,
+                staging=staging,
+                url_cache=url_cache,
+                hedger=hedger,
+                retry_policy=RetryPolicy(
+                    max_attempts=int(os.getenv("S_MAX_ATTEMPTS", "5"))
+                ),
+                relogin=lambda: performLogin(creds),
+                throttle=node_throttle_from_env(),
+                disk_guard=guard_from_env(),
+                events=events,
+                claims=claims,
+                **backend_args,
+            )
+        except Exception as e:
+            logger.error(msg=f"Error during fetching data. Reason: {str(e)}")
+            sys.exit(1)
+    finally:
+        if staging is not None:
+            staging.close()
+        if events is not None:
+            events.close()
+        if hedger is not None:
+            hedger.shutdown()
+
+    if failures:
+        logger.error(
+            f"{len(failures)} files of array task {job_index}, {tile_id}, {year}, {list_split_chooser} could not be downloaded!"
         )
-    except Exception as e:
-        logger.error(msg=f"Error during fetching data. Reason: {str(e)}")
+        failed_dir: Path = Path(os.getenv("S_FAILED_DIR", str(working_dir / "failed_files")))
+        report_file: Path = failed_dir / f"failed_{tile_id}_{year}_{chunk_id}.csv"
+        write_failed_report(report_file, failures)
+        logger.info(f"Wrote failed files to {report_file}")
+        sys.exit(1)
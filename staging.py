@@ -0,0 +1,299 @@
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from events import EventSink
+    from file_claims import FileClaim
+
+logger: logging.Logger = logging.getLogger(name=__name__)
+
+DEFAULT_BATCH_SIZE: int = 25
+
+JOURNAL_NAME: str = "staged.jsonl"
+ACTIVE_LOCK_NAME: str = ".active"
+
+
+@dataclass
+class StagedFile:
+    filename: str
+    size: int
+    sha256: str | None = None
+
+
+class StagingArea:
+    """Stages downloads of one tile and year on node-local scratch and moves them into the archive in batches.
+
+    Files are downloaded to '<staging_root>/<year>/<tile>/', verified by size and recorded in a journal.
+    Every `batch_size` files the verified files are moved to '<archive_root>/<year>/<tile>/' and the
+    archive directory is synced once. Journaled files that were not moved because the process died
+    are committed by the next `StagingArea` opened for the same tile and year on the node.
+    With `events` a completion event is published for every file moved into the archive.
+    Claims handed to `stage` are held until the file was committed, so that no other process
+    sees the file neither claimed nor in the archive.
+    """
+
+    def __init__(
+        self,
+        staging_root: Path,
+        archive_root: Path,
+        tile_id: str,
+        year: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        events: "EventSink | None" = None,
+    ) -> None:
+        self.tile_id: str = tile_id
+        self.year: int = year
+        self.events: EventSink | None = events
+        self.staging_dir: Path = staging_root / str(year) / tile_id
+        self.archive_dir: Path = archive_root / str(year) / tile_id
+        self.batch_size: int = batch_size
+        self.pending: list[StagedFile] = []
+        self.recovered: list[StagedFile] = []
+        self._claims: dict[str, FileClaim] = {}
+        # stage and commit are called from several download threads
+        self._lock: threading.RLock = threading.RLock()
+        self._active_fd: int | None = None
+
+    def __enter__(self) -> "StagingArea":
+        self.open()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Creates the staging directory and recovers files left over by crashed runs."""
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self._active_fd = os.open(
+            self.staging_dir / ACTIVE_LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o644
+        )
+
+        # Only if no other process stages into this directory, unjournaled files are
+        # partial downloads of crashed runs and can be removed.
+        try:
+            fcntl.flock(self._active_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            is_exclusive = True
+        except BlockingIOError:
+            is_exclusive = False
+
+        self.recovered = self.recover(remove_partials=is_exclusive)
+        if self.recovered:
+            logger.info(
+                f"Recovered {len(self.recovered)} staged files from a previous run into {self.archive_dir}"
+            )
+
+        # stay registered as active stager for the lifetime of this area
+        fcntl.flock(self._active_fd, fcntl.LOCK_SH)
+
+    def close(self) -> None:
+        """Commits all remaining verified files and releases the staging directory."""
+        try:
+            _ = self.commit()
+        finally:
+            if self._active_fd is not None:
+                os.close(self._active_fd)
+                self._active_fd = None
+
+    def stage(
+        self,
+        filename: str,
+        expected_size: int,
+        sha256: str | None = None,
+        claim: "FileClaim | None" = None,
+    ) -> None:
+        """Verifies a downloaded file in the staging directory and journals it for the next commit.
+        A `claim` on the file is released once it was committed.
+        """
+        staged_path: Path = self.staging_dir / filename
+        actual_size: int = staged_path.stat().st_size
+        if actual_size != expected_size:
+            staged_path.unlink(missing_ok=True)
+            raise RuntimeError(
+                f"Staged file {filename} has {actual_size} bytes, expected {expected_size}!"
+            )
+
+        staged = StagedFile(filename=filename, size=expected_size, sha256=sha256)
+        with self._journal_lock():
+            with open(self.staging_dir / JOURNAL_NAME, "a") as f:
+                _ = f.write(_journal_line(staged))
+                f.flush()
+                os.fsync(f.fileno())
+        with self._lock:
+            self.pending.append(staged)
+            if claim is not None:
+                self._claims[filename] = claim
+
+            if len(self.pending) >= self.batch_size:
+                _ = self.commit()
+
+    def commit(self) -> int:
+        """Moves all pending files of this process into the archive. Returns the number of moved files."""
+        with self._lock:
+            if not self.pending:
+                return 0
+            try:
+                with self._journal_lock():
+                    moved: list[StagedFile] = self._commit_files(self.pending)
+                    self._drop_from_journal({f.filename for f in self.pending})
+            finally:
+                for staged in self.pending:
+                    claim: FileClaim | None = self._claims.pop(staged.filename, None)
+                    if claim is not None:
+                        claim.release()
+            logger.debug(f"Committed {len(moved)} staged files to {self.archive_dir}")
+            self.pending = []
+            return len(moved)
+
+    def recover(self, remove_partials: bool = False) -> list[StagedFile]:
+        """Commits journaled files of earlier runs and returns them.
+        With `remove_partials` unjournaled (partial) downloads are deleted.
+        """
+        with self._journal_lock():
+            journaled: list[StagedFile] = self._read_journal()
+            moved: list[StagedFile] = self._commit_files(journaled)
+            self._drop_from_journal({f.filename for f in journaled})
+
+            if remove_partials:
+                for partial in [
+                    *self.staging_dir.glob("*.tif"),
+                    *self.staging_dir.glob("*.tif.part"),
+                ]:
+                    logger.debug(f"Removing partial staged download {partial}")
+                    partial.unlink(missing_ok=True)
+        return moved
+
+    def _commit_files(self, files: list[StagedFile]) -> list[StagedFile]:
+        moved: list[StagedFile] = []
+        for staged in files:
+            src: Path = self.staging_dir / staged.filename
+            dst: Path = self.archive_dir / staged.filename
+
+            if not src.exists():
+                # already committed by another process or by a recovery
+                continue
+            if src.stat().st_size != staged.size:
+                logger.warning(f"Dropping staged file {src} with unexpected size")
+                src.unlink()
+                continue
+
+            if not moved and not self.archive_dir.exists():
+                self.archive_dir.mkdir(parents=True, exist_ok=True)
+            _move_into_archive(src=src, dst=dst)
+            moved.append(staged)
+
+        if moved:
+            _fsync_dir(self.archive_dir)
+            if self.events is not None:
+                from events import CompletionEvent, file_sha256
+
+                for staged in moved:
+                    dst = self.archive_dir / staged.filename
+                    self.events.publish(
+                        CompletionEvent.for_file(
+                            dst,
+                            tile=self.tile_id,
+                            year=self.year,
+                            size=staged.size,
+                            sha256=staged.sha256 or file_sha256(dst),
+                        )
+                    )
+        return moved
+
+    def _read_journal(self) -> list[StagedFile]:
+        journal: Path = self.staging_dir / JOURNAL_NAME
+        if not journal.exists():
+            return []
+        res: list[StagedFile] = []
+        for line in journal.read_text().splitlines():
+            try:
+                entry = json.loads(line)  # pyright: ignore[reportAny]
+                res.append(
+                    StagedFile(
+                        filename=str(entry["filename"]),  # pyright: ignore[reportAny]
+                        size=int(entry["size"]),  # pyright: ignore[reportAny]
+                        sha256=entry.get("sha256"),  # pyright: ignore[reportAny]
+                    )
+                )
+            except (ValueError, KeyError, TypeError):
+                # torn last line of a crashed write, the file gets re-downloaded
+                continue
+        return res
+
+    def _drop_from_journal(self, filenames: set[str]) -> None:
+        remaining: list[StagedFile] = [
+            f for f in self._read_journal() if f.filename not in filenames
+        ]
+        journal: Path = self.staging_dir / JOURNAL_NAME
+        tmp_journal: Path = self.staging_dir / (JOURNAL_NAME + ".tmp")
+        _ = tmp_journal.write_text("".join(_journal_line(f) for f in remaining))
+        os.replace(tmp_journal, journal)
+
+    def _journal_lock(self) -> "_FileLock":
+        return _FileLock(self.staging_dir / (JOURNAL_NAME + ".lock"))
+
+
+def _journal_line(staged: StagedFile) -> str:
+    entry: dict[str, str | int] = {"filename": staged.filename, "size": staged.size}
+    if staged.sha256 is not None:
+        entry["sha256"] = staged.sha256
+    return json.dumps(entry) + "\n"
+
+
+class _FileLock:
+    def __init__(self, path: Path) -> None:
+        self.path: Path = path
+        self.fd: int | None = None
+
+    def __enter__(self) -> None:
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _move_into_archive(src: Path, dst: Path) -> None:
+    """Moves `src` to `dst` so that `dst` never exists half written, also across filesystems."""
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    incoming: Path = dst.with_name(dst.name + ".incoming")
+    with open(src, "rb") as fsrc, open(incoming, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, length=16 * 1024 * 1024)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    os.replace(incoming, dst)
+    src.unlink()
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
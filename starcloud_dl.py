@@ -1,4 +1,3 @@
-from requests.sessions import Session
 from sc_login import AuthData, LoginCredentials, performLogin
 
 from logging import Logger
@@ -6,19 +5,46 @@ from logging import Logger
 
 from argparse import ArgumentParser, Namespace
 import argparse
+import atexit
+import hashlib
 from dataclasses import dataclass, field
 import requests
 import os
-from dotenv import load_dotenv
-from typing import Any, Generator, TypeVar
+from collections.abc import Mapping
+from typing import TYPE_CHECKING, Any, Callable, Generator, TypeVar
 from pathlib import Path
 import logging
 import sys
+import threading
 import time
 import json
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bandwidth import MB, NodeTokenBucket, Throttle
+from disk_space import GB, DiskSpaceGuard, InsufficientDiskSpace, is_out_of_space, part_path
+import profiling
+from retry_queue import (
+    ERROR_AUTH,
+    ERROR_PERMANENT,
+    FailedFile,
+    RetryPolicy,
+    RetryQueue,
+    classify_error,
+    write_failed_report,
+)
+from signed_url_cache import SignedLink, SignedUrlCache
+from staging import StagingArea
+from transfer_stats import (
+    IN_FLIGHT,
+    RunningTransfer,
+    append_transfer_stat,
+    current_concurrency,
+    make_transfer_stat,
+)
 
+# only loaded when events, claims or hedging are enabled
+if TYPE_CHECKING:
+    from events import EventSink
+    from file_claims import FileClaim, FileClaims
+    from hedging import Hedger
 
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
 
@@ -54,6 +80,14 @@ class ListSplitChoose:
         return list[list[A]](_split_into_n(seq=seq, n_parts=self.n))[self.i]
 
 
+class ApiRequestError(RuntimeError):
+    """A Starcloud API request was answered with an error status."""
+
+    def __init__(self, message: str, status_code: int) -> None:
+        self.status_code: int = status_code
+        super().__init__(message)
+
+
 def requireEnv(value: T | None, name: str = "value") -> T:
     """Helper function to assure type-safety."""
     if value is None:
@@ -69,14 +103,17 @@ def indexAlreadyDownloadedFiles(path: Path) -> dict[str, int]:
     """
     logger.debug(f"Creating index of already downloaded files in '{path}' ...")
     fileIndex: dict[str, int] = {}
-    for file in path.rglob("*.tif"):
-        if file.is_file():
-            fileSize: int = file.stat().st_size
-            fileIndex[file.name] = fileSize
+    with profiling.phase("index"):
+        for file in path.rglob("*.tif"):
+            if file.is_file():
+                fileSize: int = file.stat().st_size
+                fileIndex[file.name] = fileSize
     return fileIndex
 
 
 def loadCredsFromEnv(envfilePath: Path | str) -> LoginCredentials:
+    from dotenv import load_dotenv
+
     if not load_dotenv(dotenv_path=envfilePath):
         raise RuntimeError(f".env file with path: '{envfilePath}' could not be found!")
     email: str = requireEnv(os.getenv("STAR_EMAIL"), "STAR_EMAIL")
@@ -130,41 +167,182 @@ def _getCLIArgs() -> Namespace:
         help="Flag to disable progress output when downloading files. This is useful when running multiple instances of this script in parallel.",
         action="store_false",
     )
+    _ = parser.add_argument(
+        "--stats-file",
+        help="CSV file to which per-file transfer telemetry (sizes, sign and download times) is appended. Used by 'plan_download.py' to estimate download durations.",
+        default=os.getenv("S_STATS_FILE"),
+        type=str,
+    )
+    _ = parser.add_argument(
+        "--staging-dir",
+        help="Node-local scratch directory. If set, files are downloaded there, verified by size and moved to the output directory in batches.",
+        default=os.getenv("S_STAGING_DIR"),
+        type=str,
+    )
+    _ = parser.add_argument(
+        "--url-cache-file",
+        help="JSON file in which signed download URLs are cached until they expire. Shared by all processes using the same file.",
+        default=os.getenv("S_URL_CACHE_FILE"),
+        type=str,
+    )
+    _ = parser.add_argument(
+        "--hedge-percentile",
+        help="Enables hedging of the file list and sign requests: a second request is sent if the first takes longer than this latency percentile (e.g. 0.95).",
+        default=float(os.environ["S_HEDGE_PERCENTILE"])
+        if os.getenv("S_HEDGE_PERCENTILE")
+        else None,
+        type=float,
+    )
+    _ = parser.add_argument(
+        "--max-attempts",
+        help="Maximum number of download attempts per file. Transient errors are retried with exponential backoff after the other files.",
+        default=int(os.getenv("S_MAX_ATTEMPTS", "5")),
+        type=int,
+    )
+    _ = parser.add_argument(
+        "--failed-report",
+        help="CSV file to which the files that could not be downloaded are written",
+        default=None,
+        type=str,
+    )
+    _ = parser.add_argument(
+        "--min-free-gb",
+        help="Free space in GB that must remain on the output (or staging) file system. Files are only started if they fit, once one does not the run stops.",
+        default=float(os.getenv("S_MIN_FREE_GB", "0")),
+        type=float,
+    )
+    _ = parser.add_argument(
+        "--preallocate",
+        help="Allocate the full size of a file before streaming it, so other processes see the space as taken. Only useful where the file system supports fallocate natively.",
+        action="store_true",
+        default=bool(os.getenv("S_PREALLOCATE")),
+    )
+    _ = parser.add_argument(
+        "--quota-cmd",
+        help="Shell command printing the bytes left in the user or project quota ('{path}' is replaced by the output directory). Limits the free space the files must fit in.",
+        default=os.getenv("S_QUOTA_CMD"),
+        type=str,
+    )
+    _ = parser.add_argument(
+        "--node-max-mbps",
+        help="Bandwidth cap in MB/s shared by all downloader processes on this node that set it (e.g. several instances started with 'xargs -P')",
+        default=float(os.environ["S_NODE_MAX_MBPS"]) if os.getenv("S_NODE_MAX_MBPS") else None,
+        type=float,
+    )
+    _ = parser.add_argument(
+        "--backend",
+        help="Download engine: 'threads' downloads one file after another, 'async' runs many downloads concurrently on an event loop (needs aiohttp)",
+        choices=["threads", "async"],
+        default=os.getenv("S_BACKEND", "threads"),
+    )
+    _ = parser.add_argument(
+        "--concurrency",
+        help="Maximum number of concurrent downloads of the async backend",
+        default=int(os.getenv("S_CONCURRENCY", "32")),
+        type=int,
+    )
+    _ = parser.add_argument(
+        "--event-sink",
+        help="Publish a completion event (path, tile, year, size, sha256) for every downloaded file: 'jsonl:<file>', 'fifo:<path>' or 'unix:<path>'",
+        default=os.getenv("S_EVENT_SINK"),
+        type=str,
+    )
+    _ = parser.add_argument(
+        "--profile",
+        help="Profile the run (cProfile, tracemalloc and wall time per phase: login, list, sign, connect, transfer, write, index)",
+        action="store_true",
+    )
+    _ = parser.add_argument(
+        "--profile-dir",
+        help="Directory the profiling results are written to",
+        default=os.getenv("S_PROFILE_DIR", "./profiles"),
+        type=str,
+    )
     return parser.parse_args()
 
 
-def getFileListPage(tileName: str, year: int) -> dict[str, list[dict[str, int | str]]]:
+_threadLocal = threading.local()
+
+_sessionFactory: Callable[[], requests.Session] = requests.Session
+
+
+def set_session_factory(factory: Callable[[], requests.Session]) -> None:
+    """Replaces how the HTTP sessions of new threads are created, e.g. by the recording
+    or replaying sessions of `http_trace.py`. Call it before the first request.
+    """
+    global _sessionFactory
+    _sessionFactory = factory
+
+
+def _http() -> requests.Session:
+    """HTTP session of the current thread. Reusing it keeps connections to the API and object store alive."""
+    session: requests.Session | None = getattr(_threadLocal, "session", None)
+    if session is None:
+        session = _sessionFactory()
+        _threadLocal.session = session
+    return session
+
+
+def _postJSON(
+    url: str,
+    payload: dict[str, Any],
+    headers: dict[str, str] | None = None,
+    hedger: "Hedger | None" = None,
+    endpoint: str = "",
+) -> requests.Response:
+    """POSTs a JSON payload. With `hedger` a second request is sent if the first is slow (see `hedging.py`)."""
+    if hedger is None:
+        return _http().post(url=url, headers=headers, json=payload)
+
+    def _send() -> requests.Response:
+        return _http().post(
+            url=url,
+            headers=headers,
+            json=payload,
+            timeout=hedger.policy.request_timeout_s,
+        )
+
+    # an error response of one request must not win against a good one of the other
+    return hedger.call(
+        endpoint=endpoint, fn=_send, accept=lambda r: 200 <= r.status_code < 300
+    )
+
+
+def getFileListPage(
+    tileName: str, year: int, hedger: "Hedger | None" = None
+) -> dict[str, list[dict[str, int | str]]]:
     """Retrieves a list of available tile files for a given tile and year."""
-    FILE_PAGE_URL = (
-        "https://data-starcloud.pcl.ac.cn/aiforearth/api/data/getFileListByPage"
+    payload: dict[str, dict[str, int | bool | str]] = _fileListPayload(
+        tileName=tileName, year=year
     )
-    payload: dict[str, dict[str, int | bool | str]] = {  # noqa: F821
-        "params": {
-            "count": 100,
-            "enableSpatialQuery": False,
-            "page": 1,
-            "path": f"CSDC_samples/SDC_V003/{tileName}/{year}",
-            "table": "rs_csdc30",
-        }
-    }
-    response: requests.Response = requests.post(url=FILE_PAGE_URL, json=payload)
+    with profiling.phase("list"):
+        response: requests.Response = _postJSON(
+            url=FILE_PAGE_URL,
+            payload=payload,
+            hedger=hedger,
+            endpoint="getFileListByPage",
+        )
     if response.status_code != 200:
-        raise RuntimeError(
-            f"Could not fetch FileList Page! Code: {response.status_code}, Reason: {response.text}"
+        raise ApiRequestError(
+            f"Could not fetch FileList Page! Code: {response.status_code}, Reason: {response.text}",
+            status_code=response.status_code,
         )
     return response.json()  # pyright: ignore[reportAny]
 
 
-def get_filenames_for_id(
+def get_file_entries_for_id(
     tile_id: str,
     year: int,
-    index: dict[str, int] | None = None,
     list_split_chooser: ListSplitChoose | None = None,
     write_resp_to_disk: Path | None = None,
-) -> list[str]:
+    hedger: "Hedger | None" = None,
+) -> list[dict[str, int | str]]:
+    """Retrieves the file list (name and size) of a tile and year.
+    If `write_resp_to_disk` is given the response is cached as 'expected_files_<year>_<tile>.json' there.
+    """
     if write_resp_to_disk is None:
         resp_json: dict[str, list[dict[str, int | str]]] = getFileListPage(
-            tileName=tile_id, year=year
+            tileName=tile_id, year=year, hedger=hedger
         )
     else:
         resp_file_name = f"expected_files_{year}_{tile_id}.json"
@@ -178,7 +356,7 @@ def get_filenames_for_id(
             resp_json = json.loads(target_file.read_text())  # pyright: ignore[reportAny]
         else:
             resp_json: dict[str, list[dict[str, int | str]]] = getFileListPage(
-                tileName=tile_id, year=year
+                tileName=tile_id, year=year, hedger=hedger
             )
             _ = target_file.write_text(json.dumps(resp_json))
 
@@ -187,6 +365,25 @@ def get_filenames_for_id(
     if list_split_chooser is not None:
         list_of_file_dicts = list_split_chooser.get_sublist(seq=list_of_file_dicts)
 
+    return list_of_file_dicts
+
+
+def get_filenames_for_id(
+    tile_id: str,
+    year: int,
+    index: Mapping[str, int] | None = None,
+    list_split_chooser: ListSplitChoose | None = None,
+    write_resp_to_disk: Path | None = None,
+    hedger: "Hedger | None" = None,
+) -> list[str]:
+    list_of_file_dicts = get_file_entries_for_id(
+        tile_id=tile_id,
+        year=year,
+        list_split_chooser=list_split_chooser,
+        write_resp_to_disk=write_resp_to_disk,
+        hedger=hedger,
+    )
+
     if index is None:
         return [str(resp["file"]) for resp in list_of_file_dicts]
     else:
@@ -197,37 +394,99 @@ def get_filenames_for_id(
         ]
 
 
-def _getRandomAssSignedFileLink(
-    filename: str, tileName: str, year: int, auth: AuthData
-) -> tuple[str, str, int]:
-    """Retrieves a signed file URL and its file size based on a tileName and given filename. This URL can be used to download the file."""
-    LINK_GEN_URL = (
-        "https://data-starcloud.pcl.ac.cn/starcloud/api/file/downloadResource"
-    )
-    OBJECT_KEY: str = f"shared-dataset/CSDC_samples/CSDC_samples/SDC_V003/{tileName}/{year}/{filename}"
-    auth_header: dict[str, str] = {"Authorization": f"Bearer {auth.token}"}
-    payload: dict[str, int | str] = {
+FILE_PAGE_URL: str = (
+    "https://data-starcloud.pcl.ac.cn/aiforearth/api/data/getFileListByPage"
+)
+LINK_GEN_URL: str = (
+    "https://data-starcloud.pcl.ac.cn/starcloud/api/file/downloadResource"
+)
+
+
+def _fileListPayload(tileName: str, year: int) -> dict[str, dict[str, int | bool | str]]:
+    return {
+        "params": {
+            "count": 100,
+            "enableSpatialQuery": False,
+            "page": 1,
+            "path": f"CSDC_samples/SDC_V003/{tileName}/{year}",
+            "table": "rs_csdc30",
+        }
+    }
+
+
+def _signPayload(objectKey: str, auth: AuthData) -> dict[str, int | str]:
+    return {
         "country": "Germany",
-        "objectKey": OBJECT_KEY,
+        "objectKey": objectKey,
         "resourceId": 26,
         "resourceType": "REMOTE_SENSING",
         "userAccount": auth.userName,
         "userId": auth.id,
     }
-    response: requests.Response = requests.post(
-        url=LINK_GEN_URL, headers=auth_header, json=payload
-    )
+
+
+def _objectKey(filename: str, tileName: str, year: int) -> str:
+    return f"shared-dataset/CSDC_samples/CSDC_samples/SDC_V003/{tileName}/{year}/{filename}"
+
+
+def _signedUrlCacheKey(filename: str, tileName: str, year: int, auth: AuthData) -> str:
+    # signed URLs are issued per user
+    return f"{auth.id}:{_objectKey(filename=filename, tileName=tileName, year=year)}"
+
+
+def _getRandomAssSignedFileLink(
+    filename: str,
+    tileName: str,
+    year: int,
+    auth: AuthData,
+    url_cache: SignedUrlCache | None = None,
+    hedger: "Hedger | None" = None,
+) -> tuple[str, str, int]:
+    """Retrieves a signed file URL and its file size based on a tileName and given filename. This URL can be used to download the file.
+    With `url_cache` a still valid URL signed earlier is reused instead of signing again.
+    """
+    OBJECT_KEY: str = _objectKey(filename=filename, tileName=tileName, year=year)
+
+    if url_cache is not None:
+        cached: SignedLink | None = url_cache.get(
+            _signedUrlCacheKey(filename=filename, tileName=tileName, year=year, auth=auth)
+        )
+        if cached is not None:
+            logger.debug(f"Reusing cached signed URL for {filename}")
+            return (cached.file_name, cached.signed_url, cached.file_size)
+
+    auth_header: dict[str, str] = {"Authorization": f"Bearer {auth.token}"}
+    payload: dict[str, int | str] = _signPayload(objectKey=OBJECT_KEY, auth=auth)
+    with profiling.phase("sign"):
+        response: requests.Response = _postJSON(
+            url=LINK_GEN_URL,
+            payload=payload,
+            headers=auth_header,
+            hedger=hedger,
+            endpoint="downloadResource",
+        )
     if response.status_code != 200:
-        raise RuntimeError(
-            f"Could not fetch signed file URL! Code: {response.status_code}, Reason: {response.text}"
+        raise ApiRequestError(
+            f"Could not fetch signed file URL! Code: {response.status_code}, Reason: {response.text}",
+            status_code=response.status_code,
         )
     responseBody = response.json()  # pyright: ignore[reportAny]
-    return (
+    signedLink: tuple[str, str, int] = (
         str(responseBody["fileName"]),  # pyright: ignore[reportAny]
         str(responseBody["signedUrl"]),  # pyright: ignore[reportAny]
         int(responseBody["fileSize"]),  # pyright: ignore[reportAny]
     )
 
+    if url_cache is not None:
+        _ = url_cache.put(
+            _signedUrlCacheKey(filename=filename, tileName=tileName, year=year, auth=auth),
+            file_name=signedLink[0],
+            signed_url=signedLink[1],
+            file_size=signedLink[2],
+        )
+
+    return signedLink
+
 
 def _downloadTIFFile(
     url: str,
@@ -235,7 +494,17 @@ def _downloadTIFFile(
     filename: str,
     isProgressShown: bool = True,
     chunkSize: int = DEFAULT_CHUNK_SIZE,
-) -> None:
+    throttle: Throttle | None = None,
+    expectedSize: int | None = None,
+    diskGuard: DiskSpaceGuard | None = None,
+    checksum: "hashlib._Hash | None" = None,
+    progress: RunningTransfer | None = None,
+) -> int:
+    """Streams the file behind `url` to `outDir / filename` and returns the number of bytes written.
+    The file is written as '<filename>.part' and renamed once complete, a failed download removes it.
+    With `diskGuard` the file is only started if it fits and its size is preallocated.
+    `checksum` is updated with every written chunk, `progress` counts the written bytes.
+    """
     # response: requests.Response = requests.get(url, stream=True)
     # if response.status_code != 200:
     #     raise RuntimeError(
@@ -245,22 +514,71 @@ def _downloadTIFFile(
     if not isProgressShown:
         logger.debug(f"Downloading {filename}")
 
-    with requests.get(url, stream=True) as response:
+    # time spent waiting for the network and writing to disk, only reported when profiling
+    transferTime: float = 0.0
+    writeTime: float = 0.0
+    tConnect: float = time.perf_counter()
+
+    with _http().get(url, stream=True) as response:
+        profiling.add_phase_time("connect", time.perf_counter() - tConnect)
         response.raise_for_status()
         total = int(response.headers.get("Content-Length", 0))
+        if expectedSize is None:
+            expectedSize = total
+
+        partFile: Path = part_path(outDir / filename)
+        reserved: int = 0
+        try:
+            with open(partFile, "wb") as f:
+                if diskGuard is not None:
+                    reserved = diskGuard.allocate(f, directory=outDir, n_bytes=expectedSize)
+                tChunkRequested: float = time.perf_counter()
+                for chunk in response.iter_content(chunk_size=chunkSize):
+                    tChunkReceived: float = time.perf_counter()
+                    transferTime += tChunkReceived - tChunkRequested
+                    if chunk:
+                        if throttle is not None:
+                            throttle.consume(len(chunk))
+                        f.write(chunk)
+                        if checksum is not None:
+                            checksum.update(chunk)
+                        downloaded += len(chunk)
+                        if progress is not None:
+                            progress.bytes = downloaded
+                        if isProgressShown:
+                            print(
+                                f"\rDownloading {filename}: {round(downloaded / total * 100, 2)} %",
+                                end="",
+                            )
+                    tChunkRequested = time.perf_counter()
+                    writeTime += tChunkRequested - tChunkReceived
+                if isProgressShown:
+                    print()
+                # drop preallocated space the transfer did not fill, the size check must see the real size
+                _ = f.truncate(downloaded)
+            os.replace(partFile, outDir / filename)
+        except BaseException as e:
+            partFile.unlink(missing_ok=True)
+            if is_out_of_space(e):
+                # a full file system or quota does not clear up on retry, stop like the guard would
+                raise InsufficientDiskSpace.for_failed_write(outDir, expectedSize, e) from e
+            raise
+        finally:
+            if diskGuard is not None:
+                diskGuard.release(outDir, reserved)
+
+    profiling.add_phase_time("transfer", transferTime)
+    profiling.add_phase_time("write", writeTime)
 
-        with open(outDir / filename, "wb") as f:
-            for chunk in response.iter_content(chunk_size=chunkSize):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if isProgressShown:
-                        print(
-                            f"\rDownloading {filename}: {round(downloaded / total * 100, 2)} %",
-                            end="",
-                        )
-            if isProgressShown:
-                print()
+    return downloaded
+
+
+def _isInArchive(path: Path, expectedSize: int) -> bool:
+    """Whether `path` exists with its full size."""
+    try:
+        return path.stat().st_size == expectedSize
+    except FileNotFoundError:
+        return False
 
 
 def dl_file_by_id(
@@ -272,25 +590,133 @@ def dl_file_by_id(
     show_live_progress: bool = True,
     chunk_size: int = DEFAULT_CHUNK_SIZE,
     log_time: bool = False,
+    stats_file: Path | None = None,
+    staging: StagingArea | None = None,
+    url_cache: SignedUrlCache | None = None,
+    hedger: "Hedger | None" = None,
+    throttle: Throttle | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
 ) -> None:
+    """Signs and downloads a single file. With `events` a completion event is published once
+    the file is in the archive, with staging that happens when the staging area commits it.
+    With `claims` the file is claimed for the download, `FileClaimed` is raised if another
+    process is downloading it and the file is skipped if another process completed it.
+    """
     t_file_start: float = time.perf_counter()
-
-    (filename, signedURL, _) = _getRandomAssSignedFileLink(
-        filename=filename, tileName=tile_id, year=year, auth=auth
+    requestedFilename: str = filename
+    t_got_file_link: float = t_file_start
+    downloaded: int = 0
+    checksum: "hashlib._Hash | None" = hashlib.sha256() if events is not None else None
+    claim: FileClaim | None = (
+        claims.claim(target_dir, filename) if claims is not None else None
     )
+    transfer: RunningTransfer = IN_FLIGHT.start()
+
+    try:
+        (filename, signedURL, fileSize) = _getRandomAssSignedFileLink(
+            filename=filename,
+            tileName=tile_id,
+            year=year,
+            auth=auth,
+            url_cache=url_cache,
+            hedger=hedger,
+        )
 
-    t_got_file_link: float = time.perf_counter()
+        t_got_file_link = time.perf_counter()
 
-    _downloadTIFFile(
-        url=signedURL,
-        outDir=target_dir,
-        filename=filename,
-        isProgressShown=show_live_progress,
-        chunkSize=chunk_size,
-    )
+        if claim is not None and _isInArchive(target_dir / filename, fileSize):
+            # completed by another process since the file list was made
+            logger.info(f"Skipping {filename}, it was downloaded by another process")
+            return
+
+        if staging is not None and disk_guard is not None:
+            # the staged file also has to fit into the archive once it is committed
+            disk_guard.check(target_dir, fileSize)
+
+        downloaded = _downloadTIFFile(
+            url=signedURL,
+            outDir=staging.staging_dir if staging is not None else target_dir,
+            filename=filename,
+            isProgressShown=show_live_progress,
+            chunkSize=chunk_size,
+            throttle=throttle,
+            expectedSize=fileSize,
+            diskGuard=disk_guard,
+            checksum=checksum,
+            progress=transfer,
+        )
+
+        if staging is not None:
+            # the staging area releases the claim once the file is in the archive
+            staging.stage(
+                filename=filename,
+                expected_size=fileSize,
+                sha256=checksum.hexdigest() if checksum is not None else None,
+                claim=claim,
+            )
+            claim = None
+    except Exception as e:
+        if url_cache is not None and isinstance(e, requests.exceptions.HTTPError):
+            # the object store rejected the (possibly cached) URL, sign again next time
+            url_cache.invalidate(
+                _signedUrlCacheKey(
+                    filename=requestedFilename, tileName=tile_id, year=year, auth=auth
+                )
+            )
+        if stats_file is not None:
+            t_failed: float = time.perf_counter()
+            append_transfer_stat(
+                stats_file,
+                make_transfer_stat(
+                    tile=tile_id,
+                    year=year,
+                    filename=filename,
+                    # the bytes that arrived before the transfer failed
+                    n_bytes=transfer.bytes,
+                    sign_s=t_got_file_link - t_file_start,
+                    download_s=t_failed - t_got_file_link,
+                    status="error",
+                    error=type(e).__name__,
+                    concurrency=current_concurrency(transfer.peak),
+                ),
+            )
+        raise
+    finally:
+        IN_FLIGHT.finish(transfer)
+        if claim is not None:
+            claim.release()
 
     t_downloaded: float = time.perf_counter()
 
+    if events is not None and checksum is not None and staging is None:
+        from events import CompletionEvent
+
+        events.publish(
+            CompletionEvent.for_file(
+                target_dir / filename,
+                tile=tile_id,
+                year=year,
+                size=downloaded,
+                sha256=checksum.hexdigest(),
+            )
+        )
+
+    if stats_file is not None:
+        append_transfer_stat(
+            stats_file,
+            make_transfer_stat(
+                tile=tile_id,
+                year=year,
+                filename=filename,
+                n_bytes=downloaded,
+                sign_s=t_got_file_link - t_file_start,
+                download_s=t_downloaded - t_got_file_link,
+                concurrency=current_concurrency(transfer.peak),
+            ),
+        )
+
     if log_time:
         logger.info(
             msg=f"Perf FileLink,Download: {(t_got_file_link - t_file_start):.2f}, {(t_downloaded - t_got_file_link):.2f} s"
@@ -307,19 +733,133 @@ def dl_file_list(
     show_live_progress: bool = True,
     chunk_size: int = DEFAULT_CHUNK_SIZE,
     log_time: bool = False,
-) -> None:
-    for _, f in enumerate[str](filename_list):
+    stats_file: Path | None = None,
+    staging: StagingArea | None = None,
+    url_cache: SignedUrlCache | None = None,
+    hedger: "Hedger | None" = None,
+    retry_policy: RetryPolicy | None = None,
+    relogin: Callable[[], AuthData] | None = None,
+    throttle: Throttle | None = None,
+    cancel_event: threading.Event | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
+) -> list[FailedFile]:
+    """Downloads a list of files of a tile and year.
+
+    Without `retry_policy` the first error is raised. With it, failing files are retried with
+    exponential backoff behind the remaining files, a new login is done through `relogin` on
+    auth errors and the files that could not be downloaded are returned.
+    Once `cancel_event` is set no further files are started. Once `disk_guard` rejects a file
+    for lack of space no further files are started either and all remaining files are returned.
+    Files claimed by another process (see `claims`) are skipped.
+    """
+
+    def _download(filename: str, auth: AuthData) -> None:
         dl_file_by_id(
             tile_id=tile_id,
             year=year,
             target_dir=target_dir,
             auth=auth,
-            filename=f,
+            filename=filename,
             show_live_progress=show_live_progress,
             chunk_size=chunk_size,
             log_time=log_time,
+            stats_file=stats_file,
+            staging=staging,
+            url_cache=url_cache,
+            hedger=hedger,
+            throttle=throttle,
+            disk_guard=disk_guard,
+            events=events,
+            claims=claims,
         )
 
+    # files claimed by another process are skipped, nothing is claimed without `claims`
+    claimed: tuple[type[Exception], ...] = ()
+    if claims is not None:
+        from file_claims import FileClaimed
+
+        claimed = (FileClaimed,)
+
+    if retry_policy is None:
+        for _, f in enumerate[str](filename_list):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            try:
+                _download(filename=f, auth=auth)
+            except claimed as e:
+                logger.info(f"Skipping {f}: {str(e)}")
+        return []
+
+    queue: RetryQueue[str] = RetryQueue[str](filename_list)
+    attempts: dict[str, int] = {}
+    failures: list[FailedFile] = []
+
+    while len(queue) > 0:
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info(f"Cancelled, {len(queue)} files of {tile_id} in {year} are left")
+            break
+        f: str = queue.pop()
+        try:
+            _download(filename=f, auth=auth)
+        except claimed as e:
+            logger.info(f"Skipping {f}: {str(e)}")
+        except Exception as e:
+            attempts[f] = attempts.get(f, 0) + 1
+            if isinstance(e, InsufficientDiskSpace):
+                logger.error(f"Stopping downloads of {tile_id} in {year}. Reason: {str(e)}")
+                failures += [
+                    FailedFile(
+                        tile=tile_id,
+                        year=year,
+                        filename=left,
+                        attempts=attempts.get(left, 0),
+                        error_class=ERROR_PERMANENT,
+                        error=str(e),
+                    )
+                    for left in [f, *queue.drain()]
+                ]
+                break
+            error_class: str = classify_error(e)
+            can_retry: bool = attempts[f] < retry_policy.max_attempts
+
+            if error_class == ERROR_AUTH and relogin is not None and can_retry:
+                logger.warning(f"Auth error for {f}, logging in again. Reason: {str(e)}")
+                try:
+                    auth = relogin()
+                    queue.push(f)
+                    continue
+                except Exception as login_error:
+                    # a failed login counts as another failed attempt of the file
+                    e = login_error
+                    attempts[f] += 1
+                    error_class = classify_error(e)
+                    can_retry = attempts[f] < retry_policy.max_attempts
+
+            if error_class != ERROR_PERMANENT and can_retry:
+                delay: float = retry_policy.backoff(attempts[f])
+                logger.warning(
+                    f"Attempt {attempts[f]} for {f} failed ({error_class}), retrying in {delay:.1f} s. Reason: {str(e)}"
+                )
+                queue.push(f, delay=delay)
+            else:
+                logger.error(
+                    f"Giving up on {f} after {attempts[f]} attempts ({error_class}). Reason: {str(e)}"
+                )
+                failures.append(
+                    FailedFile(
+                        tile=tile_id,
+                        year=year,
+                        filename=f,
+                        attempts=attempts[f],
+                        error_class=error_class,
+                        error=str(e),
+                    )
+                )
+
+    return failures
+
 
 def dl_years_for_tile(
     tile_id: str,
@@ -331,17 +871,45 @@ def dl_years_for_tile(
     log_time: bool = True,
     chunkSize: int = DEFAULT_CHUNK_SIZE,
     list_split_chooser: ListSplitChoose | None = None,
-) -> None:
+    stats_file: Path | None = None,
+    staging_root: Path | None = None,
+    url_cache: SignedUrlCache | None = None,
+    hedger: "Hedger | None" = None,
+    retry_policy: RetryPolicy | None = None,
+    relogin: Callable[[], AuthData] | None = None,
+    throttle: Throttle | None = None,
+    disk_guard: DiskSpaceGuard | None = None,
+    events: "EventSink | None" = None,
+    claims: "FileClaims | None" = None,
+) -> list[FailedFile]:
+    failures: list[FailedFile] = []
     for year in years:
         target_dir: Path = root_dir / str(year) / tile_id
         if not target_dir.exists():
             target_dir.mkdir(exist_ok=True, parents=True)
             logger.debug(msg=f"Created folder: {str(target_dir)}")
 
+        staging: StagingArea | None = None
+        if staging_root is not None:
+            staging = StagingArea(
+                staging_root=staging_root,
+                archive_root=root_dir,
+                tile_id=tile_id,
+                year=year,
+                events=events,
+            )
+            staging.open()
+            if dl_index is not None:
+                dl_index.update({f.filename: f.size for f in staging.recovered})
+
         start_acc: float = time.perf_counter()
 
         filenameList: list[str] = get_filenames_for_id(
-            tile_id, year, index=dl_index, list_split_chooser=list_split_chooser
+            tile_id,
+            year,
+            index=dl_index,
+            list_split_chooser=list_split_chooser,
+            hedger=hedger,
         )
         if log_time:
             logger.info(
@@ -352,22 +920,40 @@ def dl_years_for_tile(
             logger.info(
                 f"No files left for {tile_id} in {year} {list_split_chooser}. Ending download...."
             )
-            return
+            if staging is not None:
+                staging.close()
+            return failures
         else:
             logger.info(
                 msg=f"Found {len(filenameList)} files for {tile_id} in year {year}! Starting download..."
             )
 
-        dl_file_list(
-            tile_id=tile_id,
-            year=year,
-            target_dir=target_dir,
-            auth=auth,
-            filename_list=filenameList,
-            show_live_progress=show_live_progress,
-            chunk_size=chunkSize,
-            log_time=log_time,
-        )
+        try:
+            failures += dl_file_list(
+                tile_id=tile_id,
+                year=year,
+                target_dir=target_dir,
+                auth=auth,
+                filename_list=filenameList,
+                show_live_progress=show_live_progress,
+                chunk_size=chunkSize,
+                log_time=log_time,
+                stats_file=stats_file,
+                staging=staging,
+                url_cache=url_cache,
+                hedger=hedger,
+                retry_policy=retry_policy,
+                relogin=relogin,
+                throttle=throttle,
+                disk_guard=disk_guard,
+                events=events,
+                claims=claims,
+            )
+        finally:
+            if staging is not None:
+                staging.close()
+
+    return failures
 
 
 def main() -> None:
@@ -379,22 +965,68 @@ def main() -> None:
     outputDir = args.output_dir
     isProgressShown = args.no_progress
     chunkSize = args.chunk_size
+    statsFile: Path | None = Path(args.stats_file) if args.stats_file else None
+    stagingDir: Path | None = Path(args.staging_dir) if args.staging_dir else None
+    hedger: "Hedger | None" = None
+    if args.hedge_percentile is not None:
+        from hedging import HedgePolicy, Hedger
+
+        hedger = Hedger(HedgePolicy(percentile=args.hedge_percentile))
+    urlCache = SignedUrlCache(
+        cache_file=Path(args.url_cache_file) if args.url_cache_file else None
+    )
 
     if startYear > endYear:
         raise ValueError(
             "Argument '--start-year' must not be larger than '--end-year'!"
         )
 
+    if args.profile:
+        _ = profiling.enable(
+            output_dir=Path(args.profile_dir),
+            name=f"profile_{tileName}_{time.strftime('%Y-%m-%d_%H-%M-%S')}",
+        )
+        # also written when exiting early
+        atexit.register(profiling.finish)
+
+    if os.getenv("S_HTTP_TRACE"):
+        import http_trace
+
+        _ = http_trace.record_from_env(backend=args.backend)
+
     creds: LoginCredentials = loadCredsFromEnv(envFile)
-    authData: AuthData = performLogin(creds)
+    with profiling.phase("login"):
+        authData: AuthData = performLogin(creds)
     outDir = Path(f"{outputDir}/{tileName}")
 
     outDir: Path = Path(f"{outputDir}/{tileName}")
 
     downloadedFileIndex: dict[str, int] = indexAlreadyDownloadedFiles(path=outDir)
 
+    dlYears: Callable[..., list[FailedFile]] = dl_years_for_tile
+    backendArgs: dict[str, Any] = {}
+    networkErrors: tuple[type[BaseException], ...] = (requests.exceptions.RequestException,)
+    if args.backend == "async":
+        import async_dl
+
+        dlYears = async_dl.dl_years_for_tile
+        backendArgs = {"concurrency": args.concurrency}
+        networkErrors = async_dl.network_errors()
+
+    events: "EventSink | None" = None
+    if args.event_sink:
+        from events import sink_from_spec
+
+        events = sink_from_spec(args.event_sink)
+
+    claims: "FileClaims | None" = None
+    if os.getenv("S_FILE_CLAIMS"):
+        from file_claims import claims_from_env
+
+        claims = claims_from_env()
+
     try:
-        dl_years_for_tile(
+        failures: list[FailedFile] = dlYears(
             tile_id=tileName,
             years=list[int](range(startYear, endYear + 1)),
             root_dir=outDir,
@@ -402,12 +1034,47 @@ def main() -> None:
             dl_index=downloadedFileIndex,
             show_live_progress=isProgressShown,
             log_time=chunkSize,
+            stats_file=statsFile,
+            staging_root=stagingDir,
+            url_cache=urlCache,
+            hedger=hedger,
+            retry_policy=RetryPolicy(max_attempts=args.max_attempts),
+            relogin=lambda: performLogin(creds),
+            throttle=NodeTokenBucket(
+                rate_bytes_per_s=args.node_max_mbps * MB,
+                state_file=Path(os.environ["S_NODE_BW_FILE"])
+                if os.getenv("S_NODE_BW_FILE")
+                else None,
+            )
+            if args.node_max_mbps
+            else None,
+            disk_guard=DiskSpaceGuard(
+                min_free_bytes=int(args.min_free_gb * GB),
+                preallocate=args.preallocate,
+                quota_cmd=args.quota_cmd,
+            ),
+            events=events,
+            claims=claims,
+            **backendArgs,
         )
     except RuntimeError as e:
         logger.error(e)
         exit(1)
-    except requests.exceptions.ChunkedEncodingError as e:
-        logger.error(f"Connection reset by server for tile: {tileName}")
+    except networkErrors as e:
+        # e.g. the file list could not be fetched, downloads of single files are retried
+        logger.error(f"Network error for tile {tileName}: {str(e)}")
+        exit(1)
+    finally:
+        if events is not None:
+            events.close()
+        if hedger is not None:
+            hedger.shutdown()
+
+    if failures:
+        logger.error(f"{len(failures)} files of tile {tileName} could not be downloaded!")
+        if args.failed_report:
+            write_failed_report(Path(args.failed_report), failures)
+            logger.info(f"Wrote failed files to {args.failed_report}")
         exit(1)
 
 
@@ -6,14 +6,17 @@ import json
 import subprocess
 from pathlib import Path
 from dotenv import load_dotenv
-import polars as pl
 import argparse
 
-from validate_starcloud_dl import validate_year, GERMAN_TILES
+from tiles import GERMAN_TILES, add_region_arguments, tiles_from_region_args
 
 
-def fetch_missing_tiles(path: Path, year: int) -> list[str]:
-    df = validate_year(path=path, year=year, print_stats=True)
+def fetch_missing_tiles(path: Path, year: int, tiles: list[str] | None = None) -> list[str]:
+    # validation pulls in polars, which is not needed for submitting all tiles
+    import polars as pl
+    from validate_starcloud_dl import validate_year
+
+    df = validate_year(path=path, year=year, print_stats=True, tiles=tiles)
 
     incomplete_tiles: list[str] = (
         df.filter(pl.col("status") != "complete").get_column("tile").unique().to_list()
@@ -22,7 +25,7 @@ def fetch_missing_tiles(path: Path, year: int) -> list[str]:
     return incomplete_tiles
 
 
-def parse_args() -> tuple[list[int], bool]:
+def parse_args() -> tuple[list[int], bool, bool, list[str] | None]:
     parser = argparse.ArgumentParser()
     _ = parser.add_argument(
         "--slurm-years",
@@ -32,7 +35,19 @@ def parse_args() -> tuple[list[int], bool]:
         help="One or more years (e.g. --slurm-years 2024 2025)",
     )
 
-    _ = parser.add_argument("--alltiles", action="store_true")
+    _ = parser.add_argument(
+        "--alltiles",
+        action="store_true",
+        help="Submit all tiles (of the region if given) instead of only the incomplete ones",
+    )
+
+    add_region_arguments(parser)
+
+    _ = parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile every array task, results are written next to the logs",
+    )
 
     args = parser.parse_args()
 
@@ -40,7 +55,11 @@ def parse_args() -> tuple[list[int], bool]:
 
     alltiles: bool = args.alltiles
 
-    return slurm_years, alltiles
+    profile: bool = args.profile
+
+    region_tiles: list[str] | None = tiles_from_region_args(args)
+
+    return slurm_years, alltiles, profile, region_tiles
 
 
 if __name__ == "__main__":
@@ -52,16 +71,19 @@ if __name__ == "__main__":
 
     # --- Load S_TILES and S_YEARS ---
 
-    years, alltiles = parse_args()
+    years, alltiles, profile, region_tiles = parse_args()
+
+    if region_tiles is not None:
+        print(f"Region covers {len(region_tiles)} tiles: {region_tiles}")
 
     tiles: list[str] = []
 
 
     if alltiles:
-        tiles = GERMAN_TILES
+        tiles = region_tiles if region_tiles is not None else GERMAN_TILES
     else:
         for y in years:
-            incomplete_tiles = fetch_missing_tiles(root_dir / str(y), y)
+            incomplete_tiles = fetch_missing_tiles(root_dir / str(y), y, tiles=region_tiles)
 
             unique_tiles = list(set(tiles + incomplete_tiles))
 
@@ -100,7 +122,7 @@ if __name__ == "__main__":
         "sbatch",
         f"--job-name={job_name}",
         f"--array=0-{array_size - 1}%{limit_concurrent}",
-        "--export=ALL",
+        f"--export=ALL,S_PROFILE_DIR={log_base}/profiles" if profile else "--export=ALL",
         f"--output={log_base}/%x-%A_%a.log",
         f"--error={log_base}/%x-%A_%a.error",
         str(bash_wrapper),
@@ -108,6 +130,7 @@ if __name__ == "__main__":
         *[str(y) for y in years],
         "--slurm-tiles",
         f"{json.dumps(tiles)}",
+        *(["--profile"] if profile else []),
     ]
 
     # --- Submit job ---
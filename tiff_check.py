@@ -0,0 +1,203 @@
+import mmap
+import struct
+from pathlib import Path
+
+# value sizes of the TIFF field types in bytes
+_TYPE_SIZES: dict[int, int] = {
+    1: 1,  # BYTE
+    2: 1,  # ASCII
+    3: 2,  # SHORT
+    4: 4,  # LONG
+    5: 8,  # RATIONAL
+    6: 1,  # SBYTE
+    7: 1,  # UNDEFINED
+    8: 2,  # SSHORT
+    9: 4,  # SLONG
+    10: 8,  # SRATIONAL
+    11: 4,  # FLOAT
+    12: 8,  # DOUBLE
+    13: 4,  # IFD
+    16: 8,  # LONG8
+    17: 8,  # SLONG8
+    18: 8,  # IFD8
+}
+
+# integer types that may hold offsets and byte counts
+_INT_FORMATS: dict[int, str] = {3: "H", 4: "I", 13: "I", 16: "Q", 18: "Q"}
+
+TAG_COMPRESSION: int = 259
+TAG_STRIP_OFFSETS: int = 273
+TAG_STRIP_BYTE_COUNTS: int = 279
+TAG_TILE_OFFSETS: int = 324
+TAG_TILE_BYTE_COUNTS: int = 325
+
+COMPRESSION_NONE: int = 1
+
+MAX_IFDS: int = 1024
+
+# number of data blocks per image whose tail bytes are checked for zero fill
+TAIL_SAMPLE_BLOCKS: int = 8
+TAIL_SAMPLE_BYTES: int = 256
+
+
+class TiffStructureError(Exception):
+    pass
+
+
+def check_tiff_structure(path: Path) -> str | None:
+    """Checks the structure of a TIFF/BigTIFF file without reading its image data.
+
+    Validates the header, walks the IFD chain and checks that all strip/tile offsets and byte
+    counts lie inside the file. For compressed images the tail bytes of a sample of data blocks
+    must not be zero filled. Returns a description of the first problem or `None` if the file looks intact.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.seek(0, 2) == 0:
+                return "empty file"
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                _check_buffer(buf)
+    except TiffStructureError as e:
+        return str(e)
+    except (OSError, ValueError, struct.error) as e:
+        return f"unreadable: {e}"
+    return None
+
+
+def _check_buffer(buf: mmap.mmap) -> None:
+    size: int = len(buf)
+    if size < 8:
+        raise TiffStructureError("file too small for a TIFF header")
+
+    byte_order: bytes = buf[0:2]
+    if byte_order == b"II":
+        bo = "<"
+    elif byte_order == b"MM":
+        bo = ">"
+    else:
+        raise TiffStructureError("invalid byte order mark")
+
+    (magic,) = struct.unpack_from(bo + "H", buf, 2)
+    if magic == 42:
+        is_big = False
+        (ifd_offset,) = struct.unpack_from(bo + "I", buf, 4)
+    elif magic == 43:
+        if size < 16:
+            raise TiffStructureError("file too small for a BigTIFF header")
+        is_big = True
+        (ifd_offset,) = struct.unpack_from(bo + "Q", buf, 8)
+    else:
+        raise TiffStructureError(f"invalid TIFF magic number {magic}")
+
+    count_fmt, entry_size, offset_fmt, inline_size = (
+        ("Q", 20, "Q", 8) if is_big else ("H", 12, "I", 4)
+    )
+    count_size: int = struct.calcsize(count_fmt)
+    offset_size: int = struct.calcsize(offset_fmt)
+
+    if ifd_offset == 0:
+        raise TiffStructureError("no image file directory")
+
+    visited: set[int] = set()
+    while ifd_offset != 0:
+        if ifd_offset in visited:
+            raise TiffStructureError(f"IFD chain loops at offset {ifd_offset}")
+        if len(visited) >= MAX_IFDS:
+            raise TiffStructureError("too many IFDs")
+        visited.add(ifd_offset)
+
+        if ifd_offset + count_size > size:
+            raise TiffStructureError(f"IFD offset {ifd_offset} outside of file")
+        (n_entries,) = struct.unpack_from(bo + count_fmt, buf, ifd_offset)
+
+        entries_start: int = ifd_offset + count_size
+        next_ptr: int = entries_start + n_entries * entry_size
+        if next_ptr + offset_size > size:
+            raise TiffStructureError(f"IFD at offset {ifd_offset} is truncated")
+
+        tags: dict[int, list[int]] = {}
+        for i in range(n_entries):
+            entry: int = entries_start + i * entry_size
+            tag, typ = struct.unpack_from(bo + "HH", buf, entry)
+            (count,) = struct.unpack_from(
+                bo + ("Q" if is_big else "I"), buf, entry + 4
+            )
+            value_pos: int = entry + (12 if is_big else 8)
+
+            type_size: int | None = _TYPE_SIZES.get(typ)
+            if type_size is None:
+                # unknown types are allowed by the spec and skipped by readers
+                continue
+            n_bytes: int = type_size * count
+            if n_bytes > inline_size:
+                (value_pos,) = struct.unpack_from(bo + offset_fmt, buf, value_pos)
+                if value_pos + n_bytes > size:
+                    raise TiffStructureError(
+                        f"values of tag {tag} lie outside of the file"
+                    )
+
+            if tag in (
+                TAG_COMPRESSION,
+                TAG_STRIP_OFFSETS,
+                TAG_STRIP_BYTE_COUNTS,
+                TAG_TILE_OFFSETS,
+                TAG_TILE_BYTE_COUNTS,
+            ):
+                fmt: str | None = _INT_FORMATS.get(typ)
+                if fmt is None:
+                    raise TiffStructureError(f"tag {tag} has non integer type {typ}")
+                tags[tag] = list(
+                    struct.unpack_from(f"{bo}{count}{fmt}", buf, value_pos)
+                )
+
+        _check_blocks(buf, tags, ifd_offset)
+
+        (ifd_offset,) = struct.unpack_from(bo + offset_fmt, buf, next_ptr)
+
+
+def _check_blocks(buf: mmap.mmap, tags: dict[int, list[int]], ifd_offset: int) -> None:
+    size: int = len(buf)
+
+    if TAG_TILE_OFFSETS in tags:
+        offsets = tags[TAG_TILE_OFFSETS]
+        byte_counts = tags.get(TAG_TILE_BYTE_COUNTS)
+    elif TAG_STRIP_OFFSETS in tags:
+        offsets = tags[TAG_STRIP_OFFSETS]
+        byte_counts = tags.get(TAG_STRIP_BYTE_COUNTS)
+    else:
+        raise TiffStructureError(f"IFD at offset {ifd_offset} has no image data")
+
+    if byte_counts is None or len(byte_counts) != len(offsets):
+        raise TiffStructureError(
+            f"IFD at offset {ifd_offset} has mismatching offsets and byte counts"
+        )
+
+    for offset, count in zip(offsets, byte_counts):
+        # sparse blocks (offset and count 0) are written by GDAL for empty tiles
+        if count == 0:
+            continue
+        if offset + count > size:
+            raise TiffStructureError(
+                f"data block at offset {offset} with {count} bytes exceeds file size {size}"
+            )
+
+    compression: int = tags.get(TAG_COMPRESSION, [COMPRESSION_NONE])[0]
+    if compression == COMPRESSION_NONE:
+        # uncompressed blocks may legitimately end with zeros (e.g. nodata)
+        return
+
+    blocks = [(o, c) for o, c in zip(offsets, byte_counts) if c > 0]
+    if not blocks:
+        return
+    step: int = max(1, len(blocks) // TAIL_SAMPLE_BLOCKS)
+    sample = blocks[::step][:TAIL_SAMPLE_BLOCKS]
+    # the block ending last is where truncated downloads show up
+    sample.append(max(blocks, key=lambda b: b[0] + b[1]))
+
+    for offset, count in sample:
+        n_tail: int = min(count, TAIL_SAMPLE_BYTES)
+        tail: bytes = buf[offset + count - n_tail : offset + count]
+        if tail.count(0) == n_tail:
+            raise TiffStructureError(
+                f"compressed data block at offset {offset} ends zero filled"
+            )
@@ -0,0 +1,340 @@
+import argparse
+import json
+import math
+from pathlib import Path
+from typing import Any
+
+GERMAN_TILES: list[str] = [
+    "31UFS",
+    "31UFT",
+    "31UGR",
+    "31UGS",
+    "31UGT",
+    "31UGU",
+    "31UGV",
+    "32ULB",
+    "32ULC",
+    "32ULD",
+    "32ULE",
+    "32UME",
+    "32UMF",
+    "32TMT",
+    "32TNT",
+    "32TPT",
+    "32TQT",
+    "32UMA",
+    "32UMU",
+    "32UMV",
+    "32UNA",
+    "32UNB",
+    "32UNC",
+    "32UND",
+    "32UNE",
+    "32UNU",
+    "32UNV",
+    "32UPA",
+    "32UPB",
+    "32UPC",
+    "32UPD",
+    "32UPE",
+    "32UPF",
+    "32UPU",
+    "32UPV",
+    "32UQA",
+    "32UQB",
+    "32UQC",
+    "32UQD",
+    "32UQE",
+    "32UQU",
+    "32UQV",
+    "33UUA",
+    "33UUP",
+    "33UUQ",
+    "33UUR",
+    "33UUS",
+    "33UUT",
+    "33UUU",
+    "33UUV",
+    "33UVA",
+    "33UVS",
+    "33UVT",
+    "33UVU",
+    "33UVV",
+    "31UGQ",
+    "32ULA",
+    "32ULV",
+    "32ULU",
+    "32TLT",
+    "32UMB",
+    "32UMC",
+    "32UMD",
+    "32UNF",
+    "33TUN",
+    "33UVP",
+    "33UVQ",
+]
+
+
+# --- MGRS 100 km grid (tile ids like '32UQB') ---
+
+_WGS84_A: float = 6378137.0
+_WGS84_F: float = 1 / 298.257223563
+_E2: float = _WGS84_F * (2 - _WGS84_F)
+_EP2: float = _E2 / (1 - _E2)
+_K0: float = 0.9996
+
+_LAT_BANDS: str = "CDEFGHJKLMNPQRSTUVWX"
+_COLUMN_LETTERS: list[str] = ["ABCDEFGH", "JKLMNPQR", "STUVWXYZ"]
+_ROW_LETTERS: str = "ABCDEFGHJKLMNPQRSTUV"
+
+# sample spacing when covering a region, well below the 100 km tile size
+DEFAULT_STEP_DEG: float = 0.05
+
+# tiles are 109.8 km wide, overlapping the neighbouring grid squares by 9.8 km (as Sentinel-2 tiles)
+TILE_OVERLAP_M: float = 9_800
+
+# metres per degree of latitude, close enough to find the latitude band of a shifted position
+_M_PER_DEG_LAT: float = 111_320
+
+
+def _utm_zone(lat: float, lon: float) -> int:
+    if 56 <= lat < 64 and 3 <= lon < 12:
+        return 32
+    if 72 <= lat < 84 and 0 <= lon < 42:
+        return 31 if lon < 9 else 33 if lon < 21 else 35 if lon < 33 else 37
+    return min(int((lon + 180) // 6) + 1, 60)
+
+
+def _zone_bounds(zone: int, lat: float) -> tuple[float, float] | None:
+    """Longitudes a UTM zone spans at a latitude, with the Norway and Svalbard exceptions of
+    `_utm_zone`. None where the zone does not exist (32X, 34X and 36X).
+    """
+    west: float = (zone - 1) * 6 - 180
+    east: float = zone * 6 - 180
+    if 56 <= lat < 64:
+        if zone == 31:
+            east = 3
+        elif zone == 32:
+            west = 3
+    elif 72 <= lat < 84 and 31 <= zone <= 37:
+        if zone % 2 == 0:
+            return None
+        west, east = {31: (0, 9), 33: (9, 21), 35: (21, 33), 37: (33, 42)}[zone]
+    return west, east
+
+
+def _to_utm(lat: float, lon: float, zone: int) -> tuple[float, float]:
+    """WGS84 latitude/longitude to UTM easting/northing in the given zone."""
+    phi: float = math.radians(lat)
+    lam0: float = math.radians((zone - 1) * 6 - 180 + 3)
+    sin_phi, cos_phi, tan_phi = math.sin(phi), math.cos(phi), math.tan(phi)
+
+    n: float = _WGS84_A / math.sqrt(1 - _E2 * sin_phi**2)
+    t: float = tan_phi**2
+    c: float = _EP2 * cos_phi**2
+    a: float = cos_phi * (math.radians(lon) - lam0)
+    e4, e6 = _E2**2, _E2**3
+    m: float = _WGS84_A * (
+        (1 - _E2 / 4 - 3 * e4 / 64 - 5 * e6 / 256) * phi
+        - (3 * _E2 / 8 + 3 * e4 / 32 + 45 * e6 / 1024) * math.sin(2 * phi)
+        + (15 * e4 / 256 + 45 * e6 / 1024) * math.sin(4 * phi)
+        - (35 * e6 / 3072) * math.sin(6 * phi)
+    )
+
+    easting: float = 500000 + _K0 * n * (
+        a + (1 - t + c) * a**3 / 6 + (5 - 18 * t + t**2 + 72 * c - 58 * _EP2) * a**5 / 120
+    )
+    northing: float = _K0 * (
+        m
+        + n
+        * tan_phi
+        * (
+            a**2 / 2
+            + (5 - t + 9 * c + 4 * c**2) * a**4 / 24
+            + (61 - 58 * t + t**2 + 600 * c - 330 * _EP2) * a**6 / 720
+        )
+    )
+    if lat < 0:
+        northing += 10_000_000
+    return easting, northing
+
+
+def _grid_square(zone: int, band: str, easting: float, northing: float) -> str | None:
+    column_idx: int = int(easting // 100_000) - 1
+    if not 0 <= column_idx < 8:
+        return None
+    column: str = _COLUMN_LETTERS[(zone - 1) % 3][column_idx]
+    row: str = _ROW_LETTERS[(int(northing // 100_000) + (5 if zone % 2 == 0 else 0)) % 20]
+    return f"{zone:02d}{band}{column}{row}"
+
+
+def _band(lat: float) -> str:
+    if not -80 <= lat <= 84:
+        raise ValueError(f"Latitude {lat} is outside of the UTM area!")
+    return _LAT_BANDS[min(int((lat + 80) // 8), len(_LAT_BANDS) - 1)]
+
+
+def mgrs_tile(lat: float, lon: float) -> str:
+    """MGRS 100 km grid square of a WGS84 position, e.g. '32UQB'. Polar regions (UPS) are not supported."""
+    lon = (lon + 180) % 360 - 180
+    zone: int = _utm_zone(lat, lon)
+    tile: str | None = _grid_square(zone, _band(lat), *_to_utm(lat, lon, zone))
+    assert tile is not None
+    return tile
+
+
+def tiles_at(lat: float, lon: float, overlap_m: float = TILE_OVERLAP_M) -> set[str]:
+    """All tiles whose footprint contains a position.
+
+    A tile covers its 100 km grid square plus `overlap_m` to the east and south, also
+    beyond the edge of its UTM zone, so a position can lie in several tiles.
+    """
+    lon = (lon + 180) % 360 - 180
+    _ = _band(lat)
+    zone: int = _utm_zone(lat, lon)
+    tiles: set[str] = set()
+    # the zones next to a position can be two zones away where the exceptions widen them
+    for z in {(zone + d - 1) % 60 + 1 for d in range(-2, 3)}:
+        easting, northing = _to_utm(lat, lon, z)
+        for n_shift in {0.0, overlap_m}:
+            # the square north of the position may lie in the next latitude band
+            square_lat: float = lat + n_shift / _M_PER_DEG_LAT
+            if square_lat > 84:
+                continue
+            bounds: tuple[float, float] | None = _zone_bounds(z, square_lat)
+            if bounds is None:
+                continue
+            # grid squares only exist where they intersect their zone
+            west_edge, _ = _to_utm(square_lat, bounds[0], z)
+            east_edge, _ = _to_utm(square_lat, bounds[1], z)
+            for e in {easting, easting - overlap_m}:
+                square_west: float = e // 100_000 * 100_000
+                if square_west >= east_edge or square_west + 100_000 <= west_edge:
+                    continue
+                tile: str | None = _grid_square(z, _band(square_lat), e, northing + n_shift)
+                if tile is not None:
+                    tiles.add(tile)
+    return tiles
+
+
+def _frange(start: float, stop: float, step: float) -> list[float]:
+    n: int = max(1, math.ceil((stop - start) / step))
+    return [start + i * (stop - start) / n for i in range(n + 1)]
+
+
+def tiles_in_bbox(
+    min_lon: float, min_lat: float, max_lon: float, max_lat: float, step_deg: float = DEFAULT_STEP_DEG
+) -> list[str]:
+    """All tiles touching a bounding box, found by sampling it every `step_deg` degrees."""
+    return sorted(
+        {
+            tile
+            for lat in _frange(min_lat, max_lat, step_deg)
+            for lon in _frange(min_lon, max_lon, step_deg)
+            for tile in tiles_at(lat, lon)
+        }
+    )
+
+
+Ring = list[tuple[float, float]]
+
+
+def _in_ring(lon: float, lat: float, ring: Ring) -> bool:
+    inside: bool = False
+    j: int = len(ring) - 1
+    for i in range(len(ring)):
+        (xi, yi), (xj, yj) = ring[i], ring[j]
+        if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _polygons(geojson: dict[str, Any]) -> list[list[Ring]]:
+    """Polygons (outer ring followed by holes) of a GeoJSON geometry, feature or feature collection."""
+    kind: str = geojson["type"]
+    if kind == "FeatureCollection":
+        return [p for f in geojson["features"] for p in _polygons(f)]
+    if kind == "Feature":
+        return _polygons(geojson["geometry"])
+    if kind == "GeometryCollection":
+        return [p for g in geojson["geometries"] for p in _polygons(g)]
+    if kind == "Polygon":
+        return [[[(float(x), float(y)) for x, y, *_ in ring] for ring in geojson["coordinates"]]]
+    if kind == "MultiPolygon":
+        return [
+            [[(float(x), float(y)) for x, y, *_ in ring] for ring in polygon]
+            for polygon in geojson["coordinates"]
+        ]
+    raise ValueError(f"Unsupported GeoJSON type '{kind}', only (multi) polygons select tiles!")
+
+
+def tiles_in_geojson(geojson: dict[str, Any], step_deg: float = DEFAULT_STEP_DEG) -> list[str]:
+    """All tiles touching the polygons of a GeoJSON object (WGS84 longitude/latitude).
+    The interior is sampled every `step_deg` degrees, the outlines are sampled at the same spacing.
+    """
+    tiles: set[str] = set()
+    for polygon in _polygons(geojson):
+        outer: Ring = polygon[0]
+        lons, lats = [p[0] for p in outer], [p[1] for p in outer]
+        for lat in _frange(min(lats), max(lats), step_deg):
+            for lon in _frange(min(lons), max(lons), step_deg):
+                if _in_ring(lon, lat, outer) and not any(
+                    _in_ring(lon, lat, hole) for hole in polygon[1:]
+                ):
+                    tiles.update(tiles_at(lat, lon))
+        # thin parts of a region may lie between the samples
+        for (x0, y0), (x1, y1) in zip(outer, outer[1:] + outer[:1]):
+            n: int = max(1, math.ceil(max(abs(x1 - x0), abs(y1 - y0)) / step_deg))
+            for i in range(n + 1):
+                tiles.update(tiles_at(y0 + (y1 - y0) * i / n, x0 + (x1 - x0) * i / n))
+    return sorted(tiles)
+
+
+def parse_bbox(value: str) -> tuple[float, float, float, float]:
+    """Parses 'min_lon,min_lat,max_lon,max_lat'."""
+    parts: list[float] = [float(v) for v in value.split(",")]
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise argparse.ArgumentTypeError(
+            f"Expected 'min_lon,min_lat,max_lon,max_lat', got '{value}'!"
+        )
+    return parts[0], parts[1], parts[2], parts[3]
+
+
+def add_region_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds --bbox and --region to select tiles by area instead of listing them."""
+    group = parser.add_mutually_exclusive_group()
+    _ = group.add_argument(
+        "--bbox",
+        type=parse_bbox,
+        default=None,
+        help="Select the tiles touching this WGS84 bounding box: min_lon,min_lat,max_lon,max_lat",
+    )
+    _ = group.add_argument(
+        "--region",
+        type=str,
+        default=None,
+        help="Select the tiles touching the polygons of this GeoJSON file",
+    )
+
+
+def tiles_from_region_args(args: argparse.Namespace) -> list[str] | None:
+    """Tiles selected by --bbox or --region, None if neither was given."""
+    if args.bbox is not None:
+        return tiles_in_bbox(*args.bbox)
+    if args.region is not None:
+        return tiles_in_geojson(json.loads(Path(args.region).read_text()))
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prints the MGRS tiles of a region as JSON array, e.g. for S_TILES or --slurm-tiles."
+    )
+    add_region_arguments(parser)
+    args = parser.parse_args()
+
+    selected: list[str] | None = tiles_from_region_args(args)
+    if selected is None:
+        parser.error("Pass --bbox or --region!")
+    print(json.dumps(selected))
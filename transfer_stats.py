@@ -0,0 +1,158 @@
+import csv
+import fcntl
+import io
+import os
+import socket
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+
+@dataclass
+class TransferStat:
+    """One row of transfer telemetry, written for every attempted file download."""
+
+    timestamp: float
+    host: str
+    job_id: str
+    concurrency: int
+    tile: str
+    year: int
+    filename: str
+    bytes: int
+    sign_s: float
+    download_s: float
+    status: str
+    error: str = ""
+
+
+STATS_COLUMNS: list[str] = [f.name for f in fields(TransferStat)]
+
+
+class RunningTransfer:
+    def __init__(self, peak: int) -> None:
+        # most transfers of the process running at the same time while this one ran
+        self.peak: int = peak
+        # bytes streamed so far, also known when the transfer fails
+        self.bytes: int = 0
+
+
+class InFlightTransfers:
+    """Tracks the transfers running in this process, across download threads and async tasks."""
+
+    def __init__(self) -> None:
+        self._running: list[RunningTransfer] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def start(self) -> RunningTransfer:
+        with self._lock:
+            transfer = RunningTransfer(peak=len(self._running) + 1)
+            self._running.append(transfer)
+            for other in self._running:
+                other.peak = max(other.peak, len(self._running))
+            return transfer
+
+    def finish(self, transfer: RunningTransfer) -> None:
+        with self._lock:
+            self._running.remove(transfer)
+
+
+IN_FLIGHT: InFlightTransfers = InFlightTransfers()
+
+
+def current_concurrency(in_flight: int | None = None) -> int:
+    """Concurrent transfers: the processes downloading at the same time (S_LIMIT_CONCURRENT,
+    the Slurm array throttle) times `in_flight`, the transfers of this process, by default
+    those running now.
+    """
+    per_process: int = in_flight if in_flight is not None else max(IN_FLIGHT.running, 1)
+    return int(os.getenv("S_LIMIT_CONCURRENT", "1")) * per_process
+
+
+def make_transfer_stat(
+    tile: str,
+    year: int,
+    filename: str,
+    n_bytes: int,
+    sign_s: float,
+    download_s: float,
+    status: str = "ok",
+    error: str = "",
+    concurrency: int | None = None,
+) -> TransferStat:
+    return TransferStat(
+        timestamp=time.time(),
+        host=socket.gethostname(),
+        job_id=os.getenv("SLURM_ARRAY_JOB_ID", os.getenv("SLURM_JOB_ID", "")),
+        concurrency=concurrency if concurrency is not None else current_concurrency(),
+        tile=tile,
+        year=year,
+        filename=filename,
+        bytes=n_bytes,
+        sign_s=round(sign_s, 4),
+        download_s=round(download_s, 4),
+        status=status,
+        error=error,
+    )
+
+
+def append_transfer_stat(stats_file: Path, stat: TransferStat) -> None:
+    """Appends a single telemetry row to a CSV file, writing the header for new files.
+
+    Rows are written with a single `write` on an `O_APPEND` descriptor so concurrent
+    array tasks can share one stats file. Writers that find the file empty take an
+    `flock`, so exactly one of them writes the header.
+    """
+    stats_file.parent.mkdir(parents=True, exist_ok=True)
+
+    row = asdict(stat)
+    buf = io.StringIO()
+    _ = csv.writer(buf, lineterminator="\n").writerow([row[c] for c in STATS_COLUMNS])
+    line: str = buf.getvalue()
+
+    fd = os.open(stats_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size > 0:
+            _ = os.write(fd, line.encode("utf-8"))
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        header: str = ",".join(STATS_COLUMNS) + "\n" if os.fstat(fd).st_size == 0 else ""
+        _ = os.write(fd, (header + line).encode("utf-8"))
+    finally:
+        # closing the descriptor releases the lock
+        os.close(fd)
+
+
+def read_transfer_stats(stats_file: Path) -> list[TransferStat]:
+    """Reads all telemetry rows of a stats file. Malformed rows are skipped."""
+    if not stats_file.exists():
+        return []
+    res: list[TransferStat] = []
+    with open(stats_file, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                res.append(
+                    TransferStat(
+                        timestamp=float(row["timestamp"]),
+                        host=row["host"],
+                        job_id=row["job_id"],
+                        concurrency=int(row["concurrency"]),
+                        tile=row["tile"],
+                        year=int(row["year"]),
+                        filename=row["filename"],
+                        bytes=int(row["bytes"]),
+                        sign_s=float(row["sign_s"]),
+                        download_s=float(row["download_s"]),
+                        status=row["status"],
+                        error=row.get("error") or "",
+                    )
+                )
+            except (KeyError, ValueError, TypeError):
+                continue
+    return res
+
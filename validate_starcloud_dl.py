@@ -1,91 +1,37 @@
 import json
-import select
-
-from pandas._libs import missing
+import os
+import uuid
+from collections.abc import Mapping
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import datetime
 
+from file_index import build_file_index, open_file_index
 from starcloud_dl import getFileListPage, indexAlreadyDownloadedFiles
+from tiff_check import check_tiff_structure
+from tiles import GERMAN_TILES, add_region_arguments, tiles_from_region_args
 from pathlib import Path
 import polars as pl
 
-GERMAN_TILES: list[str] = [
-    "31UFS",
-    "31UFT",
-    "31UGR",
-    "31UGS",
-    "31UGT",
-    "31UGU",
-    "31UGV",
-    "32ULB",
-    "32ULC",
-    "32ULD",
-    "32ULE",
-    "32UME",
-    "32UMF",
-    "32TMT",
-    "32TNT",
-    "32TPT",
-    "32TQT",
-    "32UMA",
-    "32UMU",
-    "32UMV",
-    "32UNA",
-    "32UNB",
-    "32UNC",
-    "32UND",
-    "32UNE",
-    "32UNU",
-    "32UNV",
-    "32UPA",
-    "32UPB",
-    "32UPC",
-    "32UPD",
-    "32UPE",
-    "32UPF",
-    "32UPU",
-    "32UPV",
-    "32UQA",
-    "32UQB",
-    "32UQC",
-    "32UQD",
-    "32UQE",
-    "32UQU",
-    "32UQV",
-    "33UUA",
-    "33UUP",
-    "33UUQ",
-    "33UUR",
-    "33UUS",
-    "33UUT",
-    "33UUU",
-    "33UUV",
-    "33UVA",
-    "33UVS",
-    "33UVT",
-    "33UVU",
-    "33UVV",
-    "31UGQ",
-    "32ULA",
-    "32ULV",
-    "32ULU",
-    "32TLT",
-    "32UMB",
-    "32UMC",
-    "32UMD",
-    "32UNF",
-    "33TUN",
-    "33UVP",
-    "33UVQ",
-]
-
 
 def validate_tile_year(
-    path_year: Path, year: int, tile_id: str, print_stats: bool = True
+    path_year: Path,
+    year: int,
+    tile_id: str,
+    print_stats: bool = True,
+    check_structure: bool = False,
+    file_index: Path | None = None,
 ) -> pl.DataFrame:
-    
-    year_tile_path: Path = path_year / tile_id
+    """Compares the files of a tile and year with the expected file list.
+    With `check_structure` files of the right size are additionally checked for a sound TIFF
+    structure and get the status 'corrupt' if the check fails.
+    With `file_index` the downloaded files are looked up in that index (see file_index.py)
+    instead of listing the tile directory.
+    """
 
+    year_tile_path: Path = path_year / tile_id
 
-    res: list[dict[str, str | int]] = []
+    filenames: list[str] = []
+    statuses: list[str] = []
 
     expected_files_path = year_tile_path / f"expected_files_{year}_{tile_id}.json"
 
@@ -107,27 +53,42 @@ def validate_tile_year(
     }  # pyright: ignore[reportAssignmentType]
 
 
-    is_mapping: dict[str, int] = indexAlreadyDownloadedFiles(path=year_tile_path)
+    is_mapping: Mapping[str, int] = (
+        open_file_index(file_index).tile_year(tile_id, year)
+        if file_index is not None
+        else indexAlreadyDownloadedFiles(path=year_tile_path)
+    )
 
     for filename, fsize in should_mapping.items():
-        tile_response: dict[str, str | int] = {
-            "tile": tile_id,
-            "year": year,
-            "filename": filename,
-        }
-
-        if filename in is_mapping:
-            if is_mapping[filename] == fsize:
-                tile_response["status"] = "complete"
-            else:
-                tile_response["status"] = "incomplete"
+        is_size: int | None = is_mapping.get(filename)
 
+        if is_size is None:
+            status: str = "missing"
+        elif is_size != fsize:
+            status = "incomplete"
         else:
-            tile_response["status"] = "missing"
-
-        res.append(tile_response)
-
-    df: pl.DataFrame = pl.DataFrame(res)
+            problem: str | None = (
+                check_tiff_structure(year_tile_path / filename)
+                if check_structure
+                else None
+            )
+            if problem is None:
+                status = "complete"
+            else:
+                print(f"Corrupt file {year_tile_path / filename}: {problem}")
+                status = "corrupt"
+
+        filenames.append(filename)
+        statuses.append(status)
+
+    df: pl.DataFrame = pl.DataFrame(
+        {
+            "tile": pl.repeat(tile_id, len(filenames), dtype=pl.String, eager=True),
+            "year": pl.repeat(year, len(filenames), dtype=pl.Int64, eager=True),
+            "filename": pl.Series(filenames, dtype=pl.String),
+            "status": pl.Series(statuses, dtype=pl.String),
+        }
+    )
 
     if print_stats:
         print_completeness_percentage(df)
@@ -135,21 +96,60 @@ def validate_tile_year(
     return df
 
 
-def validate_year(path: Path, year: int, print_stats: bool = True) -> pl.DataFrame:
+def validate_year(
+    path: Path,
+    year: int,
+    print_stats: bool = True,
+    check_structure: bool = False,
+    workers: int = 1,
+    tiles: list[str] | None = None,
+    file_index: Path | None = None,
+) -> pl.DataFrame:
+    """Validates `tiles` (default: GERMAN_TILES) of a year. With `workers` > 1 tiles are validated in a process pool.
+    With `file_index` all processes look the files up in that memory-mapped index.
+    """
+    tiles = tiles if tiles is not None else GERMAN_TILES
     index_path: Path = path if str(path).endswith(str(year)) else path / str(year)
 
     res: list[pl.DataFrame] = []
 
-    for tile_id in GERMAN_TILES:
-        try:
-            tile_df: pl.DataFrame = validate_tile_year(
-                path_year=index_path, year=year, tile_id=tile_id, print_stats=print_stats
-            )
-        except Exception as e:
-            print(f"ERROR: Could not validate {year}, {tile_id}. Reason: {str(e)}")
-            continue
-
-        res.append(tile_df)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures: dict[Future[pl.DataFrame], str] = {
+                executor.submit(
+                    validate_tile_year,
+                    path_year=index_path,
+                    year=year,
+                    tile_id=tile_id,
+                    print_stats=print_stats,
+                    check_structure=check_structure,
+                    file_index=file_index,
+                ): tile_id
+                for tile_id in tiles
+            }
+            for future in as_completed(futures):
+                try:
+                    res.append(future.result())
+                except Exception as e:
+                    print(
+                        f"ERROR: Could not validate {year}, {futures[future]}. Reason: {str(e)}"
+                    )
+    else:
+        for tile_id in tiles:
+            try:
+                tile_df: pl.DataFrame = validate_tile_year(
+                    path_year=index_path,
+                    year=year,
+                    tile_id=tile_id,
+                    print_stats=print_stats,
+                    check_structure=check_structure,
+                    file_index=file_index,
+                )
+            except Exception as e:
+                print(f"ERROR: Could not validate {year}, {tile_id}. Reason: {str(e)}")
+                continue
+
+            res.append(tile_df)
 
     df = pl.concat(res)
 
@@ -189,35 +189,185 @@ def print_completeness_percentage(df: pl.DataFrame) -> None:
     )
 
 
+COMPLETENESS_HISTORY_DIR: Path = Path("./completeness_reports/history")
+
+
+def append_completeness_report(
+    df: pl.DataFrame,
+    history_dir: Path = COMPLETENESS_HISTORY_DIR,
+    checked_at: datetime | None = None,
+) -> list[Path]:
+    """Appends a validation result to the Parquet completeness history.
+
+    The history is a hive partitioned dataset '<history_dir>/year=<year>/run=<run>/part-0.parquet'
+    with one row per file status, so it can be queried lazily with `scan_completeness_history`.
+    """
+    if checked_at is None:
+        checked_at = datetime.now()
+    # runs started in the same second, or legacy reports of the same minute, must not share a partition
+    run_id: str = f"{checked_at.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+    written: list[Path] = []
+    for (year,), year_df in df.group_by(["year"]):
+        run_dir: Path = history_dir / f"year={year}" / f"run={run_id}"
+        run_dir.mkdir(parents=True, exist_ok=True)
+
+        target: Path = run_dir / "part-0.parquet"
+        tmp_target: Path = run_dir / "part-0.parquet.tmp"
+
+        year_df.select(["tile", "filename", "status"]).with_columns(
+            pl.lit(checked_at).alias("checked_at")
+        ).write_parquet(tmp_target)
+        # only complete partitions should ever be visible to readers
+        os.replace(tmp_target, target)
+        written.append(target)
+
+    return written
+
+
+def import_legacy_csv_report(
+    csv_file: Path, history_dir: Path = COMPLETENESS_HISTORY_DIR
+) -> list[Path]:
+    """Moves an old 'csdc_dl_completeness_<YYYY-MM-DD_HH-MM>_<years>.csv' report into the Parquet history."""
+    checked_at: datetime = datetime.strptime(
+        "_".join(csv_file.stem.split("_")[3:5]), "%Y-%m-%d_%H-%M"
+    )
+    return append_completeness_report(
+        pl.read_csv(csv_file), history_dir=history_dir, checked_at=checked_at
+    )
+
+
+def scan_completeness_history(
+    history_dir: Path = COMPLETENESS_HISTORY_DIR,
+) -> pl.LazyFrame:
+    """Lazily scans all completeness runs. `year` and `run` are read from the partition path."""
+    return pl.scan_parquet(
+        history_dir / "**" / "*.parquet",
+        hive_partitioning=True,
+        hive_schema={"year": pl.Int64, "run": pl.String},
+    )
+
+
+def latest_status_per_file(history: pl.LazyFrame) -> pl.LazyFrame:
+    """Most recent status of every file that was ever validated."""
+    return history.group_by(["year", "tile", "filename"]).agg(
+        pl.col("status").sort_by("checked_at").last(),
+        pl.col("checked_at").max(),
+    )
+
+
+def progress_over_time(history: pl.LazyFrame) -> pl.LazyFrame:
+    """Fraction of complete files per year for every validation run."""
+    return (
+        history.group_by(["year", "run"])
+        .agg(
+            pl.col("checked_at").first(),
+            pl.len().alias("files"),
+            (pl.col("status") == "complete").sum().alias("complete"),
+        )
+        .with_columns((pl.col("complete") / pl.col("files")).alias("pct"))
+        .sort(["year", "checked_at"])
+    )
+
+
+def progress_per_tile_over_time(history: pl.LazyFrame) -> pl.LazyFrame:
+    """Fraction of complete files per year and tile for every validation run, with the change to the previous run."""
+    return (
+        history.group_by(["year", "tile", "run"])
+        .agg(
+            pl.col("checked_at").first(),
+            pl.len().alias("files"),
+            (pl.col("status") == "complete").sum().alias("complete"),
+        )
+        .with_columns((pl.col("complete") / pl.col("files")).alias("pct"))
+        .sort(["year", "tile", "checked_at"])
+        .with_columns(pl.col("pct").diff().over(["year", "tile"]).alias("pct_change"))
+    )
+
+
+def stuck_files(history: pl.LazyFrame, min_runs: int = 3) -> pl.LazyFrame:
+    """Files that were not complete in any of the last `min_runs` runs of their year."""
+    last_runs = (
+        history.select(["year", "run", "checked_at"])
+        .unique()
+        .with_columns(
+            pl.col("checked_at")
+            .rank(method="dense", descending=True)
+            .over("year")
+            .alias("run_rank")
+        )
+        .filter(pl.col("run_rank") <= min_runs)
+        .select(["year", "run"])
+    )
+    return (
+        history.join(last_runs, on=["year", "run"], how="inner")
+        .group_by(["year", "tile", "filename"])
+        .agg(
+            pl.len().alias("runs"),
+            (pl.col("status") == "complete").any().alias("was_complete"),
+            pl.col("status").sort_by("checked_at").last(),
+        )
+        .filter((pl.col("runs") >= min_runs) & ~pl.col("was_complete"))
+        .drop("was_complete")
+    )
+
+
 if __name__ == "__main__":
-    import sys
-    from datetime import datetime
+    import argparse
 
-    root_dir: Path = Path(sys.argv[1])
-    time_str: str = datetime.now().strftime(format="%Y-%m-%d_%H-%M")
+    parser = argparse.ArgumentParser(
+        description="Checks the archive for missing and incomplete files and appends the result to the completeness history."
+    )
+    _ = parser.add_argument("root_dir", type=str, help="Archive root directory")
+    _ = parser.add_argument("years", type=int, nargs="+", help="Years to check")
+    _ = parser.add_argument(
+        "--structural",
+        action="store_true",
+        help="Additionally check the TIFF structure (header, IFDs, data block offsets) of files with the right size",
+    )
+    _ = parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes validating tiles in parallel",
+    )
+    _ = parser.add_argument(
+        "--file-index",
+        type=str,
+        default=os.getenv("S_FILE_INDEX"),
+        help="Rescan the checked years into the compact file index at this path, keeping the other years, and validate against it (default S_FILE_INDEX)",
+    )
+    add_region_arguments(parser)
+    args = parser.parse_args()
 
-    years_to_check: list[int] = [int(y) for y in sys.argv[2:]]
+    root_dir: Path = Path(args.root_dir)
+
+    years_to_check: list[int] = args.years
+
+    file_index: Path | None = Path(args.file_index) if args.file_index else None
+    if file_index is not None:
+        n_files: int = len(build_file_index(root_dir, file_index, years=years_to_check))
+        print(f"Indexed {n_files} files in {file_index}")
 
     dfs: list[pl.DataFrame] = []
 
     for year in years_to_check:
-        df = validate_year(path=root_dir, year=year, print_stats=True)
+        df = validate_year(
+            path=root_dir,
+            year=year,
+            print_stats=True,
+            check_structure=args.structural,
+            workers=args.workers,
+            tiles=tiles_from_region_args(args),
+            file_index=file_index,
+        )
 
         dfs.append(df)
 
     final_df = pl.concat(dfs)
 
-    report_dir = Path("./completeness_reports")
-
-    if not report_dir.exists():
-        report_dir.mkdir()
-
-    file_name  = report_dir / (
-        f"csdc_dl_completeness_{time_str}_{'_'.join(map(str, years_to_check))}.csv"
-    )
-
-    print(f"Writing completness report to {file_name}")
-    final_df.write_csv(file_name)
+    print(f"Appending completeness report to {COMPLETENESS_HISTORY_DIR}")
+    _ = append_completeness_report(final_df, history_dir=COMPLETENESS_HISTORY_DIR)
 
     if len(years_to_check) == 1:
         incomplete_tiles: list[str] = (